@@ -0,0 +1,441 @@
+#!/usr/bin/env python
+
+import numpy
+import data_objects
+from data_objects import BusinessTfidfIndex, reviewRank
+from instrumentation import instruments
+from feature_registry import needsInput, TFIDF
+
+# per-review values summed per group; stars is also summed squared as starsSquared
+SUM_FIELDS = ['stars', 'starsSquared', 'funny', 'useful', 'cool', 'ncharacters', 'nwords', 'nsentences', 'nsyllables', 'npolysyllables']
+CATEGORY_BITS = 32 # user code and category are packed into one int64 key for per-(user, category) counts
+
+class GroupAggregates(object):
+    def __init__(self, ngroups=0):
+        # count, sums, smallest age, number of reviews with the smallest age and smallest larger age, per group code;
+        # enough to derive every group statistic with any one review left out
+        self.count = numpy.zeros(ngroups)
+        self.sums = dict((field, numpy.zeros(ngroups)) for field in SUM_FIELDS)
+        self.minAge = numpy.zeros(ngroups) + numpy.inf
+        self.minAgeCount = numpy.zeros(ngroups)
+        self.secondMinAge = numpy.zeros(ngroups) + numpy.inf
+
+    def __len__(self):
+        return len(self.count)
+
+    def resize(self, ngroups):
+        extra = ngroups - len(self)
+        if extra <= 0:
+            return
+        self.count = numpy.concatenate([self.count, numpy.zeros(extra)])
+        for field in SUM_FIELDS:
+            self.sums[field] = numpy.concatenate([self.sums[field], numpy.zeros(extra)])
+        self.minAge = numpy.concatenate([self.minAge, numpy.zeros(extra) + numpy.inf])
+        self.minAgeCount = numpy.concatenate([self.minAgeCount, numpy.zeros(extra)])
+        self.secondMinAge = numpy.concatenate([self.secondMinAge, numpy.zeros(extra) + numpy.inf])
+
+    def add(self, codes, values):
+        # codes is the group code of each review; values is field -> per-review array for SUM_FIELDS and age. Only the
+        # range of codes given is touched, so adding reviews a few groups at a time (see group_runs) stays linear.
+        if len(codes) == 0:
+            return
+        (first, end) = (codes.min(), codes.max() + 1)
+        self.resize(end)
+        n = end - first
+        codes = codes - first
+        self.count[first:end] += numpy.bincount(codes, minlength=n)
+        for field in SUM_FIELDS:
+            self.sums[field][first:end] += numpy.bincount(codes, weights=values[field], minlength=n)
+
+        # smallest, count of smallest and second smallest age of the new reviews ...
+        ages = numpy.asarray(values['age'], dtype=float)
+        minAge = numpy.zeros(n) + numpy.inf
+        numpy.minimum.at(minAge, codes, ages)
+        isMin = ages == minAge[codes]
+        minAgeCount = numpy.bincount(codes[isMin], minlength=n).astype(float)
+        secondMinAge = numpy.zeros(n) + numpy.inf
+        numpy.minimum.at(secondMinAge, codes[~isMin], ages[~isMin])
+        self.mergeAges(minAge, minAgeCount, secondMinAge, slice(first, end))
+
+    def mergeAges(self, minAge, minAgeCount, secondMinAge, groups=slice(None)):
+        # merges the smallest, count of smallest and second smallest ages of more reviews into the given groups
+        (oldMinAge, oldMinAgeCount, oldSecondMinAge) = (self.minAge[groups], self.minAgeCount[groups], self.secondMinAge[groups])
+        newMinAge = numpy.minimum(oldMinAge, minAge)
+        newMinAgeCount = numpy.where(oldMinAge == newMinAge, oldMinAgeCount, 0) + numpy.where(minAge == newMinAge, minAgeCount, 0)
+        candidates = numpy.vstack([oldMinAge, oldSecondMinAge, minAge, secondMinAge])
+        candidates[candidates <= newMinAge] = numpy.inf
+        self.secondMinAge[groups] = candidates.min(axis=0)
+        self.minAge[groups] = newMinAge
+        self.minAgeCount[groups] = newMinAgeCount
+
+    def merge(self, other, codes):
+        # adds the aggregates of other, whose group i is this one's group codes[i]; codes are distinct
+        if len(codes) == 0:
+            return
+        self.resize(codes.max() + 1)
+        n = len(self)
+        self.count[codes] += other.count
+        for field in SUM_FIELDS:
+            self.sums[field][codes] += other.sums[field]
+        (minAge, minAgeCount, secondMinAge) = (numpy.zeros(n) + numpy.inf, numpy.zeros(n), numpy.zeros(n) + numpy.inf)
+        minAge[codes] = other.minAge
+        minAgeCount[codes] = other.minAgeCount
+        secondMinAge[codes] = other.secondMinAge
+        self.mergeAges(minAge, minAgeCount, secondMinAge)
+
+    def leaveOneOut(self, codes, values, included):
+        # count, sums and earliest age of each review's group with the review itself removed where included
+        if len(codes) > 0:
+            self.resize(codes.max() + 1)
+        own = numpy.asarray(included, dtype=float)
+        count = self.count[codes] - own
+        sums = dict((field, self.sums[field][codes] - own * values[field]) for field in SUM_FIELDS)
+        ages = numpy.asarray(values['age'], dtype=float)
+        minAge = self.minAge[codes]
+        removesMin = (own > 0) & (ages == minAge) & (self.minAgeCount[codes] == 1)
+        earliest = numpy.where(removesMin, self.secondMinAge[codes], minAge)
+        earliest[count <= 0] = numpy.nan
+        return (count, sums, earliest)
+
+class PairCounts(object):
+    # counts keyed by int64 pair keys, kept sorted for vectorized lookup
+    def __init__(self):
+        self.keys = numpy.zeros(0, dtype=numpy.int64)
+        self.counts = numpy.zeros(0)
+
+    def add(self, keys, counts=None):
+        keys = numpy.asarray(keys, dtype=numpy.int64)
+        counts = numpy.ones(len(keys)) if counts is None else numpy.asarray(counts, dtype=float)
+        (self.keys, inverse) = numpy.unique(numpy.concatenate([self.keys, keys]), return_inverse=True)
+        self.counts = numpy.bincount(inverse, weights=numpy.concatenate([self.counts, counts]), minlength=len(self.keys))
+
+    def lookup(self, keys):
+        if len(self.keys) == 0:
+            return numpy.zeros(len(keys))
+        i = numpy.minimum(numpy.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return numpy.where(self.keys[i] == keys, self.counts[i], 0)
+
+def pairKeys(userCodes, categories):
+    return (numpy.asarray(userCodes, dtype=numpy.int64) << CATEGORY_BITS) | numpy.asarray(categories, dtype=numpy.int64)
+
+class ReviewAggregates(object):
+    def __init__(self, nusers=0, nbusinesses=0, termStatistics=False):
+        # user, business and user/category aggregates over a set of reviews; user aggregates only count reviews
+        # with votes, as ReviewFeatures does for its user samples. With termStatistics, per-business tf-idf
+        # statistics (a BusinessTfidfIndex without rows, by business code) are kept as well.
+        self.users = GroupAggregates(nusers)
+        self.businesses = GroupAggregates(nbusinesses)
+        self.userCategories = PairCounts()
+        self.businessTerms = { } if termStatistics else None
+
+    def add(self, columns, rows=None, terms=None, reviewIds=None):
+        # add the given rows (default all) of review columns, as built by review_store.ReviewStoreBuilder; the
+        # review ids are needed for the tf-idf statistics of a --similarity-sample
+        if rows is None:
+            rows = numpy.arange(len(columns['userCode']))
+        values = sampleValues(columns, rows)
+        userSamples = columns['hasVotes'][rows] == 1
+        self.users.add(columns['userCode'][rows][userSamples], dict((field, v[userSamples]) for field, v in values.iteritems()))
+        self.businesses.add(columns['businessCode'][rows], values)
+        self.userCategories.add(pairKeys(columns['userCode'][rows][userSamples], columns['category'][rows][userSamples]))
+        self.addTerms(columns, rows, terms, reviewIds)
+
+    def addTerms(self, columns, rows=None, terms=None, reviewIds=None):
+        # adds only the tf-idf statistics of the given rows, for reviews whose other aggregates come from group_runs
+        if self.businessTerms is not None:
+            if rows is None:
+                rows = numpy.arange(len(columns['userCode']))
+            sampled = data_objects.similaritySampleSize is not None
+            for i in rows:
+                code = columns['businessCode'][i]
+                if code not in self.businessTerms:
+                    self.businessTerms[code] = BusinessTfidfIndex(keepRows=False)
+                if sampled:
+                    self.businessTerms[code].addSampled(reviewRank(reviewIds[i]), terms[i])
+                else:
+                    self.businessTerms[code].addReview(None, terms[i])
+
+    def mergeUsers(self, other, userCodes):
+        # adds the user and user/category aggregates of other, whose user i is this one's user userCodes[i]
+        self.users.merge(other.users, userCodes[:len(other.users)])
+        keys = other.userCategories.keys
+        self.userCategories.add(pairKeys(userCodes[keys >> CATEGORY_BITS], keys & ((1 << CATEGORY_BITS) - 1)), other.userCategories.counts)
+
+    def featureColumns(self, reviews, userProfiles, businessProfiles, included):
+        # reviewFeatureColumns for review columns; included tells whether the reviews were added to these aggregates
+        reviews = dict(reviews)
+        reviews['inUserAggregates'] = ((reviews['hasVotes'] == 1) & included).astype(float)
+        reviews['inBusinessAggregates'] = (numpy.ones(len(reviews['hasVotes']), dtype=bool) & included).astype(float)
+        return reviewFeatureColumns(reviews, self, userProfiles, businessProfiles)
+
+    def similarities(self, businessCodes, terms, included, reviewIds=None):
+        # similarityToOtherReviews from the per-business term statistics, NaN where there is none; of a sampled
+        # business, an included review is only left out if it is in the sample, which its review id tells
+        similarities = numpy.zeros(len(businessCodes)) + numpy.nan
+        for j in xrange(len(businessCodes)):
+            businessTerms = self.businessTerms.get(businessCodes[j])
+            if businessTerms is not None:
+                member = included and (businessTerms.sample is None or businessTerms.sampled(reviewRank(reviewIds[j])))
+                similarity = businessTerms.similarityOf(terms[j], member=member)
+                if similarity is not None:
+                    similarities[j] = similarity
+        return similarities
+
+class TimeIndex(object):
+    # entries of (int64 key, day number, values) sorted by key and day, with running sums of the values, so that
+    # the count and sums of each key's entries up to any day are a binary search away
+    def __init__(self, keys, days, values=None):
+        order = numpy.lexsort((days, keys))
+        self.order = order
+        self.keys = numpy.asarray(keys, dtype=numpy.int64)[order]
+        self.days = numpy.asarray(days, dtype=numpy.int64)[order]
+        self.starts = numpy.flatnonzero(numpy.concatenate([[True], self.keys[1:] != self.keys[:-1]])) if len(order) > 0 \
+                      else numpy.zeros(0, dtype=numpy.int64)
+        self.ends = numpy.append(self.starts[1:], len(order))
+        self.uniqueKeys = self.keys[self.starts]
+        self.sums = dict((field, numpy.concatenate([[0.0], numpy.cumsum(v[order])])) for field, v in (values or { }).iteritems())
+
+        # entries are searched by (key rank, day rank) packed into one int64
+        self.uniqueDays = numpy.unique(self.days)
+        self.span = len(self.uniqueDays) + 1
+        keyRanks = numpy.repeat(numpy.arange(len(self.starts)), self.ends - self.starts)
+        self.packed = keyRanks * self.span + numpy.searchsorted(self.uniqueDays, self.days)
+
+    def positions(self, day, side='right'):
+        # end of each key's entries up to day; with side='left', start of its entries on day. day is a scalar or
+        # one day per key
+        dayRanks = numpy.searchsorted(self.uniqueDays, day, side=side) - (1 if side == 'right' else 0)
+        return numpy.searchsorted(self.packed, numpy.arange(len(self.starts)) * self.span + dayRanks, side=side)
+
+    def groupAggregates(self, day, ngroups):
+        # GroupAggregates of the entries up to day, keys being group codes; ages are counted to day
+        aggregates = GroupAggregates(ngroups)
+        if len(self.starts) == 0:
+            return aggregates
+        positions = self.positions(day)
+        codes = self.uniqueKeys
+        aggregates.count[codes] = positions - self.starts
+        for field in SUM_FIELDS:
+            aggregates.sums[field][codes] = self.sums[field][positions] - self.sums[field][self.starts]
+        # the smallest age is that of the latest entry up to day, the second smallest that of the entry before
+        # the latest day's entries
+        included = positions > self.starts
+        lastDay = self.days[numpy.maximum(positions - 1, 0)]
+        lastDayStarts = self.positions(lastDay, side='left')
+        aggregates.minAge[codes[included]] = day - lastDay[included]
+        aggregates.minAgeCount[codes[included]] = (positions - lastDayStarts)[included]
+        second = included & (lastDayStarts > self.starts)
+        aggregates.secondMinAge[codes[second]] = day - self.days[lastDayStarts[second] - 1]
+        return aggregates
+
+    def pairCounts(self, day):
+        # PairCounts of the entries up to day
+        counts = PairCounts()
+        counts.keys = self.uniqueKeys
+        counts.counts = (self.positions(day) - self.starts).astype(float)
+        return counts
+
+class TimedReviewAggregates(object):
+    # the user, business and user/category aggregates of a set of reviews as of any day, from time indexes built
+    # once; day is a date.toordinal() number and days the one of each review
+    def __init__(self, columns, rows, days, nusers, nbusinesses):
+        values = sampleValues(columns, rows)
+        del values['age']
+        userSamples = columns['hasVotes'][rows] == 1
+        userRows = rows[userSamples]
+        self.users = TimeIndex(columns['userCode'][userRows], days[userRows], dict((field, v[userSamples]) for field, v in values.iteritems()))
+        self.businesses = TimeIndex(columns['businessCode'][rows], days[rows], values)
+        self.userCategories = TimeIndex(pairKeys(columns['userCode'][userRows], columns['category'][userRows]), days[userRows])
+        self.businessRows = rows[self.businesses.order] # rows by business, in date order
+        self.nusers = nusers
+        self.nbusinesses = nbusinesses
+        self.tfidfIndexes = { } # business code -> (reviews indexed, BusinessTfidfIndex of its earliest reviews)
+
+    def asOf(self, day):
+        aggregates = ReviewAggregates()
+        aggregates.users = self.users.groupAggregates(day, self.nusers)
+        aggregates.businesses = self.businesses.groupAggregates(day, self.nbusinesses)
+        aggregates.userCategories = self.userCategories.pairCounts(day)
+        return aggregates
+
+    def similarities(self, day, rows, businessCodes, terms, reviewIds):
+        # similarityToOtherReviews as of day of the given rows (NaN where there is none), from per-business tf-idf
+        # indexes over the reviews up to day; an index is only rebuilt for businesses with reviews since the previous
+        # day asked for
+        positions = self.businesses.positions(day)
+        groups = dict((code, k) for k, code in enumerate(self.businesses.uniqueKeys))
+        similarities = numpy.zeros(len(rows)) + numpy.nan
+        order = numpy.argsort(businessCodes, kind='mergesort')
+        starts = numpy.flatnonzero(numpy.diff(numpy.concatenate([[-1], businessCodes[order]])))
+        for group in numpy.split(order, starts[1:]):
+            if len(group) == 0:
+                continue
+            k = groups[businessCodes[group[0]]]
+            (nindexed, tfidfIndex) = self.tfidfIndexes.get(k, (0, None))
+            if nindexed != positions[k] - self.businesses.starts[k]:
+                businessRows = self.businessRows[self.businesses.starts[k]:positions[k]]
+                tfidfIndex = BusinessTfidfIndex.fromReviews(businessRows, [terms[i] for i in businessRows], \
+                                                            [reviewIds[i] for i in businessRows])
+                self.tfidfIndexes[k] = (len(businessRows), tfidfIndex)
+            similarities[group] = tfidfIndex.similaritiesFor(rows[group])
+        return similarities
+
+def sampleValues(columns, rows):
+    # field -> per-review array of the values GroupAggregates accumulates, for the given rows of review columns
+    values = dict((field, numpy.asarray(columns[field][rows], dtype=float)) for field in SUM_FIELDS if field in columns)
+    values['starsSquared'] = values['stars']**2
+    values['age'] = numpy.asarray(columns['age'][rows], dtype=float)
+    return values
+
+def readability(ncharacters, nwords, nsentences, nsyllables, npolysyllables):
+    # ARI, FK and SMOG of summed text statistics, NaN where there are no words or sentences
+    valid = (nwords > 0) & (nsentences > 0)
+    words = numpy.where(valid, nwords, 1.0)
+    sentences = numpy.where(valid, nsentences, 1.0)
+    ari = numpy.where(valid, 4.71*(ncharacters/words) + .5*(words/sentences) - 21.43, numpy.nan)
+    fk = numpy.where(valid, 0.39*(words/sentences) + 11.8*(nsyllables/words) - 15.59, numpy.nan)
+    smog = numpy.where(valid, 1.0430*numpy.sqrt(npolysyllables*(30.0/sentences)) + 3.1291, numpy.nan)
+    return (ari, fk, smog)
+
+def starsSd(count, sums):
+    # standard deviation of the sampled stars, NaN unless there are at least two samples
+    n = numpy.where(count > 1, count, 1.0)
+    variance = numpy.maximum(sums['starsSquared']/n - (sums['stars']/n)**2, 0.0)
+    return numpy.where(count > 1, numpy.sqrt(variance), numpy.nan)
+
+def reviewFeatureColumns(reviews, aggregates, userProfiles, businessProfiles):
+    # ReviewFeatures columns for a batch of reviews, computed at once from ReviewAggregates with each review's own
+    # contribution left out. reviews is name -> per-review array holding userCode, businessCode, category, age,
+    # hasVotes, votes, stars and ReviewText counts, plus inUserAggregates/inBusinessAggregates flags telling whether
+    # the review was added to the aggregates. Returns header name -> float array with NaN for 'NA', or for the
+    # feature's integer default (see feature_registry.INTEGER_DEFAULTS); the id and similarityToOtherReviews columns
+    # are left to the caller.
+    nan = numpy.nan
+    columns = { }
+    userCodes = reviews['userCode']
+    businessCodes = reviews['businessCode']
+    values = sampleValues(reviews, slice(None))
+    (nu, userSums, earliestUser) = aggregates.users.leaveOneOut(userCodes, values, reviews['inUserAggregates'])
+    (nb, businessSums, earliestBusiness) = aggregates.businesses.leaveOneOut(businessCodes, values, reviews['inBusinessAggregates'])
+    nuCategory = aggregates.userCategories.lookup(pairKeys(userCodes, reviews['category'])) - reviews['inUserAggregates']
+
+    userPublic = userProfiles['hasProfile'][userCodes]
+    userVotes = userPublic & userProfiles['hasVotes'][userCodes]
+    businessPublic = businessProfiles['hasProfile'][businessCodes]
+    userReviewCount = userProfiles['reviewCount'][userCodes].astype(float)
+    stars = values['stars']
+    hasVotes = reviews['hasVotes'] == 1
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        # target and user/business profile/review availability
+        columns['logUsefulVotes'] = numpy.where(hasVotes, numpy.log(numpy.where(hasVotes, values['useful'], 0) + 1), nan)
+        columns['userIsPublic'] = userPublic.astype(float)
+        columns['userHasVotes'] = userVotes.astype(float)
+        columns['userHasManySampleReviews'] = (nu >= 5).astype(float)
+        columns['businessHasProfile'] = businessPublic.astype(float)
+        columns['businessHasManyReviews'] = (businessPublic & (businessProfiles['reviewCount'][businessCodes] >= 15)).astype(float)
+        columns['businessHasManySampleReviews'] = (nb >= 5).astype(float)
+
+        # user/business review count
+        columns['numUserReviews'] = numpy.where(userPublic, userReviewCount, nan)
+        columns['numUserSampleReviews'] = nu
+        columns['numBusinessReviews'] = numpy.where(businessPublic, businessProfiles['reviewCount'][businessCodes], nan)
+        columns['numBusinessSampleReviews'] = nb
+        columns['numUserSampleReviewsInCategory'] = nuCategory
+
+        # stars, stars distribution
+        meanUserStars = numpy.where(userPublic, userProfiles['averageStars'][userCodes], \
+                                    numpy.where(nu > 0, userSums['stars']/nu, nan))
+        meanBusinessStars = numpy.where(businessPublic, businessProfiles['stars'][businessCodes], \
+                                        numpy.where(nb > 0, businessSums['stars']/nb, nan))
+        columns['reviewStars'] = stars
+        columns['reviewIsModerate'] = (stars == 3).astype(float)
+        columns['userStarsSd'] = starsSd(nu, userSums)
+        columns['reviewVsUserAvg'] = stars - meanUserStars
+        columns['reviewVsUserAvgNormalized'] = numpy.where((nu > 1) & (columns['userStarsSd'] > 0), \
+                                                           columns['reviewVsUserAvg']/columns['userStarsSd'], nan)
+        columns['businessStarsSd'] = starsSd(nb, businessSums)
+        columns['reviewVsBusinessAvg'] = stars - meanBusinessStars
+        columns['reviewVsBusinessAvgNormalized'] = numpy.where((nb > 1) & (columns['businessStarsSd'] > 0), \
+                                                               columns['reviewVsBusinessAvg']/columns['businessStarsSd'], nan)
+
+        # review age and text attributes
+        words = reviews['nwords'].astype(float)
+        sentences = reviews['nsentences'].astype(float)
+        columns['reviewAge'] = values['age']
+        columns['reviewCharacters'] = reviews['ncharacters'].astype(float)
+        columns['reviewWords'] = words
+        columns['reviewSentences'] = sentences
+        columns['reviewWordsPerSentence'] = numpy.where(sentences > 0, words/sentences, nan)
+        columns['reviewPunctuationPerSentence'] = numpy.where(sentences > 0, reviews['npunctuation']/sentences, nan)
+        columns['reviewContainsClosed'] = reviews['containsClosed'].astype(float)
+        columns['reviewAdjectivesAndAdverbs'] = reviews['nadjadv'].astype(float)
+        columns['reviewVerbs'] = reviews['nverbs'].astype(float)
+        columns['reviewNouns'] = reviews['nnouns'].astype(float)
+        columns['reviewAdjectivesAndAdverbsPerWord'] = numpy.where(words > 0, reviews['nadjadv']/words, nan)
+        columns['reviewVerbsPerWord'] = numpy.where(words > 0, reviews['nverbs']/words, nan)
+        columns['reviewNounsPerWord'] = numpy.where(words > 0, reviews['nnouns']/words, nan)
+        analyzed = (words > 0) & (sentences > 0)
+        columns['reviewARI'] = numpy.where(analyzed, reviews['ari'], nan)
+        columns['reviewFK'] = numpy.where(analyzed, reviews['fk'], nan)
+        columns['reviewSMOG'] = numpy.where(analyzed, reviews['smog'], nan)
+
+        # user attributes; see ReviewFeatures for which vote features each kind of user gets
+        columns['earliestReview'] = earliestUser
+        profileVotes = userVotes
+        profileVotesPerDay = userVotes & (nu > 1)
+        sampleVotes = (userVotes & (nu > 1)) | (~userVotes & (nu > 0))
+        for vote in ['funny', 'useful', 'cool']:
+            perReview = numpy.where(profileVotes, userProfiles[vote][userCodes]/userReviewCount, nan)
+            columns[vote + 'ProfileVotesPerReview'] = perReview
+            columns[vote + 'ProfileVotesPerReviewPerDay'] = numpy.where(profileVotesPerDay, perReview/earliestUser, nan)
+            perReview = numpy.where(sampleVotes, userSums[vote]/nu, nan)
+            columns[vote + 'VotesPerReview'] = perReview
+            columns[vote + 'VotesPerReviewPerDay'] = numpy.where(sampleVotes, perReview/earliestUser, nan)
+        columns['userCharactersPerReview'] = numpy.where(nu > 0, userSums['ncharacters']/nu, nan)
+        (ari, fk, smog) = readability(userSums['ncharacters'], userSums['nwords'], userSums['nsentences'], \
+                                      userSums['nsyllables'], userSums['npolysyllables'])
+        columns['userARI'] = numpy.where(nu > 0, ari, nan)
+        columns['userFK'] = numpy.where(nu > 0, fk, nan)
+        columns['userSMOG'] = numpy.where(nu > 0, smog, nan)
+
+        # business attributes
+        columns['businessClosed'] = numpy.where(businessPublic, businessProfiles['closed'][businessCodes], 0).astype(float)
+        columns['earliestBusinessReview'] = earliestBusiness
+        columns['businessCharactersPerReview'] = numpy.where(nb > 0, businessSums['ncharacters']/nb, nan)
+        (ari, fk, smog) = readability(businessSums['ncharacters'], businessSums['nwords'], businessSums['nsentences'], \
+                                      businessSums['nsyllables'], businessSums['npolysyllables'])
+        columns['businessARI'] = numpy.where(nb > 0, ari, nan)
+        columns['businessFK'] = numpy.where(nb > 0, fk, nan)
+        columns['businessSMOG'] = numpy.where(nb > 0, smog, nan)
+        columns['category'] = reviews['category'].astype(float)
+
+    return columns
+
+def viewSimilarities(view, rows):
+    # similarityToOtherReviews for the given rows of a ReviewStoreView, from one tf-idf index per business; NaN where
+    # there is none
+    businessCodes = view.store.columns['businessCode'][rows]
+    similarities = numpy.zeros(len(rows)) + numpy.nan
+    order = numpy.argsort(businessCodes, kind='mergesort')
+    starts = numpy.flatnonzero(numpy.diff(numpy.concatenate([[-1], businessCodes[order]])))
+    for group in numpy.split(order, starts[1:]):
+        if len(group) == 0:
+            continue
+        tfidfIndex = view.businessTfidfIndex(businessCodes[group[0]])
+        similarities[group] = tfidfIndex.similaritiesFor(rows[group])
+    return similarities
+
+def viewFeatureColumns(view, rows):
+    # ReviewFeatures columns for the given rows of a ReviewStoreView, all computed at once
+    store = view.store
+    aggregates = ReviewAggregates(len(store.userIds), len(store.businessIds))
+    aggregates.add(store.columns, view.rows)
+    reviews = dict((name, column[rows]) for name, column in store.columns.iteritems())
+    userProfiles = dict(store.userProfiles)
+    userProfiles['hasVotes'] = view.userHasVotes
+    columns = aggregates.featureColumns(reviews, userProfiles, store.businessProfiles, included=True)
+    if needsInput(TFIDF):
+        with instruments.timer('similarity'):
+            columns['similarityToOtherReviews'] = viewSimilarities(view, rows)
+    return columns
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+from datetime import datetime
+import features
+from data_objects import ReviewText, Review, ReviewGroups, ReviewFeatures
+from feature_output import FORMATS, openFeatureWriter
+from json_ingest import JsonFileReader, DECODER_NAME
+from instrumentation import peakRssMB, cpuSeconds
+from synthetic_data import generate
+from pos_tagging import TAGGERS, configureTagger
+
+RESULTS_FILENAME = 'benchmark_results.jsonl'
+
+class StageMeasurements(object):
+    # wall time, cpu time and peak memory of each stage of a benchmark run, in run order. The peak is the process
+    # high-water mark at the end of the stage, so a stage raising it is the one that set it.
+    def __init__(self):
+        self.stages = [ ]
+
+    def measure(self, name, records, function, *args):
+        # runs function(*args) as stage name and returns its result; records is the number of items processed, or a
+        # function giving it from the result
+        start = time.time()
+        cpuStart = cpuSeconds()
+        result = function(*args)
+        seconds = time.time() - start
+        if callable(records):
+            records = records(result)
+        self.stages.append({'stage': name, 'seconds': seconds, 'cpuSeconds': cpuSeconds() - cpuStart, 'records': records, \
+                            'recordsPerSecond': records/seconds if seconds > 0 else None, 'peakRssMB': peakRssMB()})
+        return result
+
+def chunks(items, chunkSize):
+    return [items[i:i + chunkSize] for i in xrange(0, len(items), chunkSize)]
+
+def parseJson():
+    reviewRecords = [list(JsonFileReader(filename)) for filename in [features.TRAINING_REVIEW_FILENAME, features.TEST_REVIEW_FILENAME]]
+    return (reviewRecords, features.loadUserData(), features.loadBusinessData())
+
+def analyzeTexts(texts, chunkSize):
+    reviewTexts = [ ]
+    for chunk in chunks(texts, chunkSize):
+        reviewTexts.extend(ReviewText.analyzeTexts(chunk))
+    return reviewTexts
+
+def loadObjects(reviewRecords, reviewTexts, jsonUserDict, jsonBusinessDict):
+    # the Review/User/Business objects of features.generateObjectFeatures, from already parsed and analyzed reviews
+    categories = features.loadBusinessCategories()
+    reviews = [ ]
+    reviewIds = [ ]
+    texts = iter(reviewTexts)
+    for records, today in zip(reviewRecords, [features.TRAINING_DATE, features.TEST_DATE]):
+        reviews.append(dict((data['review_id'], Review(data, categories, today, reviewText=texts.next())) for data in records))
+        reviewIds.append([data['review_id'] for data in records])
+    userGroups = ReviewGroups('userId', reviews[0], reviews[1])
+    businessGroups = ReviewGroups('businessId', reviews[0], reviews[1])
+    views = [ ]
+    for trainingOnly in [True, False]:
+        views.append((features.loadUsers(userGroups.view(trainingOnly), jsonUserDict), \
+                      features.loadBusinesses(businessGroups.view(trainingOnly), jsonBusinessDict, categories)))
+    return (reviews, reviewIds, views)
+
+def featureRows(reviews, reviewIds, views):
+    rows = [ ]
+    for splitReviews, splitReviewIds, (users, businesses) in zip(reviews, reviewIds, views):
+        rows.append([ReviewFeatures(splitReviews[reviewId], users[splitReviews[reviewId].userId], \
+                                    businesses[splitReviews[reviewId].businessId]).getList() for reviewId in splitReviewIds])
+    return rows
+
+def writeRows(rows, outputDir, format):
+    for splitRows, name in zip(rows, ['training_features.csv', 'test_features.csv']):
+        writer = openFeatureWriter(os.path.join(outputDir, name), format)
+        for values in splitRows:
+            writer.writeRow(values)
+        writer.close()
+
+def gitCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), \
+                                       stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def benchmark(dataDir, outputDir, format='csv', chunkSize=features.CHUNK_SIZE):
+    # times the stages of the row engine (features.generateObjectFeatures) one at a time on the data of dataDir
+    features.setDataDir(dataDir)
+    measurements = StageMeasurements()
+    (reviewRecords, jsonUserDict, jsonBusinessDict) = measurements.measure('jsonParse', \
+        lambda parsed: sum(len(records) for records in parsed[0]) + len(parsed[1]) + len(parsed[2]), parseJson)
+    nreviews = sum(len(records) for records in reviewRecords)
+    texts = [data['text'] for records in reviewRecords for data in records]
+    reviewTexts = measurements.measure('reviewText', nreviews, analyzeTexts, texts, chunkSize)
+    (reviews, reviewIds, views) = measurements.measure('loaders', nreviews, loadObjects, reviewRecords, reviewTexts, \
+                                                       jsonUserDict, jsonBusinessDict)
+    rows = measurements.measure('reviewFeatures', nreviews, featureRows, reviews, reviewIds, views)
+    measurements.measure('writeFeatures', nreviews, writeRows, rows, outputDir, format)
+    return {'timestamp': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'), 'commit': gitCommit(), 'dataDir': dataDir, \
+            'reviews': nreviews, 'format': format, 'chunkSize': chunkSize, 'jsonDecoder': DECODER_NAME, \
+            'python': sys.version.split()[0], 'stages': measurements.stages, \
+            'totalSeconds': sum(stage['seconds'] for stage in measurements.stages), 'peakRssMB': peakRssMB()}
+
+def printResult(result):
+    print '%d reviews from %s' % (result['reviews'], result['dataDir'])
+    for stage in result['stages']:
+        print '%-15s %8.2fs wall %8.2fs cpu %10.0f records/sec %8.1f MB peak' % \
+              (stage['stage'], stage['seconds'], stage['cpuSeconds'], stage['recordsPerSecond'] or 0.0, stage['peakRssMB'])
+    print '%-15s %8.2fs' % ('total', result['totalSeconds'])
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the stages of features.py and append the results to a json lines file.')
+    parser.add_argument('--data-dir', default=None, help='data directory to benchmark (default features.py\'s)')
+    parser.add_argument('--generate', type=int, default=None, metavar='REVIEWS', \
+                        help='benchmark a temporary synthetic data directory with this many reviews instead')
+    parser.add_argument('--user-skew', type=float, default=1.0, help='Zipf exponent of reviews per user of generated data')
+    parser.add_argument('--business-skew', type=float, default=0.8, help='Zipf exponent of reviews per business of generated data')
+    parser.add_argument('--seed', type=int, default=1, help='seed of generated data')
+    parser.add_argument('--format', choices=FORMATS, default='csv')
+    parser.add_argument('--chunk-size', type=int, default=features.CHUNK_SIZE, help='reviews per text analysis batch')
+    parser.add_argument('--pos-tagger', choices=TAGGERS, default='nltk')
+    parser.add_argument('--pos-lexicon', default=None, help='lexicon file of the lexicon tagger')
+    parser.add_argument('--results', default=RESULTS_FILENAME, help='json lines file the run is appended to')
+    args = parser.parse_args()
+    configureTagger(args.pos_tagger, args.pos_lexicon)
+    temporaryDir = tempfile.mkdtemp()
+    try:
+        dataDir = args.data_dir if args.data_dir is not None else features.DATA_DIR
+        if args.generate is not None:
+            dataDir = os.path.join(temporaryDir, 'data')
+            generate(dataDir, args.generate, userSkew=args.user_skew, businessSkew=args.business_skew, seed=args.seed)
+        result = benchmark(dataDir, temporaryDir, args.format, args.chunk_size)
+        result['posTagger'] = args.pos_tagger
+        if args.generate is not None:
+            result['generated'] = {'reviews': args.generate, 'userSkew': args.user_skew, 'businessSkew': args.business_skew, \
+                                   'seed': args.seed}
+    finally:
+        shutil.rmtree(temporaryDir)
+    f = open(args.results, 'a')
+    f.write(json.dumps(result, sort_keys=True) + '\n')
+    f.close()
+    printResult(result)
+
+if __name__ == '__main__':
+    main()
@@ -1,51 +1,206 @@
 #!/usr/bin/env python
 
-import json
+import os
+import sys
 import csv
+import argparse
+import numpy
+from json_ingest import JsonFileReader, reportTo, BUSINESS_FIELDS
 import pdb
 
-TRAINING_DATA_DIR = '../data/training/'
-TEST_DATA_DIR = '../data/test/'
-TRAINING_BUSINESS_FILENAME = TRAINING_DATA_DIR + 'json/yelp_training_set_business.json'
-TEST_BUSINESS_FILENAME = TEST_DATA_DIR + 'json/yelp_test_set_business.json'
-OUTPUT_FILENAME = TRAINING_DATA_DIR + '../data/business_categories.csv'
+DATA_DIR = '../data/'
+CLUSTERS = 50 # default category clusters of clusterCategories
+BATCH_SIZE = 1000 # businesses sampled per mini-batch k-means step
+ITERATIONS = 200 # mini-batch steps per run
+RESTARTS = 5 # runs from different initial centers, the one with the least within-cluster error is kept
+ASSIGN_BATCH_SIZE = 10000 # businesses assigned to their nearest center at a time
+
+def setDataDir(dataDir):
+    # (re)defines the input and output filenames below dataDir
+    global DATA_DIR, TRAINING_BUSINESS_FILENAME, TEST_BUSINESS_FILENAME, OUTPUT_FILENAME, MATRIX_FILENAME, CLUSTERS_FILENAME
+    DATA_DIR = os.path.join(dataDir, '')
+    TRAINING_BUSINESS_FILENAME = DATA_DIR + 'training/json/yelp_training_set_business.json'
+    TEST_BUSINESS_FILENAME = DATA_DIR + 'test/json/yelp_test_set_business.json'
+    OUTPUT_FILENAME = DATA_DIR + 'business_categories.csv' # dense indicators read by rscripts/business_categories.R
+    MATRIX_FILENAME = DATA_DIR + 'business_categories.npz'
+    CLUSTERS_FILENAME = DATA_DIR + 'business_clusters.csv' # read by features.loadBusinessCategories
+
+setDataDir(DATA_DIR)
 
 def loadBusinessData():
     categories = set()
     jsonData = dict()
-    f = open(TRAINING_BUSINESS_FILENAME, 'r')
-    for line in f:
-        data = json.loads(line)
-        jsonData[data['business_id']] = data
-        for c in data['categories']:
-            categories.add(c)
-    f.close()
-    f = open(TEST_BUSINESS_FILENAME, 'r')
-    for line in f:
-        data = json.loads(line)
-        jsonData[data['business_id']] = data
-        for c in data['categories']:
-            categories.add(c)
-    f.close()
+    for filename in [TRAINING_BUSINESS_FILENAME, TEST_BUSINESS_FILENAME]:
+        for data in JsonFileReader(filename, BUSINESS_FIELDS):
+            jsonData[data['business_id']] = data
+            for c in data['categories']:
+                categories.add(c)
 
     return (jsonData, sorted(categories))
 
-def writeCategories(jsonData, categories):
+class CategoryMatrix(object):
+    # sparse (CSR) 0/1 business x category indicators: the category columns of business i are
+    # indices[indptr[i]:indptr[i + 1]]
+    def __init__(self, ids, categories, indptr, indices):
+        self.ids = ids
+        self.categories = categories
+        self.indptr = indptr
+        self.indices = indices
+
+    @classmethod
+    def fromJson(cls, jsonData, categories):
+        columns = dict((c, j) for j, c in enumerate(categories))
+        ids = sorted(jsonData.keys())
+        indptr = numpy.zeros(len(ids) + 1, dtype=numpy.int64)
+        indices = [ ]
+        for i, businessId in enumerate(ids):
+            indices.extend(sorted(set(columns[c] for c in jsonData[businessId]['categories'])))
+            indptr[i + 1] = len(indices)
+        return cls(ids, categories, indptr, numpy.array(indices, dtype=numpy.int32))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def rows(self, rows):
+        # (indptr, indices) of the submatrix of the given rows
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+        indptr = numpy.zeros(len(rows) + 1, dtype=numpy.int64)
+        numpy.cumsum(lengths, out=indptr[1:])
+        return (indptr, self.indices[numpy.repeat(starts - indptr[:-1], lengths) + numpy.arange(indptr[-1])])
+
+    def save(self, filename):
+        f = open(filename, 'wb')
+        numpy.savez(f, ids=numpy.array(self.ids), categories=numpy.array(self.categories), indptr=self.indptr, indices=self.indices)
+        f.close()
+
+    @classmethod
+    def load(cls, filename):
+        data = numpy.load(filename)
+        matrix = cls(list(data['ids']), list(data['categories']), data['indptr'], data['indices'])
+        data.close()
+        return matrix
+
+def writeCategories(matrix):
+    # the dense indicator csv of rscripts/business_categories.R, written a row at a time
     f = open(OUTPUT_FILENAME, 'wb')
     csvWriter = csv.writer(f, delimiter=',', quoting=csv.QUOTE_NONNUMERIC)
-    csvWriter.writerow(['id'] + sorted(categories.keys()))
-    for businessId, data in jsonData.iteritems():
-        line = [0] * (len(categories) + 1)
+    csvWriter.writerow(['id'] + list(matrix.categories))
+    line = [0] * (len(matrix.categories) + 1)
+    for i, businessId in enumerate(matrix.ids):
+        columns = matrix.indices[matrix.indptr[i]:matrix.indptr[i + 1]] + 1
         line[0] = businessId
-        for c in data['categories']:
-            line[categories[c]] = 1
+        for j in columns:
+            line[j] = 1
         csvWriter.writerow(line)
+        for j in columns:
+            line[j] = 0
     f.close()
 
+def centerDistances(centers, indptr, indices):
+    # squared distance of each sparse 0/1 row to each center, as a rows x centers array; x.c is a difference of
+    # cumulative sums of the center weights of the rows' columns
+    weights = numpy.zeros((len(centers), len(indices) + 1))
+    numpy.cumsum(centers[:, indices], axis=1, out=weights[:, 1:])
+    dots = (weights[:, indptr[1:]] - weights[:, indptr[:-1]]).T
+    return numpy.maximum(numpy.diff(indptr)[:, None] - 2*dots + (centers**2).sum(axis=1)[None, :], 0.0)
+
+def assignClusters(matrix, centers, batchSize=ASSIGN_BATCH_SIZE):
+    # nearest center of every business and the total squared distance to it, a batch of businesses at a time
+    labels = numpy.zeros(len(matrix), dtype=numpy.int32)
+    error = 0.0
+    for start in xrange(0, len(matrix), batchSize):
+        rows = numpy.arange(start, min(start + batchSize, len(matrix)))
+        distances = centerDistances(centers, *matrix.rows(rows))
+        labels[rows] = distances.argmin(axis=1)
+        error = error + distances[numpy.arange(len(rows)), labels[rows]].sum()
+    return (labels, error)
+
+def initialCenters(matrix, k, rng, sampleSize):
+    # k-means++ seeding over a random sample of businesses
+    (indptr, indices) = matrix.rows(rng.randint(0, len(matrix), sampleSize))
+    centers = numpy.zeros((k, len(matrix.categories)))
+    closest = numpy.zeros(sampleSize) + numpy.inf
+    for j in xrange(k):
+        total = closest.sum() if j > 0 else 0.0
+        i = rng.choice(sampleSize, p=closest/total) if total > 0 else rng.randint(sampleSize)
+        centers[j, indices[indptr[i]:indptr[i + 1]]] = 1.0
+        closest = numpy.minimum(closest, centerDistances(centers[j:j + 1], indptr, indices)[:, 0])
+    return centers
+
+def miniBatchKMeans(matrix, k, batchSize, iterations, rng):
+    # Sculley's mini-batch k-means: each step assigns a random batch of businesses to their nearest centers and moves
+    # every center towards its new members by a per-center learning rate of 1/(businesses assigned so far)
+    ncategories = len(matrix.categories)
+    centers = initialCenters(matrix, k, rng, min(max(3*k, batchSize), len(matrix)))
+    counts = numpy.zeros(k)
+    for iteration in xrange(iterations):
+        (indptr, indices) = matrix.rows(rng.randint(0, len(matrix), batchSize))
+        labels = centerDistances(centers, indptr, indices).argmin(axis=1)
+        batchCounts = numpy.bincount(labels, minlength=k).astype(float)
+        sums = numpy.bincount(numpy.repeat(labels, numpy.diff(indptr)) * ncategories + indices, \
+                              minlength=k*ncategories).reshape(k, ncategories)
+        counts = counts + batchCounts
+        updated = batchCounts > 0
+        centers[updated] += (sums[updated] - batchCounts[updated, None]*centers[updated])/counts[updated, None]
+    return centers
+
+def clusterCategories(matrix, k=CLUSTERS, batchSize=BATCH_SIZE, iterations=ITERATIONS, restarts=RESTARTS, seed=1):
+    # cluster labels (0-based) of the businesses of a CategoryMatrix from the best of several mini-batch k-means runs
+    rng = numpy.random.RandomState(seed)
+    best = None
+    for restart in xrange(restarts):
+        centers = miniBatchKMeans(matrix, k, batchSize, iterations, rng)
+        (labels, error) = assignClusters(matrix, centers)
+        if best is None or error < best[1]:
+            best = (labels, error)
+    return best
+
+def writeClusters(ids, labels, filename):
+    # business_clusters.csv as written by rscripts/business_categories.R: 1-based clusters
+    f = open(filename, 'w')
+    f.write('id,category\n')
+    for businessId, label in zip(ids, labels):
+        f.write('%s,%d\n' % (businessId, label + 1))
+    f.close()
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description='Write the business category indicators from the Yelp business json data, ' + \
+                                                 'and with --clusters cluster them into business_clusters.csv.')
+    parser.add_argument('--data-dir', default=DATA_DIR, help='directory with the Yelp json data; outputs are written there')
+    parser.add_argument('--clusters', type=int, default=None, metavar='N', \
+                        help='cluster the categories into N clusters (eg %d) with mini-batch k-means and write ' % CLUSTERS + \
+                             'business_clusters.csv; without it business_clusters.csv is left alone')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='businesses per mini-batch k-means step')
+    parser.add_argument('--iterations', type=int, default=ITERATIONS, help='mini-batch steps per run')
+    parser.add_argument('--restarts', type=int, default=RESTARTS, help='runs from different initial centers')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--no-csv', action='store_true', \
+                        help='only write the sparse category matrix, not the dense indicator csv of rscripts/business_categories.R')
+    parser.add_argument('--verbose', action='store_true', help='report json ingestion records/sec and the clustering error on stderr')
+    args = parser.parse_args()
+    if args.clusters is not None and args.clusters < 1:
+        parser.error('--clusters must be at least 1')
+    return args
+
 def main():
+    args = parseArguments()
+    setDataDir(args.data_dir)
+    if args.verbose:
+        reportTo(sys.stderr)
     (jsonData, categories) = loadBusinessData()
-    categories = dict(zip(categories, range(1, len(categories) + 1)))
-    writeCategories(jsonData, categories)
+    matrix = CategoryMatrix.fromJson(jsonData, categories)
+    del jsonData
+    matrix.save(MATRIX_FILENAME)
+    if not args.no_csv:
+        writeCategories(matrix)
+    if args.clusters is not None:
+        (labels, error) = clusterCategories(matrix, args.clusters, args.batch_size, args.iterations, args.restarts, args.seed)
+        writeClusters(matrix.ids, labels, CLUSTERS_FILENAME)
+        if args.verbose:
+            total = len(matrix.indices) - (numpy.bincount(matrix.indices, minlength=len(categories))**2).sum()/float(max(len(matrix), 1))
+            sys.stderr.write('%d businesses, %d categories, %d clusters: %.1f%% of the variance explained\n' % \
+                             (len(matrix), len(categories), args.clusters, 100 - 100*error/total if total > 0 else 100.0))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import csv
+import json
+import shutil
+import tempfile
+import argparse
+import itertools
+import subprocess
+import StringIO
+import numpy
+import features
+import data_objects
+from synthetic_data import generate
+from pos_tagging import TAGGERS, configureTagger
+from feature_registry import configureFeatures
+from aggregates import SUM_FIELDS, ReviewAggregates, TimedReviewAggregates
+from text_normalizer import normalizeText, referenceNormalizeText
+from feature_server import FeatureScorer, serveLines
+from json_ingest import JsonFileReader
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+FEATURE_FILES = [os.path.join('training', 'training_features.csv'), os.path.join('test', 'test_features.csv')]
+# compared runs never hide votes, since the engines draw the users whose votes are hidden in different orders
+RUNNER = 'import sys, features; features.HIDDEN_VOTES_PROBABILITY = 0.0; sys.argv = sys.argv[1:]; import %s; %s.main()'
+# the original features.py reads ../data/ and hides votes where random.random() < 0.3, so never
+ORIGINAL_RUNNER = 'import random; random.random = lambda: 1.0; import features; features.main()'
+TOLERANCE = 1e-9 # relative difference allowed between float features, whose sums may be taken in another order
+REVIEWS = 2000
+BUSINESS_SKEW = 1.2 # a few businesses with many reviews
+SHARDS = 3
+ENGINES = ['rows', 'vectorized', 'streaming']
+MEMORY_BUDGET = 0.01 # MB of the --memory-budget runs, some hundred reviews per spilled run
+SIMILARITY_SAMPLE = 30 # below the reviews of the popular businesses of the generated data
+SERVER_WINDOW = 1.0 # seconds feature_server waits for more lines, so that each fed batch is scored together
+# review json lines feature_server.py cannot score, fed between valid ones
+MALFORMED_LINES = ['{"review_id": "bad-1", "user_id": "u", "business_id": "b", "stars": 4, "date": "2012-01-01", "text": null}', \
+                   '{"review_id": "bad-2", "user_id": 7, "business_id": "b", "stars": 4, "date": "2012-01-01", "text": "Good."}', \
+                   '{"review_id": "bad-3", "user_id": "u", "business_id": "b", "stars": 4, "date": "2012-01-01"}', \
+                   '{"review_id": "bad-4", "user_id": "u", "business_id": "b", "stars": 4, "date": "01/01/2012", "text": "Good."}', \
+                   '["not", "a", "review"]', 'not json']
+# texts added to the golden corpus of the normalizer check for the cases generated reviews lack
+NORMALIZER_TEXTS = ['', ' ', 'Closed.', 'p.s. soon', 'p. s. see you', 'P.S. ps.', 'Spaces  before , punctuation !and ?newlines \nhere .', \
+                    'Line one\nLine two.\n\n\nLine three:\nfour!\n\nfive?\n', 'Repeated... stops!!! and?? mixed.!?', \
+                    '1. first 2.second 10. tenth 3.5 stars', 'well-done *great* -- "quoted" \'single\'', \
+                    u'caf\xe9 na\xefve \u2014 unicode\u2019s', '\tTabs\tand  trailing spaces   ', 'No terminator at the end']
+AS_OF_PERCENTILES = [0, 10, 50, 90, 100] # review days the as-of check is run on, besides the day before the first
+
+class Runs(object):
+    # runs features.py and feature_shards.py on one data directory, keeping the feature files of each run under
+    # workDir; a run already made with the same arguments is not made again
+    def __init__(self, dataDir, workDir, posTagger):
+        self.dataDir = dataDir
+        self.workDir = workDir
+        self.posTagger = posTagger
+        self.outputs = { }
+
+    def run(self, module, args):
+        # the directory holding the feature files of module's run with args, as laid out in the data directory;
+        # feature_shards.py gets a work directory there
+        key = (module, tuple(args))
+        if key not in self.outputs:
+            outputDir = os.path.join(self.workDir, 'run-%d' % len(self.outputs))
+            (tagger, lexicon) = self.posTagger
+            args = list(args) + ['--data-dir', self.dataDir, '--pos-tagger', tagger] + (['--pos-lexicon', lexicon] if lexicon else [ ])
+            if module == 'feature_shards':
+                args = args + ['--work-dir', os.path.join(outputDir, 'shards')]
+            subprocess.check_call([sys.executable, '-c', RUNNER % (module, module), module + '.py'] + args, cwd=SCRIPTS_DIR)
+            self.keep(key, outputDir)
+        return self.outputs[key]
+
+    def original(self, scriptsDir):
+        # the directory holding the feature files of the features.py in scriptsDir, run from a copy next to a link to
+        # the data directory since it only reads ../data/
+        key = ('original', scriptsDir)
+        if key not in self.outputs:
+            originalDir = os.path.join(self.workDir, 'original')
+            shutil.copytree(scriptsDir, os.path.join(originalDir, 'pyscripts'), ignore=shutil.ignore_patterns('*.pyc'))
+            os.symlink(self.dataDir, os.path.join(originalDir, 'data'))
+            subprocess.check_call([sys.executable, '-c', ORIGINAL_RUNNER], cwd=os.path.join(originalDir, 'pyscripts'))
+            self.keep(key, os.path.join(self.workDir, 'run-%d' % len(self.outputs)))
+        return self.outputs[key]
+
+    def keep(self, key, outputDir):
+        # moves the feature files a run wrote to the data directory to outputDir
+        for filename in FEATURE_FILES:
+            if not os.path.isdir(os.path.dirname(os.path.join(outputDir, filename))):
+                os.makedirs(os.path.dirname(os.path.join(outputDir, filename)))
+            shutil.move(os.path.join(self.dataDir, filename), os.path.join(outputDir, filename))
+        self.outputs[key] = outputDir
+
+    def features(self, *args):
+        return self.run('features', args)
+
+    def shards(self, nshards, *args):
+        return self.run('feature_shards', ('run', '--shards', str(nshards)) + args)
+
+def valueKind(value):
+    # how a csv value is written: 'NA', an integer or a float
+    if value == 'NA':
+        return 'NA'
+    return 'float' if ('.' in value or 'e' in value or 'n' in value) else 'integer'
+
+def compareValues(expected, actual):
+    if expected == actual:
+        return True
+    if valueKind(expected) != valueKind(actual) or valueKind(expected) == 'NA':
+        return False
+    try:
+        (x, y) = (float(expected), float(actual))
+    except ValueError:
+        return False
+    return abs(x - y) <= TOLERANCE * max(1.0, abs(x))
+
+def compareFiles(expectedFilename, actualFilename):
+    # the differences of two feature csv files, at most a few; values must be written alike and floats agree to
+    # TOLERANCE
+    differences = [ ]
+    expected = csv.reader(open(expectedFilename, 'rb'))
+    actual = csv.reader(open(actualFilename, 'rb'))
+    header = expected.next()
+    if actual.next() != header:
+        return ['columns differ']
+    nrows = 0
+    for expectedRow in expected:
+        actualRow = next(actual, None)
+        if actualRow is None:
+            return differences + ['%d rows expected, only %d written' % (nrows + 1 + sum(1 for row in expected), nrows)]
+        for name, x, y in zip(header, expectedRow, actualRow):
+            if not compareValues(x, y) and len(differences) < 5:
+                differences.append('row %d %s: %s expected, %s written' % (nrows + 1, name, x, y))
+        nrows = nrows + 1
+    if next(actual, None) is not None:
+        differences.append('more than the %d expected rows written' % nrows)
+    return differences
+
+def compareRuns(name, expectedDir, actualDir):
+    # prints whether the feature files of two runs match; returns whether they do
+    matched = True
+    for filename in FEATURE_FILES:
+        differences = compareFiles(os.path.join(expectedDir, filename), os.path.join(actualDir, filename))
+        for difference in differences:
+            print '%s: %s: %s' % (name, filename, difference)
+        matched = matched and len(differences) == 0
+    print '%s: %s' % (name, 'ok' if matched else 'FAILED')
+    return matched
+
+def report(name, differences):
+    # prints a check's first differences and whether it passed; returns whether it did
+    for difference in differences[:5]:
+        print '%s: %s' % (name, difference)
+    print '%s: %s' % (name, 'ok' if len(differences) == 0 else 'FAILED')
+    return len(differences) == 0
+
+def closeArrays(expected, actual):
+    # whether two float arrays agree to TOLERANCE, NaN and infinite values included
+    same = (expected == actual) | (numpy.isnan(expected) & numpy.isnan(actual))
+    with numpy.errstate(invalid='ignore'):
+        return bool(numpy.all(same | (numpy.abs(expected - actual) <= TOLERANCE * numpy.maximum(1.0, numpy.abs(expected)))))
+
+def checkEngines(runs, args):
+    # the vectorized and streaming engines against the rows engine, every feature included, and the rows engine
+    # against the original features.py when there is one
+    rows = runs.features('--engine', 'rows')
+    matched = [compareRuns('engines %s' % engine, rows, runs.features('--engine', engine)) for engine in ENGINES[1:]]
+    if args.original is not None:
+        matched.append(compareRuns('engines original', runs.original(args.original), rows))
+    return all(matched)
+
+def checkNormalizer(runs, args):
+    # normalizeText against the original ReviewText preprocessing, referenceNormalizeText, on the texts of the
+    # review json files (the golden corpus) and NORMALIZER_TEXTS
+    features.setDataDir(runs.dataDir)
+    texts = [data['text'] for filename in [features.TRAINING_REVIEW_FILENAME, features.TEST_REVIEW_FILENAME] \
+             for data in JsonFileReader(filename)] + NORMALIZER_TEXTS
+    return report('normalizer', ['%r: %r expected, %r normalized' % (text, referenceNormalizeText(text), normalizeText(text)) \
+                                 for text in texts if normalizeText(text) != referenceNormalizeText(text)])
+
+def compareAggregates(name, expected, actual):
+    # the differences of the user, business and user/category aggregates of two ReviewAggregates
+    differences = [ ]
+    for group in ['users', 'businesses']:
+        (x, y) = (getattr(expected, group), getattr(actual, group))
+        arrays = [('count', x.count, y.count), ('minAge', x.minAge, y.minAge), ('minAgeCount', x.minAgeCount, y.minAgeCount), \
+                  ('secondMinAge', x.secondMinAge, y.secondMinAge)] + [(field, x.sums[field], y.sums[field]) for field in SUM_FIELDS]
+        differences.extend('%s %s %s' % (name, group, field) for field, a, b in arrays if len(a) != len(b) or not closeArrays(a, b))
+    (x, y) = (expected.userCategories, actual.userCategories)
+    if not numpy.array_equal(y.lookup(x.keys), x.counts) or y.counts.sum() != x.counts.sum():
+        differences.append('%s userCategories' % name)
+    return differences
+
+def checkAsOf(runs, args):
+    # TimedReviewAggregates as of several days against aggregates built from only the reviews up to each day, with
+    # ages counted to it (a brute-force --as-of), and the similarities of the reviews up to each day
+    features.setDataDir(runs.dataDir)
+    configureTagger(*runs.posTagger)
+    configureFeatures(None)
+    store = features.loadReviewStore(features.loadBusinessCategories(), 1, features.CHUNK_SIZE, None)
+    days = features.reviewDays(store)
+    asOfDays = [days.min() - 1] + sorted(set(int(numpy.percentile(days, p)) for p in AS_OF_PERCENTILES))
+    (nusers, nbusinesses) = (len(store.userIds), len(store.businessIds))
+    differences = [ ]
+    for split, isTest in [('training', False), ('test', True)]:
+        aggregated = store.splitRows(test=isTest) if not isTest else numpy.arange(len(store))
+        timed = TimedReviewAggregates(store.columns, aggregated, days, nusers, nbusinesses)
+        for day in asOfDays:
+            name = '%s as of %d' % (split, day)
+            columns = dict(store.columns)
+            columns['age'] = day - days
+            exact = ReviewAggregates(nusers, nbusinesses, termStatistics=True)
+            exact.add(columns, aggregated[days[aggregated] <= day], store.terms, store.reviewIds)
+            differences.extend(compareAggregates(name, exact, timed.asOf(day)))
+            rows = store.splitRows(test=isTest)
+            rows = rows[days[rows] <= day]
+            businessCodes = store.columns['businessCode'][rows]
+            expected = exact.similarities(businessCodes, [store.terms[i] for i in rows], True, [store.reviewIds[i] for i in rows])
+            if not closeArrays(expected, timed.similarities(day, rows, businessCodes, store.terms, store.reviewIds)):
+                differences.append('%s similarityToOtherReviews' % name)
+    return report('as-of', differences)
+
+def checkShards(runs, args):
+    # feature_shards.py run against one features.py --engine streaming process
+    return compareRuns('shards', runs.features('--engine', 'streaming'), runs.shards(args.shards))
+
+def checkPipeline(runs, args):
+    # features.py --pipeline against serial runs of each engine, with small queues and write batches
+    pipelined = ('--pipeline', '--queue-depth', 'decode=1,analysis=1,write=2', '--write-batch', '7')
+    return all([compareRuns('pipeline %s' % engine, runs.features('--engine', engine), runs.features('--engine', engine, *pipelined)) \
+                for engine in ENGINES])
+
+def checkMemoryBudget(runs, args):
+    # features.py and feature_shards.py --memory-budget against in-memory grouping, with a budget small enough that
+    # the reviews are spilled in many runs
+    spillDir = os.path.join(runs.workDir, 'spill')
+    if not os.path.isdir(spillDir):
+        os.makedirs(spillDir)
+    budget = ('--memory-budget', str(MEMORY_BUDGET), '--spill-dir', spillDir)
+    streaming = runs.features('--engine', 'streaming')
+    return all([compareRuns('memory-budget', streaming, runs.features('--engine', 'streaming', *budget)), \
+                compareRuns('memory-budget shards', streaming, runs.shards(args.shards, *budget))])
+
+def checkSimilaritySample(runs, args):
+    # --similarity-sample runs of every engine and of feature_shards.py against the rows engine's
+    sample = ('--similarity-sample', str(args.similarity_sample))
+    rows = runs.features('--engine', 'rows', *sample)
+    return all([compareRuns('similarity-sample %s' % engine, rows, runs.features('--engine', engine, *sample)) for engine in ENGINES[1:]] + \
+               [compareRuns('similarity-sample shards', rows, runs.shards(args.shards, *sample))])
+
+def serve(scorer, lines):
+    # the results of feature_server.py for the given input lines
+    output = StringIO.StringIO()
+    serveLines(scorer, StringIO.StringIO(''.join(line + '\n' for line in lines)), output, SERVER_WINDOW, len(lines) + 1)
+    return [json.loads(line) for line in output.getvalue().splitlines()]
+
+def checkServer(runs, args):
+    # feature_server.py on a --similarity-sample checkpoint: the scorer keeps the checkpoint's sample, malformed lines
+    # get an error each, and the valid reviews fed with them score as they do alone
+    checkpointDir = os.path.join(runs.workDir, 'checkpoint')
+    runs.features('--engine', 'streaming', '--checkpoint', checkpointDir, '--similarity-sample', str(args.similarity_sample))
+    features.setDataDir(runs.dataDir)
+    configureFeatures(None)
+    scorer = FeatureScorer(checkpointDir, features.loadBusinessCategories())
+    reviews = itertools.islice(JsonFileReader(features.TEST_REVIEW_FILENAME), len(MALFORMED_LINES))
+    valid = [json.dumps(dict(data, review_id='new-' + data['review_id'])) for data in reviews]
+    mixed = [line for pair in zip(valid, MALFORMED_LINES) for line in pair]
+    differences = [ ]
+    if data_objects.similaritySampleSize != args.similarity_sample:
+        differences.append('similarity sample %s, the checkpoint has %d' % (data_objects.similaritySampleSize, args.similarity_sample))
+    expected = serve(scorer, valid)
+    results = serve(scorer, mixed)
+    data_objects.configureSimilarity(None)
+    if len(results) != len(mixed):
+        differences.append('%d results of %d lines' % (len(results), len(mixed)))
+    for line, result in zip(mixed, results):
+        if line in MALFORMED_LINES and 'error' not in result:
+            differences.append('no error for %s' % line)
+        elif line in valid and result != expected[valid.index(line)]:
+            differences.append('%s scored %s with malformed lines, %s alone' % \
+                               (result.get('review_id'), result.get('features', result.get('error')), expected[valid.index(line)].get('features')))
+    return report('server', differences)
+
+CHECKS = [('engines', checkEngines), ('normalizer', checkNormalizer), ('as-of', checkAsOf), ('shards', checkShards), ('pipeline', checkPipeline), ('memory-budget', checkMemoryBudget), \
+          ('similarity-sample', checkSimilaritySample), ('server', checkServer)]
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that the ways of running features.py that should write the same ' + \
+                                                 'features do, on synthetic data: the engines (and the original features.py), ' + \
+                                                 'sharded and single process runs, pipelined and serial runs, out of core and ' + \
+                                                 'in-memory grouping, and the engines with a similarity sample; that the text ' + \
+                                                 'normalizer matches the original on the golden corpus and --as-of aggregates a ' + \
+                                                 'brute-force recount; and that feature_server.py scores the valid reviews of a ' + \
+                                                 'batch with malformed ones.')
+    parser.add_argument('checks', nargs='*', metavar='CHECK', help='checks to run: %s (default all)' % ', '.join(name for name, check in CHECKS))
+    parser.add_argument('--data-dir', default=None, help='data directory to check on instead of generated data (feature files are overwritten)')
+    parser.add_argument('--reviews', type=int, default=REVIEWS, help='reviews of the generated data')
+    parser.add_argument('--business-skew', type=float, default=BUSINESS_SKEW, help='Zipf exponent of reviews per business of generated data')
+    parser.add_argument('--seed', type=int, default=1, help='seed of generated data')
+    parser.add_argument('--shards', type=int, default=SHARDS, help='shards of the sharded runs')
+    parser.add_argument('--similarity-sample', type=int, default=SIMILARITY_SAMPLE, help='--similarity-sample of the sampled runs')
+    parser.add_argument('--pos-tagger', choices=TAGGERS, default='nltk')
+    parser.add_argument('--pos-lexicon', default=None, help='lexicon file of the lexicon tagger')
+    parser.add_argument('--original', default=None, metavar='DIR', \
+                        help='pyscripts directory of the original features.py (eg git archive of the first commit) to ' + \
+                             'compare the rows engine with; needs the nltk tagger')
+    args = parser.parse_args()
+    unknown = [name for name in args.checks if name not in dict(CHECKS)]
+    if len(unknown) > 0:
+        parser.error('unknown checks: %s' % ', '.join(unknown))
+    if args.original is not None and args.pos_tagger != 'nltk':
+        parser.error('the original features.py tags with nltk, so --original needs --pos-tagger nltk')
+    if args.pos_lexicon is not None:
+        args.pos_lexicon = os.path.abspath(args.pos_lexicon)
+    if args.original is not None:
+        args.original = os.path.abspath(args.original)
+    workDir = tempfile.mkdtemp()
+    try:
+        dataDir = os.path.abspath(args.data_dir) if args.data_dir is not None else os.path.join(workDir, 'data')
+        if args.data_dir is None:
+            generate(dataDir, args.reviews, businessSkew=args.business_skew, seed=args.seed)
+        runs = Runs(dataDir, workDir, (args.pos_tagger, args.pos_lexicon))
+        failed = [name for name, check in CHECKS if (len(args.checks) == 0 or name in args.checks) and not check(runs, args)]
+    finally:
+        shutil.rmtree(workDir)
+    if len(failed) > 0:
+        sys.exit('failed: %s' % ', '.join(failed))
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,21 @@
 #!/usr/bin/env python
 
 import math
+import array
+import heapq
+import struct
+import hashlib
 import numpy
 from datetime import datetime
-import string
-import re
-from curses.ascii import isdigit
-import nltk
-from nltk.corpus import cmudict
-from nltk.tag.simplify import simplify_wsj_tag
+import itertools
 from collections import Counter
+from syllables import syllables
+from text_normalizer import normalizeText, normalizeTexts, preprocessText
+from pos_tagging import tagTexts, tagClass, ADJADV, VERB, NOUN
+from instrumentation import instruments
+from feature_registry import featureNames, integerFeatures, integerDefaults, selectedFeatures, needsInput, TFIDF
 import pdb
-d = cmudict.dict()
+TEXT_ANALYZER_VERSION = 1 # bump whenever a change to ReviewText alters its analysis results
 
 STOP_WORDS = ['a','able','about','across','after','all','almost','also','am','among','an','and','any','are','as','at', \
               'be','because','been','but','by','can','cannot','could','dear','did','do','does','either','else','ever',\
@@ -22,15 +26,358 @@ STOP_WORDS = ['a','able','about','across','after','all','almost','also','am','am
               'us','wants','was','we','were','what','when','where','which','while','who','whom','why','will','with','would','yet',\
               'you','your']
 
+def similarityToOtherReviews(processedText, otherProcessedTexts):
+    # mean over the other reviews of the mean tf-idf weight of this review's terms; None if it has no terms.
+    # This is the direct definition; BusinessTfidfIndex computes the same for all reviews of a business at once
+    terms = [c[0] for c in Counter(processedText.split()).most_common() if c[0] not in STOP_WORDS]
+    if len(terms) == 0:
+        return None
+    tf = [] # list of dictionaries (word -> frequency)
+    df = dict(zip(terms, [0]*len(terms)))
+    for otherProcessedText in otherProcessedTexts:
+        tf.append(dict(Counter(otherProcessedText.split()).most_common())) # term frequency
+        for term in tf[-1].keys():
+            if term in df:
+                df[term] = df[term] + 1
+    tfidfPerDocument = []
+    for d in tf:
+        tfidf = [0]*len(terms)
+        for i in xrange(len(terms)):
+            tfidf[i] = math.log(1 + d[terms[i]]) * math.log(float(len(tf))/df[terms[i]]) if terms[i] in d else 0
+        tfidfPerDocument.append(numpy.array(tfidf).mean())
+    return numpy.array(tfidfPerDocument).mean()
+
+SAMPLE_REBUILD_FACTOR = 2 # a sampled index without rows is rebuilt from its sample past this many terms per sampled term
+similaritySampleSize = None # set by configureSimilarity; None indexes every review of a business
+
+def configureSimilarity(sampleSize=None):
+    # with a sampleSize, the tf-idf index of a business with more reviews holds only the sampleSize of them with the
+    # smallest reviewRank, and similarityToOtherReviews is estimated against that sample: the index cost of a business
+    # is capped, and every other review is scored against it at once
+    global similaritySampleSize
+    similaritySampleSize = sampleSize
+
+def reviewRank(reviewId):
+    # pseudo-random rank of a review fixed by its id, so that every engine and pass samples the same reviews
+    if isinstance(reviewId, unicode):
+        reviewId = reviewId.encode('utf-8')
+    return struct.unpack('<Q', hashlib.md5(reviewId).digest()[:8])[0]
+
+def similaritySample(reviewIds):
+    # positions of the reviews of a business its tf-idf index holds, in order; None if it holds all of them
+    if similaritySampleSize is None or len(reviewIds) <= similaritySampleSize:
+        return None
+    ranks = [reviewRank(reviewId) for reviewId in reviewIds]
+    return sorted(heapq.nsmallest(similaritySampleSize, xrange(len(ranks)), key=ranks.__getitem__))
+
+def internId(id):
+    # one shared byte string per review, user or business id, instead of a unicode copy in every json record and object
+    return intern(id.encode('utf-8') if isinstance(id, unicode) else id)
+
+class Vocabulary(dict):
+    # term -> int32 id of every term seen by this process. The stop words get the first ids and are marked in a
+    # bitmap indexed by id, so a review's words are split and looked up once and stop words dropped by id.
+    def __init__(self, stopWords):
+        dict.__init__(self)
+        self.terms = [ ]
+        self.stopWords = bytearray()
+        for term in stopWords:
+            self.stopWords[self[term]] = 1
+
+    def __missing__(self, term):
+        id = len(self.terms)
+        self[term] = id
+        self.terms.append(term)
+        self.stopWords.append(0)
+        return id
+
+    def termIds(self, processedText):
+        # ids of the words of a processed text, in order
+        return numpy.array(map(self.__getitem__, processedText.split()), dtype=numpy.int32)
+
+    def isStopWord(self, ids):
+        return numpy.frombuffer(self.stopWords, dtype=numpy.uint8)[ids] == 1
+
+vocabulary = Vocabulary(STOP_WORDS)
+
+class TermCounts(object):
+    # packed bag of words of a processed text, all the tf-idf index needs of it: the vocabulary ids of its non stop
+    # words, ascending, and their frequencies. Ids are only meaningful within a process; terms() gives the words.
+    __slots__ = ['ids', 'counts']
+
+    def __init__(self, processedText):
+        ids = vocabulary.termIds(processedText)
+        (ids, counts) = numpy.unique(ids[~vocabulary.isStopWord(ids)], return_counts=True)
+        self.ids = array.array('i', ids.tostring())
+        self.counts = array.array('i', counts.astype(numpy.int32).tostring())
+
+    @classmethod
+    def fromTerms(cls, terms, counts):
+        termCounts = cls.__new__(cls)
+        termCounts.ids = array.array('i', [vocabulary[term] for term in terms])
+        termCounts.counts = array.array('i', counts)
+        return termCounts
+
+    def __len__(self):
+        return len(self.ids)
+
+    def terms(self):
+        return [vocabulary.terms[id] for id in self.ids]
+
+class TermBags(object):
+    # the TermCounts of many texts packed into one sparse (CSR) matrix: the ids and counts of text i are
+    # ids[indptr[i]:indptr[i + 1]] and counts[indptr[i]:indptr[i + 1]]
+    def __init__(self, indptr, ids, counts):
+        self.indptr = indptr
+        self.ids = array.array('i', numpy.asarray(ids, dtype=numpy.int32).tostring())
+        self.counts = array.array('i', numpy.asarray(counts, dtype=numpy.int32).tostring())
+
+    @classmethod
+    def fromTexts(cls, processedTexts, nwords=None):
+        # all texts are split, looked up and counted at once, each (text, id) pair being one int64 key. nwords are
+        # the words of each text if already counted (ReviewText.nwords); the texts are then split as one string.
+        if nwords is None:
+            words = [processedText.split() for processedText in processedTexts]
+            nwords = map(len, words)
+            words = itertools.chain.from_iterable(words)
+        else:
+            words = ' '.join(processedTexts).split()
+        nwords = numpy.asarray(nwords, dtype=numpy.int64)
+        ids = numpy.fromiter(itertools.imap(vocabulary.__getitem__, words), dtype=numpy.int64, count=nwords.sum())
+        rows = numpy.repeat(numpy.arange(len(nwords), dtype=numpy.int64), nwords)
+        kept = ~vocabulary.isStopWord(ids)
+        nterms = len(vocabulary.terms)
+        (keys, counts) = numpy.unique(rows[kept]*nterms + ids[kept], return_counts=True)
+        indptr = numpy.searchsorted(keys // nterms, numpy.arange(len(nwords) + 1))
+        return cls(indptr, keys % nterms, counts)
+
+    @classmethod
+    def concatenate(cls, termBags):
+        # one TermBags of the texts of several, in order
+        offsets = numpy.cumsum([0] + [len(bags.ids) for bags in termBags])
+        concatenated = cls(numpy.concatenate([[0]] + [bags.indptr[1:] + offset for bags, offset in zip(termBags, offsets)]), \
+                           numpy.zeros(0), numpy.zeros(0))
+        for bags in termBags:
+            concatenated.ids.extend(bags.ids)
+            concatenated.counts.extend(bags.counts)
+        return concatenated
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def __getitem__(self, i):
+        (start, end) = self.indptr[i:i + 2]
+        termCounts = TermCounts.__new__(TermCounts)
+        termCounts.ids = self.ids[start:end]
+        termCounts.counts = self.counts[start:end]
+        return termCounts
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+def reviewTerms(processedText):
+    # TermCounts of a processed review text, which may already be one
+    return processedText if isinstance(processedText, TermCounts) else TermCounts(processedText)
+
+class BusinessTfidfIndex(object):
+    def __init__(self, keepRows=True):
+        # inverted index over the reviews of one business: per-term document frequency and sum of log(1 + tf),
+        # plus each review's term frequencies as a sparse (CSR) row unless keepRows is False. Reviews can be
+        # added at any time. Terms are keyed by vocabulary id, pickled as their words. A sampled index (see
+        # fromReviews and addSampled) also has the similarities of the reviews it left out, or its sample.
+        self.termIds = { }
+        self.df = array.array('d')
+        self.weights = array.array('d')
+        self.nreviews = 0
+        self.keepRows = keepRows
+        self.reviewIds = [ ]
+        self.reviewIndex = { }
+        self.indptr = array.array('l', [0])
+        self.indices = array.array('l')
+        self.tf = array.array('d')
+        self.cachedSimilarities = None
+        self.outside = { } # review id -> similarity of the reviews left out of a sampled index with rows
+        self.sample = None # heap of (-reviewRank, TermCounts) of a sampled index without rows
+        self.sampleTerms = 0
+
+    @classmethod
+    def fromReviews(cls, keys, processedTexts, reviewIds=None):
+        # index over the reviews of a business, keyed by keys: on a sample of them if there are more than
+        # similaritySampleSize (ranked by reviewIds, default keys), the others getting their similarity to it
+        sample = similaritySample(reviewIds if reviewIds is not None else keys)
+        index = cls()
+        if sample is None:
+            for key, processedText in itertools.izip(keys, processedTexts):
+                index.addReview(key, processedText)
+            return index
+        inSample = numpy.zeros(len(keys), dtype=bool)
+        inSample[sample] = True
+        for i in sample:
+            index.addReview(keys[i], processedTexts[i])
+        others = numpy.flatnonzero(~inSample)
+        index.outside = dict(itertools.izip([keys[i] for i in others], index.similaritiesOf([processedTexts[i] for i in others])))
+        return index
+
+    def __len__(self):
+        return self.nreviews
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['termIds'] = dict((vocabulary.terms[id], termId) for id, termId in self.termIds.iteritems())
+        if self.sample is not None:
+            state['sample'] = [(rank, terms.terms(), list(terms.counts)) for rank, terms in self.sample]
+        return state
+
+    def __setstate__(self, state):
+        state['termIds'] = dict((vocabulary[term], termId) for term, termId in state['termIds'].iteritems())
+        if state.get('sample') is not None:
+            state['sample'] = [(rank, TermCounts.fromTerms(terms, counts)) for rank, terms, counts in state['sample']]
+        state.setdefault('outside', { })
+        state.setdefault('sample', None)
+        state.setdefault('sampleTerms', 0)
+        self.__dict__.update(state)
+
+    def addReview(self, reviewId, processedText):
+        self.nreviews = self.nreviews + 1
+        if self.keepRows:
+            self.reviewIndex[reviewId] = len(self.reviewIds)
+            self.reviewIds.append(reviewId)
+        terms = reviewTerms(processedText)
+        for term, n in itertools.izip(terms.ids, terms.counts):
+            termId = self.termIds.get(term)
+            if termId is None:
+                termId = len(self.df)
+                self.termIds[term] = termId
+                self.df.append(0.0)
+                self.weights.append(0.0)
+            self.df[termId] = self.df[termId] + 1
+            self.weights[termId] = self.weights[termId] + math.log(1 + n)
+            if self.keepRows:
+                self.indices.append(termId)
+                self.tf.append(n)
+        if self.keepRows:
+            self.indptr.append(len(self.indices))
+        self.cachedSimilarities = None
+
+    def addSampled(self, rank, processedText):
+        # adds a review of the given reviewRank to an index without rows holding only the similaritySampleSize
+        # reviews of smallest rank added so far: a review ranked below the largest of a full sample replaces it, whose
+        # terms are taken out again. Once replaced reviews left too many unused terms, it is rebuilt from the sample.
+        terms = reviewTerms(processedText)
+        if self.sample is None:
+            self.sample = [ ]
+        if len(self.sample) < similaritySampleSize:
+            heapq.heappush(self.sample, (-rank, terms))
+        elif rank < -self.sample[0][0]:
+            replaced = heapq.heapreplace(self.sample, (-rank, terms))[1]
+            self.removeReview(replaced)
+            self.sampleTerms = self.sampleTerms - len(replaced)
+        else:
+            return
+        self.addReview(None, terms)
+        self.sampleTerms = self.sampleTerms + len(terms)
+        if len(self.df) > SAMPLE_REBUILD_FACTOR * max(self.sampleTerms, 1):
+            index = BusinessTfidfIndex(keepRows=False)
+            for negativeRank, sampled in self.sample:
+                index.addReview(None, sampled)
+            (self.termIds, self.df, self.weights) = (index.termIds, index.df, index.weights)
+
+    def removeReview(self, terms):
+        # takes the TermCounts of a review added to an index without rows out again
+        self.nreviews = self.nreviews - 1
+        for term, n in itertools.izip(terms.ids, terms.counts):
+            termId = self.termIds[term]
+            self.df[termId] = self.df[termId] - 1
+            self.weights[termId] = self.weights[termId] - math.log(1 + n)
+        self.cachedSimilarities = None
+
+    def sampled(self, rank):
+        # whether a review of the given reviewRank added with addSampled is held by the index
+        return self.sample is None or len(self.sample) < similaritySampleSize or rank <= -self.sample[0][0]
+
+    def similarities(self):
+        # leave-one-out similarityToOtherReviews of every review in the index, in the order added; NaN where a
+        # review has no terms or there are no other reviews
+        if self.cachedSimilarities is not None:
+            return self.cachedSimilarities
+        nreviews = len(self.reviewIds)
+        indptr = numpy.frombuffer(self.indptr, dtype=numpy.dtype('l'))
+        nterms = numpy.diff(indptr)
+        similarities = numpy.zeros(nreviews) + numpy.nan
+        if nreviews > 1 and len(self.indices) > 0:
+            indices = numpy.frombuffer(self.indices, dtype=numpy.dtype('l'))
+            tf = numpy.frombuffer(self.tf)
+            rows = numpy.repeat(numpy.arange(nreviews), nterms)
+            otherDf = numpy.frombuffer(self.df)[indices] - 1
+            otherWeights = numpy.frombuffer(self.weights)[indices] - numpy.log(1 + tf)
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                tfidf = numpy.where(otherDf > 0, numpy.log((nreviews - 1)/otherDf) * otherWeights, 0.0)
+                totals = numpy.bincount(rows, weights=tfidf, minlength=nreviews)
+                similarities = numpy.where(nterms > 0, totals/(nterms*(nreviews - 1.0)), numpy.nan)
+        self.cachedSimilarities = similarities
+        return similarities
+
+    def similarity(self, reviewId):
+        similarity = self.similarities()[self.reviewIndex[reviewId]] if reviewId in self.reviewIndex else self.outside[reviewId]
+        return None if similarity != similarity else similarity
+
+    def similaritiesFor(self, reviewIds):
+        # similarities of the given reviews, held or left out by the index; NaN where there is none
+        similarities = self.similarities()
+        return numpy.array([similarities[self.reviewIndex[reviewId]] if reviewId in self.reviewIndex else self.outside[reviewId] \
+                            for reviewId in reviewIds])
+
+    def similaritiesOf(self, processedTexts):
+        # similarityOf each of the given reviews, none of them in the index, at once; NaN where it is None
+        termCounts = [reviewTerms(processedText) for processedText in processedTexts]
+        nterms = numpy.array([len(terms) for terms in termCounts], dtype=numpy.int64)
+        similarities = numpy.zeros(len(termCounts)) + numpy.nan
+        if self.nreviews == 0 or len(self.termIds) == 0 or nterms.sum() == 0:
+            return similarities
+        ids = numpy.concatenate([numpy.frombuffer(terms.ids, dtype=numpy.int32) for terms in termCounts if len(terms) > 0])
+        rows = numpy.repeat(numpy.arange(len(termCounts)), nterms)
+        indexIds = numpy.fromiter(self.termIds.iterkeys(), dtype=numpy.int64, count=len(self.termIds))
+        termIds = numpy.fromiter(self.termIds.itervalues(), dtype=numpy.int64, count=len(self.termIds))
+        order = numpy.argsort(indexIds)
+        positions = numpy.minimum(numpy.searchsorted(indexIds[order], ids), len(order) - 1)
+        termIds = termIds[order][positions]
+        df = numpy.where(indexIds[order][positions] == ids, numpy.frombuffer(self.df)[termIds], 0.0)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            tfidf = numpy.where(df > 0, numpy.log(self.nreviews/df) * numpy.frombuffer(self.weights)[termIds], 0.0)
+            totals = numpy.bincount(rows, weights=tfidf, minlength=len(termCounts))
+            similarities = numpy.where(nterms > 0, totals/(nterms*float(self.nreviews)), numpy.nan)
+        return similarities
+
+    def similarityOf(self, processedText, member=False):
+        # similarityToOtherReviews of a review from its text; if member, the review was added to the index and
+        # its own contribution is left out, otherwise it is compared against every review in the index
+        terms = reviewTerms(processedText)
+        nothers = self.nreviews - 1 if member else self.nreviews
+        if len(terms) == 0 or nothers <= 0:
+            return None
+        total = 0.0
+        for term, n in itertools.izip(terms.ids, terms.counts):
+            termId = self.termIds.get(term)
+            if termId is None:
+                continue
+            df = self.df[termId] - 1 if member else self.df[termId]
+            if df > 0:
+                weight = self.weights[termId] - math.log(1 + n) if member else self.weights[termId]
+                total = total + math.log(float(nothers)/df) * weight
+        return total/(len(terms)*nothers)
+
 class ReviewText(object):
-    def __init__(self, text, posAnalysis=None, readabilityAnalysis=None):
+    # attributes produced by text analysis, in the order used by getAnalysis/fromAnalysis
+    analysisFields = ['processedText', 'ncharacters', 'nwords', 'nsentences', 'npunctuation', 'containsClosed', \
+                      'nverbs', 'nnouns', 'nadjadv', 'nsyllables', 'npolysyllables', 'ari', 'fk', 'smog']
+    __slots__ = ['rawText'] + analysisFields
+
+    def __init__(self, text, posAnalysis=None, readabilityAnalysis=None, normalized=None, tags=None):
+        # normalized and tags are this text's normalizeText tuple and tagTexts tags when analyzed in a batch
         self.rawText = text
-        self.processedText = self.preprocessText(text)
-        self.ncharacters = len(self.processedText.translate(string.maketrans("", ""), string.punctuation).replace(' ', ''))
-        self.nwords = len(self.processedText.split())
-        self.nsentences = self.nsent(self.processedText)
-        self.npunctuation = len([x for x in self.rawText if x in string.punctuation])
-        self.containsClosed = 1 if self.processedText.find('closed') >= 0 else 0
+        (self.processedText, self.ncharacters, self.nwords, self.nsentences, self.npunctuation, self.containsClosed) = \
+            normalized if normalized is not None else normalizeText(text)
         self.nverbs = 0
         self.nnouns = 0
         self.nadjadv = 0
@@ -45,45 +392,44 @@ class ReviewText(object):
             posAnalysis = True
         if readabilityAnalysis is None:
             readabilityAnalysis = True
-        if posAnalysis:
+        if posAnalysis and tags is not None:
+            self.countTags(tags)
+        elif posAnalysis:
             self.analyzePosAndSyllables(self.processedText)
         if readabilityAnalysis:
             self.analyzeReadability(self.processedText)
 
+    @classmethod
+    def analyzeTexts(cls, texts, posAnalysis=None, readabilityAnalysis=None):
+        # ReviewTexts of many texts, normalized and POS tagged in one batch each
+        normalized = normalizeTexts(texts)
+        if posAnalysis is None or posAnalysis:
+            tags = tagTexts([textNormalized[0] for textNormalized in normalized])
+        else:
+            tags = [None] * len(texts)
+        return [cls(text, posAnalysis, readabilityAnalysis, textNormalized, textTags) \
+                for text, textNormalized, textTags in itertools.izip(texts, normalized, tags)]
+
+    @classmethod
+    def fromAnalysis(cls, text, analysis):
+        # rebuild a ReviewText from a getAnalysis() tuple without re-running the analysis
+        reviewText = cls.__new__(cls)
+        reviewText.rawText = text
+        for field, value in zip(cls.analysisFields, analysis):
+            setattr(reviewText, field, value)
+        return reviewText
+
+    def getAnalysis(self):
+        return tuple(getattr(self, field) for field in self.analysisFields)
+
+    def compact(self, keepTerms):
+        # drops the texts once the analysis is done; the processed text becomes TermCounts if keepTerms (the tf-idf
+        # index needs it), None otherwise
+        self.rawText = None
+        self.processedText = TermCounts(self.processedText) if keepTerms else None
+
     def preprocessText(self, text):
-        # remove quotation marks
-        text = text.replace('\"', ' ')
-        # deal with PS, p.s., p. s.
-        text = re.sub('p\.s\.', 'ps', text)
-        text = re.sub('p\. s\.', 'ps', text)
-        # remove repeated spaces
-        text = re.sub(' +', ' ', text)
-        # remove spaces before punctuation/newline
-        text = re.sub(' \n', '\n', text)
-        text = re.sub(' \.', '.', text)
-        text = re.sub(' ,', ',', text)
-        text = re.sub(' !', '!', text)
-        text = re.sub(' \?', '?', text)
-        # remove repeated newlines
-        text = re.sub('\n+', '\n', text)
-        # remove newlines
-        text = re.sub('\.\n', '. ', text)
-        text = re.sub('!\n', '! ', text)
-        text = re.sub(':\n', ': ', text)
-        text = re.sub('\?\n', '? ', text)
-        text = text.replace('\n', '.')
-        # remove digits eg 1., 2., and special characters
-        text = re.sub('[0-9]\.', ' ', text)
-        text = text.replace('-', ' ')
-        text = text.replace('*', ' ')
-        # remove repeated puntuation
-        text = re.sub('\.+', '. ', text)
-        text = re.sub('!+', '! ', text)
-        text = re.sub('\?+', '? ', text)
-        # remove repeated spaces
-        text = re.sub(' +', ' ', text)
-        text = text.encode('ascii', 'ignore').lower().strip()
-        return text
+        return preprocessText(text)
 
     def nsent(self, text):
         if len(text) == 0:
@@ -96,29 +442,25 @@ class ReviewText(object):
         return nsentences
 
     def nsyl(self, word):
-        if word in d:
-            return [len(list(y for y in x if isdigit(y[-1]))) for x in d[word]]
-        else:
-            return [-1]
+        # syllables of the first cmudict pronunciation, -1 for unknown words
+        return syllables(word)
 
     def analyzePosAndSyllables(self, text):
-        tags = nltk.pos_tag(nltk.word_tokenize(text))
-        tags = [(word, simplify_wsj_tag(tag)) for word, tag in tags]
-        adjadvtag = ['ADJ', 'ADV']
-        verbtag = ['V', 'VD', 'VG', 'VN'] # leaving out modal verbs MOD
-        nountag = ['N', 'NP'] # leaving out pronouns PRO
-        for p in tags:
-            syl = self.nsyl(p[0])[0]
-            if p[1] in adjadvtag:
-                self.nadjadv = self.nadjadv + 1
-            if p[1] in verbtag:
-                self.nverbs = self.nverbs + 1
-            if p[1] in nountag:
-                self.nnouns = self.nnouns + 1
+        self.countTags(tagTexts([text])[0])
+
+    def countTags(self, tags):
+        # tags is [(word, WSJ tag)] of the processed text
+        counts = [0, 0, 0, 0]
+        for word, tag in tags:
+            counts[tagClass(tag)] += 1
+            syl = self.nsyl(word)
             if syl > 0:
                 self.nsyllables = self.nsyllables + 1
             if syl >= 3:
                 self.npolysyllables = self.npolysyllables + 1
+        self.nadjadv = counts[ADJADV]
+        self.nverbs = counts[VERB]
+        self.nnouns = counts[NOUN]
 
     def analyzeReadability(self, text):
         if self.nsentences > 0 and self.nwords > 0:
@@ -127,7 +469,9 @@ class ReviewText(object):
             self.smog = 1.0430*math.sqrt(float(self.npolysyllables)*(30.0/float(self.nsentences))) + 3.1291
 
 class Review(object):
-    def __init__(self, jsonData, businessCategories, today, posAnalysis=None, readabilityAnalysis=None):
+    __slots__ = ['reviewId', 'userId', 'businessId', 'businessCategory', 'stars', 'age', 'funny', 'useful', 'cool', 'reviewText']
+
+    def __init__(self, jsonData, businessCategories, today, posAnalysis=None, readabilityAnalysis=None, reviewText=None, textCache=None):
         self.reviewId = jsonData['review_id']
         self.userId = jsonData['user_id']
         self.businessId = jsonData['business_id']
@@ -141,9 +485,57 @@ class Review(object):
             posAnalysis = True
         if readabilityAnalysis is None:
             readabilityAnalysis = True
-        self.reviewText = ReviewText(jsonData['text'], posAnalysis, readabilityAnalysis)
+        if reviewText is None and textCache is not None:
+            reviewText = textCache.reviewText(jsonData['text'], posAnalysis, readabilityAnalysis)
+        elif reviewText is None:
+            reviewText = ReviewText(jsonData['text'], posAnalysis, readabilityAnalysis)
+        self.reviewText = reviewText
+
+    def compact(self, keepTerms):
+        # see ReviewText.compact; ids are interned so that users, businesses and groups share them
+        self.reviewId = internId(self.reviewId)
+        self.userId = internId(self.userId)
+        self.businessId = internId(self.businessId)
+        self.reviewText.compact(keepTerms)
+
+class ReviewGroups(object):
+    def __init__(self, attribute, trainingReviews, testReviews):
+        # attribute value (eg userId) -> [Review] over the training and then the test reviews, built once;
+        # the training reviews of each group are a prefix of its list, so both views share the same lists
+        self.groups = { }
+        for review in trainingReviews.itervalues():
+            self.groups.setdefault(getattr(review, attribute), [ ]).append(review)
+        self.trainingCounts = dict((key, len(group)) for key, group in self.groups.iteritems())
+        for review in testReviews.itervalues():
+            self.groups.setdefault(getattr(review, attribute), [ ]).append(review)
+
+    def view(self, trainingOnly):
+        return ReviewGroupView(self, trainingOnly)
+
+class ReviewGroupView(object):
+    # read-only attribute value -> [Review] mapping over a ReviewGroups, restricted to training reviews if trainingOnly
+    def __init__(self, reviewGroups, trainingOnly):
+        self.reviewGroups = reviewGroups
+        self.trainingOnly = trainingOnly
+
+    def keys(self):
+        if self.trainingOnly:
+            return self.reviewGroups.trainingCounts.keys()
+        return self.reviewGroups.groups.keys()
+
+    def __contains__(self, key):
+        if self.trainingOnly:
+            return key in self.reviewGroups.trainingCounts
+        return key in self.reviewGroups.groups
+
+    def __getitem__(self, key):
+        if self.trainingOnly:
+            return itertools.islice(self.reviewGroups.groups[key], self.reviewGroups.trainingCounts[key])
+        return iter(self.reviewGroups.groups[key])
 
 class UserProfile(object):
+    __slots__ = ['funny', 'useful', 'cool', 'averageStars', 'reviewCount']
+
     def __init__(self, jsonData):
         self.funny = int(jsonData['votes']['funny']) if 'votes' in jsonData else None
         self.useful = int(jsonData['votes']['useful']) if 'votes' in jsonData else None
@@ -152,6 +544,8 @@ class UserProfile(object):
         self.reviewCount = int(jsonData['review_count'])
 
 class User(object):
+    __slots__ = ['userId', 'profile', 'reviews']
+
     def __init__(self, userId, jsonUserDict, reviewDict):
         # jsonUserDict is userId->json user data dictionary; reviewDict is userId->[Review] dictionary
         self.userId = userId
@@ -162,6 +556,8 @@ class User(object):
                 self.reviews[review.reviewId] = review
 
 class BusinessProfile(object):
+    __slots__ = ['closed', 'stars', 'reviewCount', 'category']
+
     def __init__(self, category, jsonData):
         self.closed = 0 if jsonData['open'] == True else 1
         self.stars = float(jsonData['stars'])
@@ -169,6 +565,8 @@ class BusinessProfile(object):
         self.category = category
 
 class Business(object):
+    __slots__ = ['businessId', 'profile', 'reviews', 'tfidfIndex']
+
     def __init__(self, businessId, category, jsonBusinessDict, reviewDict):
         # jsonBusinessDict is businessId->json business data dictionary; reviewDict is businessId->[Review] dictionary
         self.businessId = businessId
@@ -177,21 +575,39 @@ class Business(object):
         if businessId in reviewDict:
             for review in reviewDict[businessId]:
                 self.reviews[review.reviewId] = review
+        self.tfidfIndex = None
+
+    def getTfidfIndex(self):
+        # built on first use from this business's reviews
+        if self.tfidfIndex is None:
+            reviews = self.reviews.values()
+            self.tfidfIndex = BusinessTfidfIndex.fromReviews([review.reviewId for review in reviews], \
+                                                             [review.reviewText.processedText for review in reviews])
+        return self.tfidfIndex
 
 class ReviewFeatures(object):
-    header = ['logUsefulVotes', 'userId', 'businessId', 'userIsPublic', 'userHasVotes', 'userHasManySampleReviews', \
-              'businessHasProfile', 'businessHasManyReviews', 'businessHasManySampleReviews', 'numUserReviews', \
-              'numUserSampleReviews', 'numBusinessReviews', 'numBusinessSampleReviews', 'numUserSampleReviewsInCategory', \
-              'reviewIsModerate', 'reviewStars', 'userStarsSd', 'reviewVsUserAvg', 'reviewVsUserAvgNormalized', \
-              'businessStarsSd', 'reviewVsBusinessAvg', 'reviewVsBusinessAvgNormalized', 'reviewAge', 'reviewCharacters', \
-              'reviewWords', 'reviewSentences', 'reviewWordsPerSentence', 'reviewPunctuationPerSentence', 'reviewContainsClosed', \
-              'reviewAdjectivesAndAdverbs', 'reviewVerbs', 'reviewNouns', 'reviewAdjectivesAndAdverbsPerWord', 'reviewVerbsPerWord', \
-              'reviewNounsPerWord', 'reviewARI', 'reviewFK', 'reviewSMOG', 'earliestReview', 'funnyProfileVotesPerReview', \
-              'usefulProfileVotesPerReview', 'coolProfileVotesPerReview', 'funnyProfileVotesPerReviewPerDay', \
-              'usefulProfileVotesPerReviewPerDay', 'coolProfileVotesPerReviewPerDay', 'funnyVotesPerReview', 'usefulVotesPerReview', \
-              'coolVotesPerReview', 'funnyVotesPerReviewPerDay', 'usefulVotesPerReviewPerDay', 'coolVotesPerReviewPerDay', \
-              'userCharactersPerReview', 'userARI', 'userFK', 'userSMOG', 'businessClosed', 'earliestBusinessReview', \
-              'businessCharactersPerReview', 'businessARI', 'businessFK', 'businessSMOG', 'similarityToOtherReviews', 'category']
+    # columns, their integer subset and integer defaults come from the feature registry
+    header = featureNames()
+    integerFields = integerFeatures()
+    integerDefaults = integerDefaults()
+
+    @classmethod
+    def fromColumns(cls, columns, i, userId, businessId):
+        # ReviewFeatures from row i of column arrays (see aggregates.reviewFeatureColumns); NaN becomes the integer
+        # default of the feature, or 'NA', so that values are written as the rows engine writes them
+        features = cls.__new__(cls)
+        features.userId = userId
+        features.businessId = businessId
+        for name, column in columns.iteritems():
+            value = column[i]
+            if value != value:
+                value = cls.integerDefaults.get(name, 'NA')
+            elif name in cls.integerFields:
+                value = int(value)
+            else:
+                value = float(value)
+            setattr(features, name, value)
+        return features
 
     def __init__(self, review, user, business):
         # other user reviews and business reviews
@@ -346,34 +762,24 @@ class ReviewFeatures(object):
             self.userSMOG = 1.0430*math.sqrt(npolysyllables*(30.0/nsentences)) + 3.1291
 
     def calculateBusinessTextFeatures(self, businessReviewSamples, business, review):
-        terms = [c[0] for c in Counter(review.reviewText.processedText.split()).most_common() if c[0] not in STOP_WORDS]
         ncharacters = 0.0
         nwords = 0.0
         nsentences = 0.0
         nsyllables = 0.0
         npolysyllables = 0.0
-        tf = [] # list of dictionaries (word -> frequency)
-        df = dict(zip(terms, [0]*len(terms)))
         for businessReview in businessReviewSamples:
             ncharacters = ncharacters + businessReview.reviewText.ncharacters
             nwords = nwords + businessReview.reviewText.nwords
             nsentences = nsentences + businessReview.reviewText.nsentences
             nsyllables = nsyllables + businessReview.reviewText.nsyllables
             npolysyllables = npolysyllables + businessReview.reviewText.npolysyllables
-            tf.append(dict(Counter(businessReview.reviewText.processedText.split()).most_common())) # term frequency
-            for term in tf[-1].keys():
-                if term in df:
-                    df[term] = df[term] + 1
-
-        # calculate similarity to other reviews for this business
-        if len(terms) > 0:
-            tfidfPerDocument = []
-            for d in tf:
-                tfidf = [0]*len(terms)
-                for i in xrange(len(terms)):
-                    tfidf[i] = math.log(1 + d[terms[i]]) * math.log(float(len(tf))/df[terms[i]]) if terms[i] in d else 0
-                tfidfPerDocument.append(numpy.array(tfidf).mean())
-            self.similarityToOtherReviews = numpy.array(tfidfPerDocument).mean()
+
+        # calculate similarity to other reviews for this business, unless no selected feature needs the index
+        if needsInput(TFIDF):
+            with instruments.timer('similarity'):
+                similarity = business.getTfidfIndex().similarity(review.reviewId)
+            if similarity is not None:
+                self.similarityToOtherReviews = similarity
 
         self.businessCharactersPerReview = float(ncharacters)/self.numBusinessSampleReviews
         if nwords > 0 and nsentences > 0:
@@ -382,66 +788,5 @@ class ReviewFeatures(object):
             self.businessSMOG = 1.0430*math.sqrt(npolysyllables*(30.0/nsentences)) + 3.1291
 
     def getList(self):
-        return [self.logUsefulVotes, \
-                self.userId, \
-                self.businessId, \
-                self.userIsPublic, \
-                self.userHasVotes, \
-                self.userHasManySampleReviews, \
-                self.businessHasProfile, \
-                self.businessHasManyReviews, \
-                self.businessHasManySampleReviews, \
-                self.numUserReviews, \
-                self.numUserSampleReviews, \
-                self.numBusinessReviews, \
-                self.numBusinessSampleReviews , \
-                self.numUserSampleReviewsInCategory, \
-                self.reviewIsModerate, \
-                self.reviewStars, \
-                self.userStarsSd, \
-                self.reviewVsUserAvg, \
-                self.reviewVsUserAvgNormalized, \
-                self.businessStarsSd, \
-                self.reviewVsBusinessAvg, \
-                self.reviewVsBusinessAvgNormalized, \
-                self.reviewAge, \
-                self.reviewCharacters, \
-                self.reviewWords, \
-                self.reviewSentences, \
-                self.reviewWordsPerSentence, \
-                self.reviewPunctuationPerSentence, \
-                self.reviewContainsClosed, \
-                self.reviewAdjectivesAndAdverbs, \
-                self.reviewVerbs, \
-                self.reviewNouns, \
-                self.reviewAdjectivesAndAdverbsPerWord, \
-                self.reviewVerbsPerWord, \
-                self.reviewNounsPerWord, \
-                self.reviewARI, \
-                self.reviewFK, \
-                self.reviewSMOG, \
-                self.earliestReview, \
-                self.funnyProfileVotesPerReview, \
-                self.usefulProfileVotesPerReview, \
-                self.coolProfileVotesPerReview, \
-                self.funnyProfileVotesPerReviewPerDay, \
-                self.usefulProfileVotesPerReviewPerDay, \
-                self.coolProfileVotesPerReviewPerDay, \
-                self.funnyVotesPerReview, \
-                self.usefulVotesPerReview, \
-                self.coolVotesPerReview, \
-                self.funnyVotesPerReviewPerDay, \
-                self.usefulVotesPerReviewPerDay, \
-                self.coolVotesPerReviewPerDay, \
-                self.userCharactersPerReview, \
-                self.userARI, \
-                self.userFK, \
-                self.userSMOG, \
-                self.businessClosed, \
-                self.earliestBusinessReview, \
-                self.businessCharactersPerReview, \
-                self.businessARI, \
-                self.businessFK, \
-                self.businessSMOG, \
-                self.similarityToOtherReviews, \
-                self.category]
+        # values of the selected features (see feature_registry.configureFeatures), in header order
+        return [getattr(self, name) for name in selectedFeatures()]
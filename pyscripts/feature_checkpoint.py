@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+
+import os
+import sqlite3
+import cPickle
+import marshal
+import numpy
+from data_objects import ReviewFeatures, TermCounts
+from review_store import userProfileColumns, businessProfileColumns, hideUserVotes
+from feature_output import ID_COLUMNS, openFeatureWriter
+from instrumentation import instruments
+
+CHECKPOINT_VERSION = 2
+SPLITS = ['training', 'test'] # the test split's features use the aggregates of all reviews
+FEATURE_COLUMNS = [name for name in ReviewFeatures.header if name not in ID_COLUMNS]
+STATE_FILENAME = 'state.pkl'
+REVIEWS_FILENAME = 'reviews.npz'
+FEATURES_FILENAME = 'features_%s.npy'
+TERMS_FILENAME = 'terms.sqlite'
+COMMIT_INTERVAL = 10000 # term inserts between sqlite commits
+TERMS_QUERY_SIZE = 500 # rows per sqlite terms lookup, below sqlite's 999 variable limit
+
+class FeatureCheckpoint(object):
+    # the state of a streaming features.py run: per-user and per-business ReviewAggregates of both views (counts,
+    # star sums and sums of squares, vote and text statistic totals, earliest ages, per-business term document
+    # frequencies), id codes, profiles with their hidden votes, plus every review's columns and feature row.
+    # refresh() adds new reviews and recomputes only the rows of the users and businesses they touch. Review terms
+    # are kept in a sqlite file and only read back for the reviews whose similarity is recomputed.
+    # Only that recomputation scales with the update: the review columns and feature rows are held as whole arrays,
+    # so refresh copies them, writeFeatures rewrites every row of a changed split and save rewrites the state,
+    # columns and feature rows. This O(N) array I/O is kept deliberately, since the feature files are rewritten
+    # whole anyway; it is cheap next to the text analysis and aggregation a full run would redo.
+    def __init__(self, dirname):
+        self.dirname = dirname
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self.connection = sqlite3.connect(os.path.join(dirname, TERMS_FILENAME))
+        self.connection.execute('CREATE TABLE IF NOT EXISTS terms (row INTEGER PRIMARY KEY, terms BLOB NOT NULL)')
+        self.uncommitted = 0
+        self.settings = { }
+        self.users = None
+        self.businesses = None
+        self.aggregates = { }
+        self.userProfiles = None
+        self.userHasVotes = { }
+        self.inTrainingView = None
+        self.businessProfiles = None
+        self.columns = { }
+        self.reviewIds = [ ]
+        self.features = dict((split, [ ]) for split in SPLITS) # lists of row blocks until saved or loaded
+
+    def __len__(self):
+        return len(self.reviewIds)
+
+    def setState(self, users, businesses, aggregates, userProfiles, userHasVotes, inTrainingView, businessProfiles, settings):
+        # aggregates and userHasVotes are split -> ReviewAggregates / per-user hasVotes of the split's view
+        self.users = users
+        self.businesses = businesses
+        self.aggregates = aggregates
+        self.userProfiles = userProfiles
+        self.userHasVotes = userHasVotes
+        self.inTrainingView = inTrainingView
+        self.businessProfiles = businessProfiles
+        self.settings = settings
+
+    def addRows(self, split, store, featureColumns):
+        # appends a ReviewStore chunk of a split's reviews and their feature columns
+        self.putTerms(len(self), store.terms)
+        for name, column in store.columns.iteritems():
+            self.columns.setdefault(name, [ ]).append(column)
+        self.reviewIds.extend(store.reviewIds)
+        self.features[split].append(featureMatrix(featureColumns))
+
+    def putTerms(self, firstRow, terms):
+        # the TermCounts of the given rows, stored as words since vocabulary ids differ between runs; nothing is stored
+        # without the tf-idf feature
+        for i, termCounts in enumerate(terms or [ ]):
+            value = sqlite3.Binary(marshal.dumps((termCounts.terms(), termCounts.counts.tolist())))
+            self.connection.execute('INSERT OR REPLACE INTO terms (row, terms) VALUES (?, ?)', (firstRow + i, value))
+            self.uncommitted = self.uncommitted + 1
+            if self.uncommitted >= COMMIT_INTERVAL:
+                self.connection.commit()
+                self.uncommitted = 0
+
+    def terms(self, rows):
+        # TermCounts of the given review rows, in order
+        terms = { }
+        for i in xrange(0, len(rows), TERMS_QUERY_SIZE):
+            batch = [int(row) for row in rows[i:i + TERMS_QUERY_SIZE]]
+            query = 'SELECT row, terms FROM terms WHERE row IN (%s)' % ','.join('?' * len(batch))
+            for row, value in self.connection.execute(query, batch):
+                terms[row] = TermCounts.fromTerms(*marshal.loads(str(value)))
+        return [terms[int(row)] for row in rows]
+
+    def consolidate(self):
+        # turns the appended column and feature blocks into single arrays
+        for name, blocks in self.columns.items():
+            if isinstance(blocks, list):
+                self.columns[name] = numpy.concatenate(blocks)
+        for split in SPLITS:
+            if isinstance(self.features[split], list):
+                blocks = self.features[split]
+                self.features[split] = numpy.vstack(blocks) if len(blocks) > 0 else numpy.zeros((0, len(FEATURE_COLUMNS)))
+
+    def save(self):
+        # rewrites the whole checkpoint, except the terms of reviews already stored
+        self.consolidate()
+        self.connection.commit()
+        self.uncommitted = 0
+        state = {'version': CHECKPOINT_VERSION, 'settings': self.settings, 'users': self.users, 'businesses': self.businesses, \
+                 'aggregates': self.aggregates, 'userProfiles': self.userProfiles, 'userHasVotes': self.userHasVotes, \
+                 'inTrainingView': self.inTrainingView, 'businessProfiles': self.businessProfiles, 'reviewIds': self.reviewIds}
+        writeAtomically(os.path.join(self.dirname, STATE_FILENAME), lambda f: cPickle.dump(state, f, cPickle.HIGHEST_PROTOCOL))
+        writeAtomically(os.path.join(self.dirname, REVIEWS_FILENAME), lambda f: numpy.savez(f, **self.columns))
+        for split in SPLITS:
+            writeAtomically(os.path.join(self.dirname, FEATURES_FILENAME % split), lambda f: numpy.save(f, self.features[split]))
+
+    @classmethod
+    def load(cls, dirname, reviews=True):
+        # without reviews, only the aggregates, id codes and profiles are read (enough to score new reviews)
+        f = open(os.path.join(dirname, STATE_FILENAME), 'rb')
+        state = cPickle.load(f)
+        f.close()
+        if state['version'] != CHECKPOINT_VERSION:
+            raise ValueError('%s is a version %d feature checkpoint, expected version %d' % (dirname, state['version'], CHECKPOINT_VERSION))
+        checkpoint = cls(dirname)
+        checkpoint.setState(state['users'], state['businesses'], state['aggregates'], state['userProfiles'], state['userHasVotes'], \
+                            state['inTrainingView'], state['businessProfiles'], state['settings'])
+        if not reviews:
+            return checkpoint
+        checkpoint.reviewIds = state['reviewIds']
+        columns = numpy.load(os.path.join(dirname, REVIEWS_FILENAME))
+        checkpoint.columns = dict((name, columns[name]) for name in columns.files)
+        columns.close()
+        checkpoint.features = dict((split, numpy.load(os.path.join(dirname, FEATURES_FILENAME % split))) for split in SPLITS)
+        return checkpoint
+
+    def refresh(self, store, split, jsonUserDict, jsonBusinessDict, categories, hiddenVoteProbability):
+        # adds the new reviews of store, one split's reviews coded with this checkpoint's IdCoders, and recomputes
+        # the feature rows of every review sharing a user or business with them. jsonUserDict/jsonBusinessDict
+        # hold profile records of new users and businesses and of any whose profile changed. Returns the splits
+        # whose rows changed.
+        nusers = len(self.userProfiles['hasProfile'])
+        nbusinesses = len(self.businessProfiles['hasProfile'])
+        changedUsers = mergeProfiles(self.userProfiles, userProfileColumns, self.users, nusers, jsonUserDict)
+        changedBusinesses = mergeProfiles(self.businessProfiles, businessProfileColumns, self.businesses, nbusinesses, \
+                                          jsonBusinessDict, categories)
+        newUsers = numpy.unique(store.columns['userCode'])
+        newBusinesses = numpy.unique(store.columns['businessCode'])
+
+        # hidden votes of new users, of users whose profile changed and of users entering the training view
+        self.inTrainingView = numpy.concatenate([self.inTrainingView, numpy.zeros(len(self.users) - nusers, dtype=bool)])
+        redrawn = numpy.union1d(numpy.arange(nusers, len(self.users)), changedUsers)
+        redrawnTraining = redrawn
+        if split == 'training':
+            redrawnTraining = numpy.union1d(redrawn, newUsers[~self.inTrainingView[newUsers]])
+            self.inTrainingView[newUsers] = True
+        for s, codes, inView in [('training', redrawnTraining, self.inTrainingView), ('test', redrawn, numpy.ones(len(self.users), dtype=bool))]:
+            hasVotes = numpy.concatenate([self.userHasVotes[s], self.userProfiles['hasVotes'][len(self.userHasVotes[s]):]])
+            redraw = numpy.zeros(len(self.users), dtype=bool)
+            redraw[codes] = True
+            hasVotes[redraw] = hideUserVotes(self.userProfiles, redraw & inView, hiddenVoteProbability)[redraw]
+            self.userHasVotes[s] = hasVotes
+
+        # the new reviews join the aggregates of the views they belong to: test reviews only the test split's
+        self.putTerms(len(self), store.terms)
+        for name in self.columns:
+            self.columns[name] = numpy.concatenate([self.columns[name], store.columns[name]])
+        self.reviewIds.extend(store.reviewIds)
+        refreshed = [ ]
+        for s in SPLITS:
+            users = changedUsers
+            businesses = changedBusinesses
+            if s == 'test' or split == 'training':
+                self.aggregates[s].add(store.columns, terms=store.terms, reviewIds=store.reviewIds)
+                users = numpy.union1d(newUsers, changedUsers)
+                businesses = numpy.union1d(newBusinesses, changedBusinesses)
+            rows = self.splitRows(s)
+            affectedUser = numpy.zeros(len(self.users), dtype=bool)
+            affectedUser[users] = True
+            affectedBusiness = numpy.zeros(len(self.businesses), dtype=bool)
+            affectedBusiness[businesses] = True
+            positions = numpy.flatnonzero(affectedUser[self.columns['userCode'][rows]] | affectedBusiness[self.columns['businessCode'][rows]])
+            instruments.count('refreshed%sRows' % s.capitalize(), len(positions))
+            if len(positions) == 0:
+                continue
+            matrix = numpy.zeros((len(rows), len(FEATURE_COLUMNS)))
+            matrix[:len(self.features[s])] = self.features[s]
+            matrix[positions] = featureMatrix(self.featureColumns(s, rows[positions]))
+            self.features[s] = matrix
+            refreshed.append(s)
+        return refreshed
+
+    def splitRows(self, split):
+        return numpy.flatnonzero(self.columns['isTest'] == (1 if split == 'test' else 0))
+
+    def featureColumns(self, split, rows):
+        # the feature columns of the given review rows from the aggregates of a split's view
+        reviews = dict((name, column[rows]) for name, column in self.columns.iteritems())
+        userProfiles = dict(self.userProfiles)
+        userProfiles['hasVotes'] = self.userHasVotes[split]
+        aggregates = self.aggregates[split]
+        columns = aggregates.featureColumns(reviews, userProfiles, self.businessProfiles, included=True)
+        with instruments.timer('similarity'):
+            columns['similarityToOtherReviews'] = aggregates.similarities(reviews['businessCode'], self.terms(rows), included=True, \
+                                                                          reviewIds=[self.reviewIds[i] for i in rows])
+        return columns
+
+    def writeFeatures(self, split, filename, format='csv'):
+        # writes a split's feature file from the stored rows; nothing is recomputed
+        rows = self.splitRows(split)
+        columns = dict((name, self.features[split][:, k]) for k, name in enumerate(FEATURE_COLUMNS))
+        writer = instruments.timedWriter(openFeatureWriter(filename, format), filename, len(rows))
+        writer.writeColumns(columns, [self.users.ids[code] for code in self.columns['userCode'][rows]], \
+                            [self.businesses.ids[code] for code in self.columns['businessCode'][rows]])
+        writer.close()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+def featureMatrix(columns):
+    return numpy.column_stack([numpy.asarray(columns[name], dtype=float) for name in FEATURE_COLUMNS])
+
+def mergeProfiles(profiles, profileColumns, coder, ncoded, jsonDict, *args):
+    # extends profile columns (see review_store.userProfileColumns) to the ids coded since the checkpoint and
+    # replaces those of known ids with a different record in jsonDict; returns the codes of the changed ids
+    newProfiles = profileColumns(coder.ids[ncoded:], jsonDict, *args)
+    for name in profiles:
+        profiles[name] = numpy.concatenate([profiles[name], newProfiles[name]])
+    known = [id for id in jsonDict if coder.codes.get(id, ncoded) < ncoded]
+    codes = numpy.array([coder.codes[id] for id in known], dtype=int)
+    updated = profileColumns(known, jsonDict, *args)
+    changed = numpy.zeros(len(known), dtype=bool)
+    for name in profiles:
+        changed |= profiles[name][codes] != updated[name]
+    for name in profiles:
+        profiles[name][codes[changed]] = updated[name][changed]
+    return codes[changed]
+
+def writeAtomically(filename, write):
+    # write(f) to a temporary file renamed over filename, so a failed save leaves the previous checkpoint
+    f = open(filename + '.tmp', 'wb')
+    write(f)
+    f.close()
+    os.rename(filename + '.tmp', filename)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+
+import csv
+import json
+import os
+import struct
+import numpy
+from data_objects import ReviewFeatures
+from feature_registry import selectedFeatures
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FORMATS = ['csv', 'npy', 'parquet']
+COLUMNS_FORMAT = 'columns' # npy matrix of the feature columns as computed, NaN kept for integer defaults; not a feature file
+ID_COLUMNS = ['userId', 'businessId']
+NPY_HEADER_SIZE = 128 # bytes reserved for the .npy header, rewritten with the final row count on close
+PARQUET_ROW_GROUP_SIZE = 100000 # rows buffered per parquet row group
+
+def featureFilename(filename, format):
+    # output filename for a format, replacing the extension of the csv filename
+    return os.path.splitext(filename)[0] + '.' + format
+
+def schemaFilename(filename):
+    return filename + '.schema.json'
+
+def openFeatureWriter(filename, format='csv'):
+    # writer of ReviewFeatures rows; filename is the csv filename, its extension is replaced for other formats
+    if format == 'csv':
+        return CsvFeatureWriter(filename)
+    elif format == 'npy':
+        return NpyFeatureWriter(featureFilename(filename, format))
+    elif format == COLUMNS_FORMAT:
+        return NpyFeatureWriter(featureFilename(filename, 'npy'), fillDefaults=False)
+    elif format == 'parquet':
+        return ParquetFeatureWriter(featureFilename(filename, format))
+    raise ValueError('unknown feature output format: %s' % format)
+
+class FeatureWriter(object):
+    # writes ReviewFeatures rows given either as getList() values or as reviewFeatureColumns output; the columns
+    # are the features selected when the writer is opened
+    def __init__(self, filename):
+        self.filename = filename
+        self.header = selectedFeatures()
+        self.nrows = 0
+
+    def writeRow(self, values):
+        raise NotImplementedError
+
+    def writeRows(self, rows):
+        for values in rows:
+            self.writeRow(values)
+
+    def writeColumns(self, columns, userIds, businessIds):
+        # columns is header name -> array (NaN for 'NA'); userIds/businessIds are the id of each row
+        for j in xrange(len(userIds)):
+            self.writeRow(ReviewFeatures.fromColumns(columns, j, userIds[j], businessIds[j]).getList())
+
+    def close(self):
+        pass
+
+class CsvFeatureWriter(FeatureWriter):
+    def __init__(self, filename):
+        FeatureWriter.__init__(self, filename)
+        self.f = open(filename, 'wb')
+        self.csvWriter = csv.writer(self.f, delimiter=',')
+        self.csvWriter.writerow(self.header)
+
+    def writeRow(self, values):
+        self.csvWriter.writerow(values)
+        self.nrows = self.nrows + 1
+
+    def writeRows(self, rows):
+        self.csvWriter.writerows(rows)
+        self.nrows = self.nrows + len(rows)
+
+    def close(self):
+        self.f.close()
+
+class BinaryFeatureWriter(FeatureWriter):
+    # float64 rows with NaN for 'NA'; id columns hold integer codes into the id lists of the schema file. Unless
+    # fillDefaults is False, the NaN of feature columns at an integer default are written as that default.
+    def __init__(self, filename, fillDefaults=True):
+        FeatureWriter.__init__(self, filename)
+        self.fillDefaults = fillDefaults
+        self.idCodes = dict((name, { }) for name in ID_COLUMNS)
+        self.ids = dict((name, [ ]) for name in ID_COLUMNS)
+
+    def encodeIds(self, name, ids):
+        codes = self.idCodes[name]
+        encoded = numpy.zeros(len(ids))
+        for j, id in enumerate(ids):
+            code = codes.get(id)
+            if code is None:
+                code = len(self.ids[name])
+                codes[id] = code
+                self.ids[name].append(id)
+            encoded[j] = code
+        return encoded
+
+    def rowMatrix(self, values):
+        row = numpy.zeros((1, len(self.header)))
+        for k, (name, value) in enumerate(zip(self.header, values)):
+            if name in self.idCodes:
+                row[0, k] = self.encodeIds(name, [value])[0]
+            else:
+                row[0, k] = numpy.nan if value == 'NA' else value
+        return row
+
+    def columnMatrix(self, columns, userIds, businessIds):
+        matrix = numpy.zeros((len(userIds), len(self.header)))
+        for k, name in enumerate(self.header):
+            if name == 'userId':
+                matrix[:, k] = self.encodeIds(name, userIds)
+            elif name == 'businessId':
+                matrix[:, k] = self.encodeIds(name, businessIds)
+            elif name in ReviewFeatures.integerDefaults and self.fillDefaults:
+                matrix[:, k] = numpy.where(numpy.isnan(columns[name]), ReviewFeatures.integerDefaults[name], columns[name])
+            else:
+                matrix[:, k] = columns[name]
+        return matrix
+
+    def writeRow(self, values):
+        self.writeMatrix(self.rowMatrix(values))
+
+    def writeRows(self, rows):
+        if len(rows) > 0:
+            self.writeMatrix(numpy.vstack([self.rowMatrix(values) for values in rows]))
+
+    def writeColumns(self, columns, userIds, businessIds):
+        self.writeMatrix(self.columnMatrix(columns, userIds, businessIds))
+
+    def writeSchema(self, idColumns):
+        # sidecar json describing the columns; idColumns is id column name -> its id list or value type
+        schema = {'format': os.path.splitext(self.filename)[1][1:], 'rows': self.nrows, 'dtype': 'float64', \
+                  'columns': self.header, 'integerColumns': sorted(ReviewFeatures.integerFields.intersection(self.header)), \
+                  'idColumns': idColumns, 'missing': 'NaN'}
+        f = open(schemaFilename(self.filename), 'w')
+        json.dump(schema, f)
+        f.close()
+
+class NpyFeatureWriter(BinaryFeatureWriter):
+    # memory-mappable .npy matrix (numpy.load(filename, mmap_mode='r')), written row block by row block
+    def __init__(self, filename, fillDefaults=True):
+        BinaryFeatureWriter.__init__(self, filename, fillDefaults)
+        self.f = open(filename, 'wb')
+        self.f.write(self.npyHeader())
+
+    def npyHeader(self):
+        header = "{'descr': '<f8', 'fortran_order': False, 'shape': (%d, %d), }" % (self.nrows, len(self.header))
+        return '\x93NUMPY\x01\x00' + struct.pack('<H', NPY_HEADER_SIZE - 10) + header.ljust(NPY_HEADER_SIZE - 11) + '\n'
+
+    def writeMatrix(self, matrix):
+        self.f.write(numpy.ascontiguousarray(matrix, dtype='<f8').tostring())
+        self.nrows = self.nrows + len(matrix)
+
+    def close(self):
+        self.f.seek(0)
+        self.f.write(self.npyHeader())
+        self.f.close()
+        self.writeSchema(self.ids)
+
+class ParquetFeatureWriter(BinaryFeatureWriter):
+    # parquet file with float64 feature columns and string id columns, written in row groups; ids are only
+    # coded while rows are buffered
+    def __init__(self, filename):
+        if pyarrow is None:
+            raise ImportError('parquet output needs pyarrow')
+        BinaryFeatureWriter.__init__(self, filename)
+        self.writer = None
+        self.buffered = [ ]
+        self.nbuffered = 0
+
+    def writeMatrix(self, matrix):
+        self.buffered.append(matrix)
+        self.nbuffered = self.nbuffered + len(matrix)
+        self.nrows = self.nrows + len(matrix)
+        if self.nbuffered >= PARQUET_ROW_GROUP_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.nbuffered == 0 and self.writer is not None:
+            return
+        matrix = numpy.vstack(self.buffered) if self.nbuffered > 0 else numpy.zeros((0, len(self.header)))
+        arrays = [ ]
+        for k, name in enumerate(self.header):
+            if name in self.ids:
+                ids = self.ids[name]
+                arrays.append(pyarrow.array([ids[int(code)] for code in matrix[:, k]], type=pyarrow.string()))
+            else:
+                arrays.append(pyarrow.array(matrix[:, k], type=pyarrow.float64()))
+        table = pyarrow.Table.from_arrays(arrays, self.header)
+        if self.writer is None:
+            self.writer = pyarrow.parquet.ParquetWriter(self.filename, table.schema)
+        self.writer.write_table(table)
+        self.buffered = [ ]
+        self.nbuffered = 0
+        self.idCodes = dict((name, { }) for name in ID_COLUMNS)
+        self.ids = dict((name, [ ]) for name in ID_COLUMNS)
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        self.writeSchema(dict((name, 'string') for name in ID_COLUMNS))
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+from collections import namedtuple
+
+# inputs a feature is computed from; the upstream stages of inputs no selected feature needs are skipped
+REVIEW = 'review' # review json fields and business category
+TEXT = 'text' # normalizeText counts of the review text
+POS = 'pos' # pos tag counts, and the syllable counts of the tagged words
+USER = 'user' # user profile and aggregates over the user's other reviews
+BUSINESS = 'business' # business profile and aggregates over the business's other reviews
+TFIDF = 'tfidf' # per-business tf-idf index of the review texts
+INPUTS = [REVIEW, TEXT, POS, USER, BUSINESS, TFIDF]
+
+Feature = namedtuple('Feature', ['name', 'integer', 'inputs'])
+
+# the ReviewFeatures columns, in output order
+FEATURES = [Feature('logUsefulVotes', False, [REVIEW]),
+            Feature('userId', False, [REVIEW]),
+            Feature('businessId', False, [REVIEW]),
+            Feature('userIsPublic', True, [USER]),
+            Feature('userHasVotes', True, [USER]),
+            Feature('userHasManySampleReviews', True, [USER]),
+            Feature('businessHasProfile', True, [BUSINESS]),
+            Feature('businessHasManyReviews', True, [BUSINESS]),
+            Feature('businessHasManySampleReviews', True, [BUSINESS]),
+            Feature('numUserReviews', True, [USER]),
+            Feature('numUserSampleReviews', True, [USER]),
+            Feature('numBusinessReviews', True, [BUSINESS]),
+            Feature('numBusinessSampleReviews', True, [BUSINESS]),
+            Feature('numUserSampleReviewsInCategory', True, [USER]),
+            Feature('reviewIsModerate', True, [REVIEW]),
+            Feature('reviewStars', False, [REVIEW]),
+            Feature('userStarsSd', False, [USER]),
+            Feature('reviewVsUserAvg', False, [REVIEW, USER]),
+            Feature('reviewVsUserAvgNormalized', False, [REVIEW, USER]),
+            Feature('businessStarsSd', False, [BUSINESS]),
+            Feature('reviewVsBusinessAvg', False, [REVIEW, BUSINESS]),
+            Feature('reviewVsBusinessAvgNormalized', False, [REVIEW, BUSINESS]),
+            Feature('reviewAge', True, [REVIEW]),
+            Feature('reviewCharacters', True, [TEXT]),
+            Feature('reviewWords', True, [TEXT]),
+            Feature('reviewSentences', True, [TEXT]),
+            Feature('reviewWordsPerSentence', False, [TEXT]),
+            Feature('reviewPunctuationPerSentence', False, [TEXT]),
+            Feature('reviewContainsClosed', True, [TEXT]),
+            Feature('reviewAdjectivesAndAdverbs', True, [POS]),
+            Feature('reviewVerbs', True, [POS]),
+            Feature('reviewNouns', True, [POS]),
+            Feature('reviewAdjectivesAndAdverbsPerWord', False, [TEXT, POS]),
+            Feature('reviewVerbsPerWord', False, [TEXT, POS]),
+            Feature('reviewNounsPerWord', False, [TEXT, POS]),
+            Feature('reviewARI', False, [TEXT]),
+            Feature('reviewFK', False, [TEXT, POS]),
+            Feature('reviewSMOG', False, [TEXT, POS]),
+            Feature('earliestReview', True, [USER]),
+            Feature('funnyProfileVotesPerReview', False, [USER]),
+            Feature('usefulProfileVotesPerReview', False, [USER]),
+            Feature('coolProfileVotesPerReview', False, [USER]),
+            Feature('funnyProfileVotesPerReviewPerDay', False, [USER]),
+            Feature('usefulProfileVotesPerReviewPerDay', False, [USER]),
+            Feature('coolProfileVotesPerReviewPerDay', False, [USER]),
+            Feature('funnyVotesPerReview', False, [USER]),
+            Feature('usefulVotesPerReview', False, [USER]),
+            Feature('coolVotesPerReview', False, [USER]),
+            Feature('funnyVotesPerReviewPerDay', False, [USER]),
+            Feature('usefulVotesPerReviewPerDay', False, [USER]),
+            Feature('coolVotesPerReviewPerDay', False, [USER]),
+            Feature('userCharactersPerReview', False, [USER, TEXT]),
+            Feature('userARI', False, [USER, TEXT]),
+            Feature('userFK', False, [USER, TEXT, POS]),
+            Feature('userSMOG', False, [USER, TEXT, POS]),
+            Feature('businessClosed', True, [BUSINESS]),
+            Feature('earliestBusinessReview', True, [BUSINESS]),
+            Feature('businessCharactersPerReview', False, [BUSINESS, TEXT]),
+            Feature('businessARI', False, [BUSINESS, TEXT]),
+            Feature('businessFK', False, [BUSINESS, TEXT, POS]),
+            Feature('businessSMOG', False, [BUSINESS, TEXT, POS]),
+            Feature('similarityToOtherReviews', False, [BUSINESS, TEXT, TFIDF]),
+            Feature('category', True, [REVIEW])]
+FEATURE_INDEX = dict((feature.name, feature) for feature in FEATURES)
+
+# integer value ReviewFeatures gives these features, which are never 'NA', when there is nothing to compute them from;
+# feature column arrays hold NaN there
+INTEGER_DEFAULTS = dict([('logUsefulVotes', -1)] + \
+                        [(name, 0) for name in ['reviewWordsPerSentence', 'reviewPunctuationPerSentence', \
+                                                'reviewAdjectivesAndAdverbsPerWord', 'reviewVerbsPerWord', 'reviewNounsPerWord', \
+                                                'reviewARI', 'reviewFK', 'reviewSMOG', 'userCharactersPerReview', 'userARI', \
+                                                'userFK', 'userSMOG', 'businessCharactersPerReview', 'businessARI', 'businessFK', \
+                                                'businessSMOG', 'similarityToOtherReviews']])
+
+selected = [feature.name for feature in FEATURES] # set by configureFeatures
+selectedInputs = frozenset(INPUTS)
+
+def featureNames():
+    return [feature.name for feature in FEATURES]
+
+def integerFeatures():
+    return set(feature.name for feature in FEATURES if feature.integer)
+
+def integerDefaults():
+    return dict(INTEGER_DEFAULTS)
+
+def requiredInputs(names):
+    return frozenset(input for name in names for input in FEATURE_INDEX[name].inputs)
+
+def configureFeatures(names=None):
+    # selects the features written by a run, kept in registry order; None selects all of them
+    global selected, selectedInputs
+    if names is None:
+        names = featureNames()
+    unknown = [name for name in names if name not in FEATURE_INDEX]
+    if len(unknown) > 0:
+        raise ValueError('unknown features: %s' % ', '.join(unknown))
+    selected = [feature.name for feature in FEATURES if feature.name in set(names)]
+    selectedInputs = requiredInputs(selected)
+
+def selectedFeatures():
+    return selected
+
+def needsInput(input):
+    # whether any selected feature is computed from input
+    return input in selectedInputs
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+
+import sys
+import json
+import time
+import Queue
+import argparse
+import threading
+import BaseHTTPServer
+import SocketServer
+import numpy
+from datetime import datetime
+import features
+from data_objects import ReviewText, ReviewFeatures, configureSimilarity
+from review_store import ReviewStoreBuilder
+from feature_checkpoint import FeatureCheckpoint
+from feature_registry import POS, TFIDF, configureFeatures, selectedFeatures, needsInput
+from pos_tagging import configureTagger, currentTagger
+
+REQUIRED_FIELDS = ['review_id', 'user_id', 'business_id', 'stars', 'date', 'text']
+STRING_FIELDS = ['review_id', 'user_id', 'business_id', 'text']
+BATCH_SIZE = 64 # most reviews scored together by the micro-batcher
+
+class KnownIdCoder(object):
+    # the codes of an IdCoder's ids without adding new ones; unknown ids share the code after the last known one,
+    # an empty group in the scorer's aggregates
+    def __init__(self, coder):
+        self.coder = coder
+        self.ids = coder.ids
+        self.unknown = len(coder)
+
+    def encode(self, id):
+        return self.coder.codes.get(id, self.unknown)
+
+class ScoringCategories(dict):
+    # business id -> category cluster; businesses without a cluster get 0
+    def __missing__(self, businessId):
+        return 0
+
+class FeatureScorer(object):
+    # ReviewFeatures rows of new reviews against the aggregates of every review of a feature checkpoint (see
+    # features.py --checkpoint), loaded once. A scored review is not one of the aggregated reviews, so nothing is
+    # left out for it, and user profile votes are used as they are rather than hidden at random.
+    def __init__(self, checkpointDir, categories, today=features.TEST_DATE):
+        checkpoint = FeatureCheckpoint.load(checkpointDir, reviews=False)
+        checkpoint.close()
+        configureTagger(*checkpoint.settings['posTagger'])
+        configureSimilarity(checkpoint.settings.get('similaritySample'))
+        if needsInput(POS):
+            currentTagger() # loaded now rather than by the first request
+        self.users = KnownIdCoder(checkpoint.users)
+        self.businesses = KnownIdCoder(checkpoint.businesses)
+        self.aggregates = checkpoint.aggregates['test']
+        self.aggregates.users.resize(len(checkpoint.users) + 1)
+        self.aggregates.businesses.resize(len(checkpoint.businesses) + 1)
+        self.userProfiles = dict((name, numpy.concatenate([column, numpy.zeros(1, dtype=column.dtype)])) \
+                                 for name, column in checkpoint.userProfiles.iteritems())
+        self.businessProfiles = dict((name, numpy.concatenate([column, numpy.zeros(1, dtype=column.dtype)])) \
+                                     for name, column in checkpoint.businessProfiles.iteritems())
+        self.categories = ScoringCategories(categories)
+        self.today = today
+
+    def invalid(self, data):
+        # why a review json record cannot be scored, or None
+        if not isinstance(data, dict):
+            return 'not a review json object'
+        missing = [field for field in REQUIRED_FIELDS if field not in data]
+        if len(missing) > 0:
+            return 'missing fields: %s' % ', '.join(missing)
+        notStrings = [field for field in STRING_FIELDS if not isinstance(data[field], basestring)]
+        if len(notStrings) > 0:
+            return 'not strings: %s' % ', '.join(notStrings)
+        try:
+            datetime.strptime(data['date'], '%Y-%m-%d')
+            float(data['stars'])
+        except (TypeError, ValueError):
+            return 'invalid date or stars'
+        return None
+
+    def score(self, records):
+        # {'review_id', 'features': header name -> value (None for NA)} or {'review_id', 'error'} of each review
+        # json record, the valid ones analyzed and scored as one batch
+        results = [None] * len(records)
+        valid = [ ]
+        for i, data in enumerate(records):
+            error = self.invalid(data)
+            if error is not None:
+                reviewId = data.get('review_id') if isinstance(data, dict) else None
+                results[i] = {'review_id': reviewId if isinstance(reviewId, basestring) else None, 'error': error}
+            else:
+                valid.append(i)
+        if len(valid) == 0:
+            return results
+
+        reviewTexts = ReviewText.analyzeTexts([records[i]['text'] for i in valid], needsInput(POS))
+        builder = ReviewStoreBuilder(needsInput(TFIDF), self.users, self.businesses)
+        for i, reviewText in zip(valid, reviewTexts):
+            builder.addReview(records[i], self.categories, self.today, reviewText, isTest=True)
+        store = builder.build()
+        columns = self.aggregates.featureColumns(store.columns, self.userProfiles, self.businessProfiles, included=False)
+        if needsInput(TFIDF):
+            columns['similarityToOtherReviews'] = self.aggregates.similarities(store.columns['businessCode'], store.terms, included=False)
+        names = selectedFeatures()
+        for j, i in enumerate(valid):
+            values = ReviewFeatures.fromColumns(columns, j, records[i]['user_id'], records[i]['business_id']).getList()
+            results[i] = {'review_id': records[i]['review_id'], \
+                          'features': dict((name, None if value == 'NA' else value) for name, value in zip(names, values))}
+        return results
+
+def scoreRecords(scorer, records):
+    # scorer.score, or an error for each record when the batch fails, so that the server keeps serving
+    try:
+        return scorer.score(records)
+    except Exception, e:
+        return [{'error': 'scoring failed: %s' % e}] * len(records)
+
+def takeBatch(queue, window, batchSize):
+    # blocks for the first item of a queue, then takes more for up to window seconds or batchSize items
+    batch = [queue.get()]
+    deadline = time.time() + window
+    while len(batch) < batchSize and batch[-1] is not None:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(queue.get(timeout=remaining))
+        except Queue.Empty:
+            break
+    return batch
+
+class MicroBatcher(object):
+    # scores the reviews of concurrent requests together: requests arriving within window seconds of the first one
+    # are analyzed and tagged in one batch, raising throughput under load for at most window seconds of latency
+    def __init__(self, scorer, window=0.0, batchSize=BATCH_SIZE):
+        self.scorer = scorer
+        self.window = window
+        self.batchSize = batchSize
+        self.queue = Queue.Queue()
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    def score(self, records):
+        # called from request threads; blocks until the records are scored
+        request = {'records': records, 'done': threading.Event()}
+        self.queue.put(request)
+        request['done'].wait()
+        return request['results']
+
+    def run(self):
+        while True:
+            batch = takeBatch(self.queue, self.window, self.batchSize)
+            records = [data for request in batch for data in request['records']]
+            results = scoreRecords(self.scorer, records)
+            for request in batch:
+                request['results'] = results[:len(request['records'])]
+                results = results[len(request['records']):]
+                request['done'].set()
+
+class ScoringRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # POST a review json object, or a list of them, to get its features back in the same shape
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.getheader('content-length', 0)))
+        try:
+            data = json.loads(body)
+        except ValueError:
+            self.respond(400, {'error': 'invalid json'})
+            return
+        results = self.server.batcher.score(data if isinstance(data, list) else [data])
+        self.respond(200, results if isinstance(data, list) else results[0])
+
+    def respond(self, status, result):
+        response = json.dumps(result)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+class ScoringServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+def serveHttp(scorer, host, port, window, batchSize):
+    server = ScoringServer((host, port), ScoringRequestHandler)
+    server.batcher = MicroBatcher(scorer, window, batchSize)
+    sys.stderr.write('scoring reviews on http://%s:%d/\n' % (host, port))
+    server.serve_forever()
+
+def readLines(stream, queue):
+    for line in iter(stream.readline, ''):
+        queue.put(line)
+    queue.put(None)
+
+def serveLines(scorer, input, output, window, batchSize):
+    # one review json per input line, one result json per output line in the same order; lines arriving within
+    # window seconds of each other are scored together
+    lines = Queue.Queue()
+    reader = threading.Thread(target=readLines, args=(input, lines))
+    reader.daemon = True
+    reader.start()
+    while True:
+        batch = takeBatch(lines, window, batchSize)
+        finished = batch[-1] is None
+        records = [ ]
+        for line in batch[:-1] if finished else batch:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                records.append(None)
+        for result in scoreRecords(scorer, records):
+            output.write(json.dumps(result) + '\n')
+        output.flush()
+        if finished:
+            break
+
+def main():
+    parser = argparse.ArgumentParser(description='Score new reviews against a features.py --checkpoint, over stdin/stdout ' + \
+                                                 'json lines or a local http server.')
+    parser.add_argument('checkpoint', help='checkpoint directory written by features.py --engine streaming --checkpoint')
+    parser.add_argument('--data-dir', default=features.DATA_DIR, help='directory with business_clusters.csv')
+    parser.add_argument('--today', default=features.TEST_DATE.strftime('%Y-%m-%d'), help='date review ages are counted to')
+    parser.add_argument('--features', default=None, metavar='NAMES', help='comma separated features to return (default all)')
+    parser.add_argument('--http', type=int, default=None, metavar='PORT', help='serve POST requests on this port instead of stdin')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--batch-window', type=float, default=0.0, metavar='MS', \
+                        help='milliseconds to wait for more reviews to score together (0 = score each as it comes)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='most reviews scored together')
+    args = parser.parse_args()
+    try:
+        configureFeatures(args.features.split(',') if args.features is not None else None)
+    except ValueError, e:
+        parser.error(str(e))
+    features.setDataDir(args.data_dir)
+    scorer = FeatureScorer(args.checkpoint, features.loadBusinessCategories(), datetime.strptime(args.today, '%Y-%m-%d'))
+    if args.http is not None:
+        serveHttp(scorer, args.host, args.http, args.batch_window/1000.0, args.batch_size)
+    else:
+        serveLines(scorer, sys.stdin, sys.stdout, args.batch_window/1000.0, args.batch_size)
+
+if __name__ == '__main__':
+    main()
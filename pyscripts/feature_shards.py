@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import zlib
+import array
+import cPickle
+import argparse
+import numpy
+import features
+from review_store import IdCoder, userProfileColumns, businessProfileColumns, hideUserVotes
+from aggregates import ReviewAggregates
+from feature_output import FORMATS, COLUMNS_FORMAT, ID_COLUMNS, openFeatureWriter, featureFilename, schemaFilename
+from feature_checkpoint import SPLITS, writeAtomically
+from feature_registry import FEATURE_INDEX, configureFeatures, selectedFeatures
+from pos_tagging import TAGGERS, configureTagger
+from data_objects import configureSimilarity
+from instrumentation import instruments
+from json_ingest import decode
+
+# a sharded features.py --engine streaming run, in steps coordinated only through the files of a work directory:
+#   partition      splits the review and business json files into shards by a hash of the business id
+#   aggregate K    first streaming pass over shard K: its business aggregates and partial user aggregates
+#   users          merges the partial user aggregates of every shard and draws the hidden votes, once
+#   features K     second streaming pass over shard K with the merged user aggregates
+#   merge          interleaves the shards' feature rows into the feature files, in review file order
+# A shard directory is laid out like a data directory, so the aggregate and features steps of a shard can run on
+# any node holding its directory, the manifest and (for features) the users file.
+COMMANDS = ['partition', 'aggregate', 'users', 'features', 'merge', 'run']
+MANIFEST_FILENAME = 'manifest.json'
+USERS_FILENAME = 'users.pkl' # merged user aggregates and profiles, read by every shard's features step
+ORDER_FILENAME = 'order_%s.npy' # shard of each review of a split, in review file order
+SHARD_DIRNAME = 'shard-%04d'
+SHARD_USERS_FILENAME = 'shard_users.pkl' # partial user aggregates of a shard
+SHARD_BUSINESSES_FILENAME = 'shard_businesses.pkl' # business aggregates of a shard
+TEXTS_FILENAME = 'texts.sqlite' # text analysis cache shared by a shard's two passes
+MERGE_BLOCK_SIZE = 10000 # feature rows merged at a time
+
+def shardOf(businessId, nshards):
+    # stable across processes and machines, unlike hash()
+    return (zlib.crc32(businessId.encode('utf-8')) & 0xffffffff) % nshards
+
+def shardDirname(workDir, shard):
+    return os.path.join(workDir, SHARD_DIRNAME % shard)
+
+def saveState(filename, state):
+    writeAtomically(filename, lambda f: cPickle.dump(state, f, cPickle.HIGHEST_PROTOCOL))
+
+def loadState(filename):
+    f = open(filename, 'rb')
+    state = cPickle.load(f)
+    f.close()
+    return state
+
+def loadManifest(workDir):
+    f = open(os.path.join(workDir, MANIFEST_FILENAME), 'r')
+    manifest = json.load(f)
+    f.close()
+    return manifest
+
+def configure(manifest):
+    # the tagger, features and similarity sample of a sharded run are those given to partition
+    configureTagger(*manifest['posTagger'])
+    configureFeatures(manifest['features'])
+    configureSimilarity(manifest.get('similaritySample'))
+
+def jsonFilenames():
+    # (data directory relative filename, split of its reviews or None for business records) of the json files a
+    # shard gets its part of
+    return [(os.path.relpath(filename, features.DATA_DIR), split) for filename, split in \
+            [(features.TRAINING_REVIEW_FILENAME, 'training'), (features.TEST_REVIEW_FILENAME, 'test'), \
+             (features.TRAINING_BUSINESS_FILENAME, None), (features.TEST_BUSINESS_FILENAME, None)]]
+
+def partition(workDir, dataDir, nshards, featureNames, posTagger, memoryBudget=None, spillDir=None, similaritySample=None):
+    # writes each review and business json record to the shard of its business, the shard order of the reviews of
+    # each split, each shard's part of business_clusters.csv and the manifest of the run
+    features.setDataDir(dataDir)
+    categories = features.loadBusinessCategories()
+    shardDirs = [shardDirname(workDir, shard) for shard in xrange(nshards)]
+    for relpath, split in jsonFilenames():
+        for shardDir in shardDirs:
+            if not os.path.isdir(os.path.dirname(os.path.join(shardDir, relpath))):
+                os.makedirs(os.path.dirname(os.path.join(shardDir, relpath)))
+    with instruments.stage('partition') as stage:
+        stage.records = 0
+        for relpath, split in jsonFilenames():
+            outputs = [open(os.path.join(shardDir, relpath), 'wb') for shardDir in shardDirs]
+            order = array.array('i')
+            f = open(os.path.join(features.DATA_DIR, relpath), 'rb')
+            for line in f:
+                if not line.strip():
+                    continue
+                shard = shardOf(decode(line)['business_id'], nshards)
+                outputs[shard].write(line if line.endswith('\n') else line + '\n')
+                order.append(shard)
+            f.close()
+            for output in outputs:
+                output.close()
+            if split is not None:
+                numpy.save(os.path.join(workDir, ORDER_FILENAME % split), numpy.frombuffer(order, dtype=numpy.int32))
+            stage.records = stage.records + len(order)
+    outputs = [open(os.path.join(shardDir, 'business_clusters.csv'), 'w') for shardDir in shardDirs]
+    for output in outputs:
+        output.write('id,category\n')
+    for businessId, category in categories.iteritems():
+        outputs[shardOf(businessId, nshards)].write('%s,%d\n' % (businessId, category))
+    for output in outputs:
+        output.close()
+    manifest = {'shards': nshards, 'dataDir': dataDir, 'features': featureNames, 'posTagger': list(posTagger), \
+                'memoryBudget': memoryBudget, 'spillDir': spillDir, 'similaritySample': similaritySample}
+    writeAtomically(os.path.join(workDir, MANIFEST_FILENAME), lambda f: json.dump(manifest, f, indent=1))
+
+def openShardAnalysis(shardDir, workers):
+    features.setDataDir(shardDir)
+    return features.openTextAnalysis(workers, os.path.join(shardDir, TEXTS_FILENAME))
+
+def aggregateShard(workDir, shard, workers=1, chunkSize=features.CHUNK_SIZE, memoryBudget=None, spillDir=None):
+    # first pass over a shard; its user aggregates are partial (users review businesses of other shards), its
+    # business aggregates are complete. With a memoryBudget (MB), its reviews are grouped out of core as by
+    # features.py --memory-budget.
+    shardDir = shardDirname(workDir, shard)
+    features.setDataDir(shardDir)
+    categories = features.loadBusinessCategories()
+    (pool, textCache) = openShardAnalysis(shardDir, workers)
+    users = IdCoder()
+    businesses = IdCoder()
+    try:
+        (aggregates, ntrainingUsers) = features.aggregatePass(categories, users, businesses, pool, chunkSize, \
+                                                              chunkSize * features.CHUNKS_PER_WORKER * workers, textCache, \
+                                                              memoryBudget, spillDir)
+    finally:
+        features.closeTextAnalysis(pool, textCache)
+    userAggregates = { }
+    for split in SPLITS:
+        userAggregates[split] = ReviewAggregates()
+        (userAggregates[split].users, userAggregates[split].userCategories) = (aggregates[split].users, aggregates[split].userCategories)
+        (aggregates[split].users, aggregates[split].userCategories) = (ReviewAggregates().users, ReviewAggregates().userCategories)
+    saveState(os.path.join(shardDir, SHARD_USERS_FILENAME), {'users': users, 'ntrainingUsers': ntrainingUsers, 'aggregates': userAggregates})
+    saveState(os.path.join(shardDir, SHARD_BUSINESSES_FILENAME), {'businesses': businesses, 'aggregates': aggregates})
+
+def mergeUsers(workDir, dataDir):
+    # the user aggregates of every review from the shards' partial ones, the user profiles and their hidden votes;
+    # users seen in the training reviews of any shard are in the training view
+    manifest = loadManifest(workDir)
+    users = IdCoder()
+    aggregates = dict((split, ReviewAggregates()) for split in SPLITS)
+    trainingUsers = [ ]
+    with instruments.stage('mergeUsers') as stage:
+        for shard in xrange(manifest['shards']):
+            state = loadState(os.path.join(shardDirname(workDir, shard), SHARD_USERS_FILENAME))
+            codes = numpy.array([users.encode(userId) for userId in state['users'].ids], dtype=numpy.int64)
+            for split in SPLITS:
+                aggregates[split].mergeUsers(state['aggregates'][split], codes)
+            trainingUsers.append(codes[:state['ntrainingUsers']])
+        stage.records = len(users)
+    inTrainingView = numpy.zeros(len(users), dtype=bool)
+    for codes in trainingUsers:
+        inTrainingView[codes] = True
+    features.setDataDir(dataDir)
+    with instruments.stage('loadProfiles', records=len(users)):
+        userProfiles = userProfileColumns(users.ids, features.loadUserData())
+    userHasVotes = {'training': hideUserVotes(userProfiles, inTrainingView, features.HIDDEN_VOTES_PROBABILITY), \
+                    'test': hideUserVotes(userProfiles, numpy.ones(len(users), dtype=bool), features.HIDDEN_VOTES_PROBABILITY)}
+    saveState(os.path.join(workDir, USERS_FILENAME), {'users': users, 'aggregates': aggregates, 'userProfiles': userProfiles, \
+                                                      'userHasVotes': userHasVotes})
+
+def shardFeatures(workDir, shard, workers=1, chunkSize=features.CHUNK_SIZE):
+    # second pass over a shard, its feature columns written to npy files in the shard directory (integer defaults
+    # still NaN, for merge to write as features.py would); users are coded as in the users file, so their aggregates
+    # and profiles index directly
+    shardDir = shardDirname(workDir, shard)
+    broadcast = loadState(os.path.join(workDir, USERS_FILENAME))
+    state = loadState(os.path.join(shardDir, SHARD_BUSINESSES_FILENAME))
+    features.setDataDir(shardDir)
+    categories = features.loadBusinessCategories()
+    aggregates = state['aggregates']
+    userProfiles = { }
+    for split in SPLITS:
+        (aggregates[split].users, aggregates[split].userCategories) = (broadcast['aggregates'][split].users, broadcast['aggregates'][split].userCategories)
+        userProfiles[split] = dict(broadcast['userProfiles'])
+        userProfiles[split]['hasVotes'] = broadcast['userHasVotes'][split]
+    businesses = state['businesses']
+    with instruments.stage('loadProfiles', records=len(businesses)):
+        businessProfiles = businessProfileColumns(businesses.ids, features.loadBusinessData(), categories)
+    (pool, textCache) = openShardAnalysis(shardDir, workers)
+    try:
+        features.featurePass(categories, aggregates, userProfiles, businessProfiles, broadcast['users'], businesses, pool, chunkSize, \
+                             chunkSize * features.CHUNKS_PER_WORKER * workers, textCache, COLUMNS_FORMAT)
+    finally:
+        features.closeTextAnalysis(pool, textCache)
+
+class ShardRows(object):
+    # the feature rows of one split of a shard, read in order from its npy file
+    def __init__(self, filename):
+        self.filename = filename
+        self.matrix = numpy.load(filename, mmap_mode='r')
+        f = open(schemaFilename(filename), 'r')
+        schema = json.load(f)
+        f.close()
+        self.header = schema['columns']
+        self.ids = dict((name, numpy.array(ids, dtype=object)) for name, ids in schema['idColumns'].iteritems())
+        self.nread = 0
+
+    def take(self, n):
+        rows = numpy.asarray(self.matrix[self.nread:self.nread + n])
+        if len(rows) != n:
+            raise ValueError('%s has %d rows, the partition order expects more' % (self.filename, len(self.matrix)))
+        self.nread = self.nread + n
+        return rows
+
+def mergeFeatures(workDir, dataDir, format='csv'):
+    # writes the feature files of dataDir from the shards' rows, in the order of the partitioned review files
+    manifest = loadManifest(workDir)
+    header = selectedFeatures()
+    idColumns = [k for k, name in enumerate(header) if name in ID_COLUMNS]
+    splitShards = [ ]
+    for shard in xrange(manifest['shards']):
+        features.setDataDir(shardDirname(workDir, shard))
+        splitShards.append(dict((split, featureFilename(outputFilename, 'npy')) for split, reviewFilename, today, isTest, outputFilename \
+                                in features.streamingSplits()))
+    features.setDataDir(dataDir)
+    with instruments.stage('merge') as stage:
+        stage.records = 0
+        for split, reviewFilename, today, isTest, outputFilename in features.streamingSplits():
+            order = numpy.load(os.path.join(workDir, ORDER_FILENAME % split))
+            shards = [ShardRows(filenames[split]) for filenames in splitShards]
+            for shardRows in shards:
+                if shardRows.header != header:
+                    raise ValueError('%s has columns %s, expected %s' % (shardRows.filename, ','.join(shardRows.header), ','.join(header)))
+            writer = instruments.timedWriter(openFeatureWriter(outputFilename, format), outputFilename, len(order))
+            for start in xrange(0, len(order), MERGE_BLOCK_SIZE):
+                block = order[start:start + MERGE_BLOCK_SIZE]
+                rows = numpy.zeros((len(block), len(header)))
+                ids = dict((name, numpy.zeros(len(block), dtype=object)) for name in ID_COLUMNS)
+                for shard in numpy.unique(block):
+                    positions = numpy.flatnonzero(block == shard)
+                    rows[positions] = shards[shard].take(len(positions))
+                    for k in idColumns:
+                        ids[header[k]][positions] = shards[shard].ids[header[k]][rows[positions, k].astype(int)]
+                columns = dict((name, rows[:, k]) for k, name in enumerate(header) if name not in ID_COLUMNS)
+                writer.writeColumns(columns, ids['userId'], ids['businessId'])
+            writer.close()
+            for shardRows in shards:
+                if shardRows.nread != len(shardRows.matrix):
+                    raise ValueError('%s has %d rows, the partition order expects %d' % (shardRows.filename, len(shardRows.matrix), shardRows.nread))
+            stage.records = stage.records + len(order)
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description='Run features.py --engine streaming as hash-partitioned shards, one step at a ' + \
+                                                 'time: partition, aggregate K (each shard), users, features K (each shard), merge; ' + \
+                                                 'or all of them in this process with run.')
+    parser.add_argument('command', choices=COMMANDS)
+    parser.add_argument('shard', type=int, nargs='?', default=None, help='shard number of the aggregate and features steps')
+    parser.add_argument('--work-dir', required=True, help='directory of the manifest, shards and merged user aggregates')
+    parser.add_argument('--data-dir', default=None, \
+                        help='directory with the Yelp json data and business_clusters.csv, where merge writes the feature ' + \
+                             'files (default the one given to partition)')
+    parser.add_argument('--shards', type=int, default=None, help='partition: number of shards')
+    parser.add_argument('--workers', type=int, default=1, help='processes used for review text analysis (1 = serial)')
+    parser.add_argument('--chunk-size', type=int, default=features.CHUNK_SIZE, help='reviews per text analysis task')
+    parser.add_argument('--format', choices=FORMATS, default='csv', help='merge: feature file format')
+    parser.add_argument('--pos-tagger', choices=TAGGERS, default='nltk', help='partition: pos tagger of the text analysis')
+    parser.add_argument('--pos-lexicon', default=None, help='partition: lexicon file of the lexicon tagger')
+    parser.add_argument('--features', default=None, metavar='NAMES', help='partition: comma separated feature columns (default all)')
+    parser.add_argument('--similarity-sample', type=int, default=None, metavar='N', \
+                        help='partition: estimate similarityToOtherReviews of popular businesses as features.py --similarity-sample')
+    parser.add_argument('--memory-budget', type=float, default=None, metavar='MB', \
+                        help='partition: group the reviews of each shard out of core in aggregate, as features.py --memory-budget')
+    parser.add_argument('--spill-dir', default=None, metavar='DIR', \
+                        help='partition: directory for the --memory-budget runs on the nodes running aggregate ' + \
+                             '(default their system temporary directory)')
+    parser.add_argument('--instrument', action='store_true', help='report wall/cpu time, records/sec and peak memory of each stage')
+    args = parser.parse_args()
+    if args.command in ['aggregate', 'features'] and args.shard is None:
+        parser.error('%s needs a shard number' % args.command)
+    if args.command in ['partition', 'run']:
+        if args.shards is None or args.shards < 1:
+            parser.error('%s needs --shards' % args.command)
+        if args.data_dir is None:
+            args.data_dir = features.DATA_DIR
+        if args.features is not None:
+            args.features = args.features.split(',')
+            unknown = [name for name in args.features if name not in FEATURE_INDEX]
+            if len(unknown) > 0:
+                parser.error('unknown features: %s' % ', '.join(unknown))
+        if args.similarity_sample is not None and args.similarity_sample < 1:
+            parser.error('--similarity-sample must be at least 1')
+        if args.memory_budget is not None and args.memory_budget <= 0:
+            parser.error('--memory-budget must be positive')
+        if args.spill_dir is not None and args.memory_budget is None:
+            parser.error('--spill-dir holds the runs of --memory-budget')
+    elif args.similarity_sample is not None or args.memory_budget is not None or args.spill_dir is not None:
+        parser.error('--similarity-sample, --memory-budget and --spill-dir are given to partition, and kept in the manifest')
+    return args
+
+def main():
+    args = parseArguments()
+    if args.instrument:
+        instruments.enable()
+    if args.command in ['partition', 'run']:
+        if not os.path.isdir(args.work_dir):
+            os.makedirs(args.work_dir)
+        partition(args.work_dir, args.data_dir, args.shards, args.features, (args.pos_tagger, args.pos_lexicon), \
+                  args.memory_budget, args.spill_dir, args.similarity_sample)
+    manifest = loadManifest(args.work_dir)
+    configure(manifest)
+    dataDir = args.data_dir if args.data_dir is not None else manifest['dataDir']
+    if args.shard is not None and not 0 <= args.shard < manifest['shards']:
+        sys.exit('shard %d is not one of the %d shards of %s' % (args.shard, manifest['shards'], args.work_dir))
+    shards = range(manifest['shards']) if args.command == 'run' else [args.shard]
+    if args.command in ['aggregate', 'run']:
+        for shard in shards:
+            aggregateShard(args.work_dir, shard, args.workers, args.chunk_size, manifest.get('memoryBudget'), manifest.get('spillDir'))
+    if args.command in ['users', 'run']:
+        mergeUsers(args.work_dir, dataDir)
+    if args.command in ['features', 'run']:
+        for shard in shards:
+            shardFeatures(args.work_dir, shard, args.workers, args.chunk_size)
+    if args.command in ['merge', 'run']:
+        mergeFeatures(args.work_dir, dataDir, args.format)
+
+if __name__ == '__main__':
+    main()
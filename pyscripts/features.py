@@ -1,115 +1,198 @@
 #!/usr/bin/env python
 
-import json
+import sys
+import time
 from datetime import datetime
 import csv
 import random
+import argparse
+import itertools
+import functools
+import multiprocessing
+import os
+import tempfile
+import numpy
 from data_objects import *
+from text_cache import ReviewTextCache
+from review_store import IdCoder, ReviewStoreBuilder, userProfileColumns, businessProfileColumns, hideUserVotes
+from aggregates import ReviewAggregates, TimedReviewAggregates, viewFeatureColumns
+from feature_output import FORMATS, openFeatureWriter
+from feature_checkpoint import FeatureCheckpoint
+from feature_registry import FEATURE_INDEX, POS, TFIDF, configureFeatures, needsInput
+import pos_tagging
+from pos_tagging import TAGGERS, configureTagger
+from instrumentation import instruments
+from pipeline import STAGES, QUEUE_DEPTHS, WRITE_BATCH_SIZE, configurePipeline, runAhead, pipelinedWriter
+from group_runs import GroupRuns
+from json_ingest import JsonFileReader, loadJsonRecords, reportTo, USER_FIELDS, BUSINESS_FIELDS
 import pdb
 
 DATA_DIR = '../data/'
-BUSINESS_CATEGORIES_FILENAME = DATA_DIR + 'business_clusters.csv'
-TRAINING_REVIEW_FILENAME = DATA_DIR + 'training/json/yelp_training_set_review.json'
-TEST_REVIEW_FILENAME = DATA_DIR + 'test/json/yelp_test_set_review.json'
-TRAINING_USER_FILENAME = DATA_DIR + 'training/json/yelp_training_set_user.json'
-TEST_USER_FILENAME = DATA_DIR + 'test/json/yelp_test_set_user.json'
-TRAINING_BUSINESS_FILENAME = DATA_DIR + 'training/json/yelp_training_set_business.json'
-TEST_BUSINESS_FILENAME = DATA_DIR + 'test/json/yelp_test_set_business.json'
-TRAINING_OUTPUTFILE = DATA_DIR + 'training/training_features.csv'
-TEST_OUTPUTFILE = DATA_DIR + 'test/test_features.csv'
+
+def setDataDir(dataDir):
+    # (re)defines the input and output filenames below dataDir, eg a directory written by synthetic_data.py
+    global DATA_DIR, BUSINESS_CATEGORIES_FILENAME, TRAINING_REVIEW_FILENAME, TEST_REVIEW_FILENAME, TRAINING_USER_FILENAME, \
+           TEST_USER_FILENAME, TRAINING_BUSINESS_FILENAME, TEST_BUSINESS_FILENAME, TRAINING_OUTPUTFILE, TEST_OUTPUTFILE
+    DATA_DIR = os.path.join(dataDir, '')
+    BUSINESS_CATEGORIES_FILENAME = DATA_DIR + 'business_clusters.csv'
+    TRAINING_REVIEW_FILENAME = DATA_DIR + 'training/json/yelp_training_set_review.json'
+    TEST_REVIEW_FILENAME = DATA_DIR + 'test/json/yelp_test_set_review.json'
+    TRAINING_USER_FILENAME = DATA_DIR + 'training/json/yelp_training_set_user.json'
+    TEST_USER_FILENAME = DATA_DIR + 'test/json/yelp_test_set_user.json'
+    TRAINING_BUSINESS_FILENAME = DATA_DIR + 'training/json/yelp_training_set_business.json'
+    TEST_BUSINESS_FILENAME = DATA_DIR + 'test/json/yelp_test_set_business.json'
+    TRAINING_OUTPUTFILE = DATA_DIR + 'training/training_features.csv'
+    TEST_OUTPUTFILE = DATA_DIR + 'test/test_features.csv'
+
+setDataDir(DATA_DIR)
 TRAINING_DATE = datetime.strptime('2013-01-19', '%Y-%m-%d')
 TEST_DATE = datetime.strptime('2013-03-12', '%Y-%m-%d')
+CHUNK_SIZE = 256 # reviews per task sent to a text analysis worker
+CHUNKS_PER_WORKER = 8 # task chunks per worker read ahead from the review file
+HIDDEN_VOTES_PROBABILITY = 0.3 # fraction of user profiles whose votes are hidden
+STREAM_CHUNK_SIZE = 10000 # reviews per chunk in the streaming engine
 
-def loadReviews(categories):
-    f = open(TRAINING_REVIEW_FILENAME, 'r')
-    trainingReviews = { }
-    trainingReviewIds = [ ]
-    i = 0
-    for line in f:
-        data = json.loads(line)
-        trainingReviews[data['review_id']] = Review(data, categories, TRAINING_DATE)
-        trainingReviewIds.append(data['review_id'])
-        i = i + 1
-    f.close()
+def analyzeTexts(texts, posAnalysis=True):
+    # runs in a worker process for a chunk of texts, tagged in one batch; only the compact analysis tuples are sent back,
+    # with the seconds spent pos tagging them
+    start = pos_tagging.taggingSeconds
+    analyses = [reviewText.getAnalysis() for reviewText in ReviewText.analyzeTexts(texts, posAnalysis)]
+    return (analyses, pos_tagging.taggingSeconds - start)
 
-    f = open(TEST_REVIEW_FILENAME, 'r')
-    testReviews = { }
-    testReviewIds = [ ]
-    i = 0
-    for line in f:
-        data = json.loads(line)
-        testReviews[data['review_id']] = Review(data, categories, TEST_DATE)
-        testReviewIds.append(data['review_id'])
-        i = i + 1
-    f.close()
+def collectAnalyses(chunkResults):
+    # the analysis tuples of analyzeTexts results, adding up their tagging time
+    for analyses, taggingSeconds in chunkResults:
+        instruments.add('posTagging', taggingSeconds)
+        for analysis in analyses:
+            yield analysis
+
+def chunks(items, chunkSize):
+    return [items[i:i + chunkSize] for i in xrange(0, len(items), chunkSize)]
+
+def analyzeBlock(block, pool, chunkSize, textCache=None):
+    # analysis tuples for a block of review json records, in order; only cache misses are analyzed, in the pool
+    # if there is one. Pos tagging is skipped unless a selected feature needs it.
+    start = time.time()
+    posAnalysis = needsInput(POS)
+    analyses = [None] * len(block)
+    if textCache is not None:
+        analyses = [textCache.get(data['text'], posAnalysis) for data in block]
+    misses = [i for i in xrange(len(block)) if analyses[i] is None]
+    textChunks = chunks([block[i]['text'] for i in misses], chunkSize)
+    analyze = functools.partial(analyzeTexts, posAnalysis=posAnalysis)
+    chunkResults = pool.imap(analyze, textChunks) if pool is not None else itertools.imap(analyze, textChunks)
+    for i, analysis in itertools.izip(misses, collectAnalyses(chunkResults)):
+        analyses[i] = analysis
+        if textCache is not None:
+            textCache.put(block[i]['text'], analysis, posAnalysis)
+    instruments.add('textAnalysis', time.time() - start)
+    instruments.count('analyzedTexts', len(misses))
+    instruments.count('cachedTexts', len(block) - len(misses))
+    return analyses
+
+def readReviewBlocks(filename, blockSize):
+    # the review json records of a file in blocks of blockSize
+    reader = JsonFileReader(filename) # review records are not kept, so all of their fields are decoded
+    records = iter(reader)
+    progress = instruments.progress(filename, os.path.getsize(filename), 'bytes')
+    while True:
+        block = list(itertools.islice(records, blockSize))
+        if len(block) == 0:
+            break
+        progress.update(reader.bytes)
+        yield block
+
+def readReviewFile(filename, pool=None, chunkSize=CHUNK_SIZE, blockSize=None, textCache=None):
+    # yields (json data, ReviewText) for each review of a file, in file order: a block of reviews is read, its text
+    # analysis fanned out to the pool (or done here in chunks), then the reviews are yielded. Pipelined, blocks are
+    # decoded and analyzed in threads of their own while the reviews of earlier blocks are used.
+    if blockSize is None:
+        blockSize = chunkSize * CHUNKS_PER_WORKER
+    blocks = runAhead(readReviewBlocks(filename, blockSize), 'decode')
+    analyzed = runAhead(((block, analyzeBlock(block, pool, chunkSize, textCache)) for block in blocks), 'analysis')
+    for block, analyses in analyzed:
+        for data, analysis in itertools.izip(block, analyses):
+            yield (data, ReviewText.fromAnalysis(data['text'], analysis))
+
+def loadReviewFile(filename, categories, today, pool=None, chunkSize=CHUNK_SIZE, blockSize=None, textCache=None, compact=False):
+    # with compact, each review's texts are dropped once analyzed (see Review.compact); otherwise the processed text
+    # is replaced by its TermCounts if the tf-idf feature needs it
+    reviews = { }
+    reviewIds = [ ]
+    keepTerms = needsInput(TFIDF)
+    for data, reviewText in readReviewFile(filename, pool, chunkSize, blockSize, textCache):
+        review = Review(data, categories, today, reviewText=reviewText)
+        if compact:
+            review.compact(keepTerms)
+        elif keepTerms:
+            reviewText.processedText = TermCounts(reviewText.processedText)
+        reviews[review.reviewId] = review
+        reviewIds.append(review.reviewId)
+    return (reviews, reviewIds)
+
+def openTextAnalysis(workers, textCacheFilename):
+    # workers use the tagger configured here
+    pool = multiprocessing.Pool(workers, configureTagger, pos_tagging.taggerConfiguration) if workers > 1 else None
+    textCache = ReviewTextCache(textCacheFilename) if textCacheFilename is not None else None
+    return (pool, textCache)
+
+def closeTextAnalysis(pool, textCache):
+    if pool is not None:
+        pool.close()
+        pool.join()
+    if textCache is not None:
+        textCache.close()
+
+def loadReviews(categories, workers=1, chunkSize=CHUNK_SIZE, textCacheFilename=None, compact=False):
+    (pool, textCache) = openTextAnalysis(workers, textCacheFilename)
+    blockSize = chunkSize * CHUNKS_PER_WORKER * workers
+    try:
+        (trainingReviews, trainingReviewIds) = loadReviewFile(TRAINING_REVIEW_FILENAME, categories, TRAINING_DATE, pool, chunkSize, blockSize, \
+                                                              textCache, compact)
+        (testReviews, testReviewIds) = loadReviewFile(TEST_REVIEW_FILENAME, categories, TEST_DATE, pool, chunkSize, blockSize, textCache, compact)
+    finally:
+        closeTextAnalysis(pool, textCache)
 
     return (trainingReviews, trainingReviewIds, testReviews, testReviewIds)
 
-def loadUsers(reviews):
-    # get all unique user IDs within reviews
-    userIds = set([review.userId for review in reviews.values()])
+def loadReviewStore(categories, workers=1, chunkSize=CHUNK_SIZE, textCacheFilename=None):
+    # columnar alternative to loadReviews; no Review objects are kept
+    (pool, textCache) = openTextAnalysis(workers, textCacheFilename)
+    blockSize = chunkSize * CHUNKS_PER_WORKER * workers
+    builder = ReviewStoreBuilder(keepTerms=needsInput(TFIDF))
+    try:
+        for data, reviewText in readReviewFile(TRAINING_REVIEW_FILENAME, pool, chunkSize, blockSize, textCache):
+            builder.addReview(data, categories, TRAINING_DATE, reviewText, isTest=False)
+        for data, reviewText in readReviewFile(TEST_REVIEW_FILENAME, pool, chunkSize, blockSize, textCache):
+            builder.addReview(data, categories, TEST_DATE, reviewText, isTest=True)
+    finally:
+        closeTextAnalysis(pool, textCache)
 
-    # load json data
-    f = open(TRAINING_USER_FILENAME, 'r')
-    jsonUserDict = { }
-    for line in f:
-        jsonData = json.loads(line)
-        jsonUserDict[jsonData['user_id']] = jsonData
-    f.close()
+    return builder.build()
 
-    f = open(TEST_USER_FILENAME, 'r')
-    for line in f:
-        jsonData = json.loads(line)
-        jsonUserDict[jsonData['user_id']] = jsonData
-    f.close()
+def loadUserData():
+    return loadJsonRecords([TRAINING_USER_FILENAME, TEST_USER_FILENAME], 'user_id', USER_FIELDS)
 
-    # get userId -> [Review] dictionary
-    reviewDict = { }
-    for review in reviews.values():
-        if review.userId not in reviewDict:
-            reviewDict[review.userId] = [ ]
-        reviewDict[review.userId].append(review)
+def loadBusinessData():
+    return loadJsonRecords([TRAINING_BUSINESS_FILENAME, TEST_BUSINESS_FILENAME], 'business_id', BUSINESS_FIELDS)
 
-    # get dict of users
+def loadUsers(reviewDict, jsonUserDict):
+    # reviewDict is a userId -> [Review] view (see ReviewGroups); it holds every user within its reviews
     users = { }
-    for userId in userIds:
+    for userId in reviewDict.keys():
         users[userId] = User(userId, jsonUserDict, reviewDict)
         if (users[userId].profile is not None):
-            if (random.random() < 0.3):
+            if (random.random() < HIDDEN_VOTES_PROBABILITY):
                 users[userId].profile.funny = None
                 users[userId].profile.useful = None
                 users[userId].profile.cool = None
 
     return users
 
-def loadBusinesses(reviews, categories):
-    # get all unique business IDs within reviews
-    businessIds = set([review.businessId for review in reviews.values()])
-
-    # load json data
-    f = open(TRAINING_BUSINESS_FILENAME, 'r')
-    jsonBusinessDict = { }
-    for line in f:
-        jsonData = json.loads(line)
-        jsonBusinessDict[jsonData['business_id']] = jsonData
-    f.close()
-
-    f = open(TEST_BUSINESS_FILENAME, 'r')
-    for line in f:
-        jsonData = json.loads(line)
-        jsonBusinessDict[jsonData['business_id']] = jsonData
-    f.close()
-
-    # get businessId -> [Review] dictionary
-    reviewDict = { }
-    for review in reviews.values():
-        if review.businessId not in reviewDict:
-            reviewDict[review.businessId] = [ ]
-        reviewDict[review.businessId].append(review)
-
-    # get dict of businesses
+def loadBusinesses(reviewDict, jsonBusinessDict, categories):
+    # reviewDict is a businessId -> [Review] view (see ReviewGroups); it holds every business within its reviews
     businesses = { }
-    for businessId in businessIds:
+    for businessId in reviewDict.keys():
         businesses[businessId] = Business(businessId, categories[businessId], jsonBusinessDict, reviewDict)
 
     return businesses
@@ -128,26 +211,411 @@ def loadBusinessCategories():
     f.close()
     return categories
 
-def writeFeatures(reviewIds, reviews, users, businesses, filename):
-    f = open(filename, 'wb')
-    csvWriter = csv.writer(f, delimiter=',')
-    csvWriter.writerow(ReviewFeatures.header)
+def openWriter(filename, format='csv', total=None):
+    # feature writer with its writing time measured, run by a writer thread when pipelined
+    return pipelinedWriter(instruments.timedWriter(openFeatureWriter(filename, format), filename, total))
+
+def writeFeatures(reviewIds, reviews, users, businesses, filename, format='csv'):
+    writer = openWriter(filename, format, len(reviewIds))
     for reviewId in reviewIds:
         review = reviews[reviewId]
         features = ReviewFeatures(review, users[review.userId], businesses[review.businessId])
-        csvWriter.writerow(features.getList())
-    f.close()
+        writer.writeRow(features.getList())
+    writer.close()
+
+def rowIds(reviewColumns, rows, userIds, businessIds):
+    # user and business ids of the given rows of review columns
+    return ([userIds[code] for code in reviewColumns['userCode'][rows]], [businessIds[code] for code in reviewColumns['businessCode'][rows]])
+
+def writeFeatureColumns(view, rows, filename, format='csv'):
+    # writeFeatures for the vectorized engine: every row's features are computed at once from group aggregates
+    store = view.store
+    columns = viewFeatureColumns(view, rows)
+    writer = openWriter(filename, format, len(rows))
+    (userIds, businessIds) = rowIds(store.columns, rows, store.userIds, store.businessIds)
+    writer.writeColumns(columns, userIds, businessIds)
+    writer.close()
+
+def readReviewChunks(filename, categories, today, isTest, users, businesses, pool, chunkSize, blockSize, textCache):
+    # yields the reviews of a file as ReviewStores of at most STREAM_CHUNK_SIZE reviews, with shared id codes
+    builder = ReviewStoreBuilder(needsInput(TFIDF), users, businesses)
+    for data, reviewText in readReviewFile(filename, pool, chunkSize, blockSize, textCache):
+        builder.addReview(data, categories, today, reviewText, isTest)
+        if len(builder) >= STREAM_CHUNK_SIZE:
+            yield builder.build()
+            builder = ReviewStoreBuilder(needsInput(TFIDF), users, businesses)
+    if len(builder) > 0:
+        yield builder.build()
+
+def writeStreamingFeatures(reviewChunks, aggregates, userProfiles, businessProfiles, users, businesses, filename, format='csv', \
+                           checkpoint=None, split=None):
+    # second streaming pass: features of each chunk of reviews from the first pass's aggregates, written as computed
+    # and added to the checkpoint if there is one
+    writer = openWriter(filename, format)
+    for chunk in reviewChunks:
+        columns = aggregates.featureColumns(chunk.columns, userProfiles, businessProfiles, included=True)
+        if aggregates.businessTerms is not None:
+            with instruments.timer('similarity'):
+                columns['similarityToOtherReviews'] = aggregates.similarities(chunk.columns['businessCode'], chunk.terms, included=True, \
+                                                                              reviewIds=chunk.reviewIds)
+        (userIds, businessIds) = rowIds(chunk.columns, slice(None), users.ids, businesses.ids)
+        writer.writeColumns(columns, userIds, businessIds)
+        if checkpoint is not None:
+            checkpoint.addRows(split, chunk, columns)
+    writer.close()
+
+def streamingSplits():
+    # (split, review file, date ages are counted to, isTest, feature file) of each split, in pass order
+    return [('training', TRAINING_REVIEW_FILENAME, TRAINING_DATE, False, TRAINING_OUTPUTFILE), \
+            ('test', TEST_REVIEW_FILENAME, TEST_DATE, True, TEST_OUTPUTFILE)]
+
+def aggregatePass(categories, users, businesses, pool, chunkSize, blockSize, textCache, memoryBudget=None, spillDir=None):
+    # first streaming pass: split -> ReviewAggregates of the training-only and combined views, with the number of
+    # users seen in training reviews (users are coded in order of appearance, training reviews first). With a
+    # memoryBudget (MB), the reviews are grouped by user and business out of core: their compact records are spilled
+    # in sorted runs below spillDir, and the user and business aggregates built from a scan of the merged runs.
+    aggregates = dict((split, ReviewAggregates(termStatistics=needsInput(TFIDF))) for split in ['training', 'test'])
+    groupRuns = GroupRuns(spillDir, memoryBudget) if memoryBudget is not None else None
+    try:
+        with instruments.stage('aggregatePass') as stage:
+            stage.records = 0
+            for split, reviewFilename, today, isTest, outputFilename in streamingSplits():
+                if isTest:
+                    ntrainingUsers = len(users)
+                for chunk in readReviewChunks(reviewFilename, categories, today, isTest, users, businesses, pool, chunkSize, blockSize, textCache):
+                    views = ['test'] if isTest else ['training', 'test']
+                    if groupRuns is not None:
+                        groupRuns.add(split, chunk.columns)
+                    for view in views:
+                        if groupRuns is not None:
+                            aggregates[view].addTerms(chunk.columns, terms=chunk.terms, reviewIds=chunk.reviewIds)
+                        else:
+                            aggregates[view].add(chunk.columns, terms=chunk.terms, reviewIds=chunk.reviewIds)
+                    stage.records = stage.records + len(chunk)
+        if groupRuns is not None:
+            with instruments.stage('mergeRuns') as stage:
+                # the training runs are read for both views
+                stage.records = groupRuns.aggregate(aggregates['training'], ['training']) + \
+                                groupRuns.aggregate(aggregates['test'], ['training', 'test'])
+    finally:
+        if groupRuns is not None:
+            groupRuns.close()
+    return (aggregates, ntrainingUsers)
+
+def featurePass(categories, aggregates, userProfiles, businessProfiles, users, businesses, pool, chunkSize, blockSize, textCache, \
+                format='csv', checkpoint=None):
+    # second streaming pass; aggregates and userProfiles are split -> the ReviewAggregates and user profiles of
+    # the split's view
+    with instruments.stage('featurePass'):
+        for split, reviewFilename, today, isTest, outputFilename in streamingSplits():
+            reviewChunks = readReviewChunks(reviewFilename, categories, today, isTest, users, businesses, pool, chunkSize, blockSize, textCache)
+            writeStreamingFeatures(reviewChunks, aggregates[split], userProfiles[split], businessProfiles, users, businesses, \
+                                   outputFilename, format, checkpoint, split)
+
+def generateStreamingFeatures(args, categories):
+    # two passes over the review files holding only per-user and per-business state: the first collects the
+    # aggregates of the training-only and combined views, the second re-reads the reviews and writes their features.
+    # The second pass reads the text analysis back from the text cache, a temporary one unless --text-cache is given.
+    # With --checkpoint, the aggregates, profiles and feature rows are saved for --update.
+    textCacheFilename = args.text_cache
+    if textCacheFilename is None:
+        (handle, textCacheFilename) = tempfile.mkstemp(suffix='.sqlite')
+        os.close(handle)
+    (pool, textCache) = openTextAnalysis(args.workers, textCacheFilename)
+    blockSize = args.chunk_size * CHUNKS_PER_WORKER * args.workers
+    users = IdCoder()
+    businesses = IdCoder()
+    try:
+        (aggregates, ntrainingUsers) = aggregatePass(categories, users, businesses, pool, args.chunk_size, blockSize, textCache, \
+                                                     args.memory_budget, args.spill_dir)
+        with instruments.stage('loadProfiles', records=len(users) + len(businesses)):
+            userProfiles = userProfileColumns(users.ids, loadUserData())
+            businessProfiles = businessProfileColumns(businesses.ids, loadBusinessData(), categories)
+        trainingUserProfiles = dict(userProfiles)
+        trainingUserProfiles['hasVotes'] = hideUserVotes(userProfiles, numpy.arange(len(users)) < ntrainingUsers, HIDDEN_VOTES_PROBABILITY)
+        testUserProfiles = dict(userProfiles)
+        testUserProfiles['hasVotes'] = hideUserVotes(userProfiles, numpy.ones(len(users), dtype=bool), HIDDEN_VOTES_PROBABILITY)
+        checkpoint = None
+        if args.checkpoint is not None:
+            checkpoint = FeatureCheckpoint(args.checkpoint)
+            checkpoint.setState(users, businesses, aggregates, userProfiles, \
+                                {'training': trainingUserProfiles['hasVotes'], 'test': testUserProfiles['hasVotes']}, \
+                                numpy.arange(len(users)) < ntrainingUsers, businessProfiles, \
+                                {'posTagger': pos_tagging.taggerConfiguration, 'similaritySample': args.similarity_sample})
+
+        featurePass(categories, aggregates, {'training': trainingUserProfiles, 'test': testUserProfiles}, businessProfiles, \
+                    users, businesses, pool, args.chunk_size, blockSize, textCache, args.format, checkpoint)
+        if checkpoint is not None:
+            with instruments.stage('saveCheckpoint', records=len(checkpoint)):
+                checkpoint.save()
+            checkpoint.close()
+    finally:
+        closeTextAnalysis(pool, textCache)
+        if args.text_cache is None:
+            os.remove(textCacheFilename)
+
+def lookupNewProfiles(kind, jsonDict, coder, ncoded, loadData):
+    # adds to jsonDict the data directory records of the ids coded since a checkpoint that it has no record of, as a
+    # full run would see them; ids without one anywhere are reported, and get no profile as in a full run
+    missing = [id for id in coder.ids[ncoded:] if id not in jsonDict]
+    if len(missing) == 0:
+        return
+    jsonData = loadData()
+    unknown = [id for id in missing if id not in jsonData]
+    jsonDict.update((id, jsonData[id]) for id in missing if id in jsonData)
+    instruments.count('lookedUp%s' % kind.capitalize(), len(missing) - len(unknown))
+    if len(unknown) > 0:
+        sys.stderr.write('warning: %d new %s of the update have no profile record in the update or data directory json, eg %s\n' % \
+                         (len(unknown), kind, unknown[0]))
+
+def updateFeatures(args, categories):
+    # adds the reviews of --update to a --checkpoint: only the rows of reviews sharing a user or business with them
+    # (or with a new profile record) are recomputed, then the changed feature files are rewritten from the stored rows
+    # and the checkpoint is saved, both in time linear in the stored reviews (see FeatureCheckpoint)
+    checkpoint = FeatureCheckpoint.load(args.checkpoint)
+    configureTagger(*checkpoint.settings['posTagger'])
+    configureSimilarity(checkpoint.settings.get('similaritySample'))
+    isTest = args.update_split == 'test'
+    builder = ReviewStoreBuilder(needsInput(TFIDF), checkpoint.users, checkpoint.businesses)
+    (pool, textCache) = openTextAnalysis(args.workers, args.text_cache)
+    try:
+        with instruments.stage('loadUpdate') as stage:
+            for data, reviewText in readReviewFile(args.update, pool, args.chunk_size, args.chunk_size * CHUNKS_PER_WORKER * args.workers, textCache):
+                builder.addReview(data, categories, TEST_DATE if isTest else TRAINING_DATE, reviewText, isTest)
+            stage.records = len(builder)
+    finally:
+        closeTextAnalysis(pool, textCache)
+    jsonUserDict = loadJsonRecords([args.update_users], 'user_id', USER_FIELDS) if args.update_users is not None else { }
+    jsonBusinessDict = loadJsonRecords([args.update_businesses], 'business_id', BUSINESS_FIELDS) if args.update_businesses is not None else { }
+    with instruments.stage('lookupProfiles'):
+        lookupNewProfiles('users', jsonUserDict, checkpoint.users, len(checkpoint.userProfiles['hasProfile']), loadUserData)
+        lookupNewProfiles('businesses', jsonBusinessDict, checkpoint.businesses, len(checkpoint.businessProfiles['hasProfile']), loadBusinessData)
+
+    with instruments.stage('refresh', records=len(builder)):
+        refreshed = checkpoint.refresh(builder.build(), args.update_split, jsonUserDict, jsonBusinessDict, categories, HIDDEN_VOTES_PROBABILITY)
+    with instruments.stage('writeFeatures'):
+        for split, filename in [('training', TRAINING_OUTPUTFILE), ('test', TEST_OUTPUTFILE)]:
+            if split in refreshed:
+                checkpoint.writeFeatures(split, filename, args.format)
+    with instruments.stage('saveCheckpoint', records=len(checkpoint)):
+        checkpoint.save()
+    checkpoint.close()
+
+def asOfFilename(filename, date):
+    # feature file of an --as-of date, eg training/training_features_2012-06-30.csv
+    (root, extension) = os.path.splitext(filename)
+    return '%s_%s%s' % (root, date.strftime('%Y-%m-%d'), extension)
+
+def reviewDays(store):
+    # date.toordinal() of each review of a store, from its age at its split's date
+    return numpy.where(store.columns['isTest'] == 1, TEST_DATE.toordinal(), TRAINING_DATE.toordinal()) - store.columns['age'].astype(numpy.int64)
+
+def generateAsOfFeatures(args, categories):
+    # features as of each --as-of date from one load: only the reviews written by a date are rows or in the
+    # aggregates, their ages are counted to it, and the aggregates come from time indexes (prefix sums over each
+    # user's and business's reviews by date) rather than a reload per date. Profiles and hidden votes are those of
+    # the json data for every date, which has no history of them.
+    with instruments.stage('loadReviews') as stage:
+        store = loadReviewStore(categories, args.workers, args.chunk_size, args.text_cache)
+        stage.records = len(store)
+    with instruments.stage('loadUsersAndBusinesses'):
+        store.loadProfiles(loadUserData(), loadBusinessData(), categories)
+        userProfiles = { }
+        for split, trainingOnly in [('training', True), ('test', False)]:
+            userProfiles[split] = dict(store.userProfiles)
+            userProfiles[split]['hasVotes'] = store.view(trainingOnly, HIDDEN_VOTES_PROBABILITY).userHasVotes
+    days = reviewDays(store)
+    with instruments.stage('timeIndexes', records=len(store)):
+        timedAggregates = dict((split, TimedReviewAggregates(store.columns, store.splitRows(test=isTest) if not isTest else numpy.arange(len(store)), \
+                                                             days, len(store.userIds), len(store.businessIds))) \
+                               for split, isTest in [('training', False), ('test', True)])
+    for date in args.as_of:
+        day = date.toordinal()
+        with instruments.stage('asOf %s' % date.strftime('%Y-%m-%d')) as stage:
+            stage.records = 0
+            for split, isTest, filename in [('training', False, TRAINING_OUTPUTFILE), ('test', True, TEST_OUTPUTFILE)]:
+                rows = store.splitRows(test=isTest)
+                rows = rows[days[rows] <= day]
+                reviews = dict((name, column[rows]) for name, column in store.columns.iteritems())
+                reviews['age'] = day - days[rows]
+                columns = timedAggregates[split].asOf(day).featureColumns(reviews, userProfiles[split], store.businessProfiles, included=True)
+                if needsInput(TFIDF):
+                    with instruments.timer('similarity'):
+                        columns['similarityToOtherReviews'] = timedAggregates[split].similarities(day, rows, reviews['businessCode'], store.terms, \
+                                                                                                  store.reviewIds)
+                filename = asOfFilename(filename, date)
+                writer = openWriter(filename, args.format, len(rows))
+                (userIds, businessIds) = rowIds(store.columns, rows, store.userIds, store.businessIds)
+                writer.writeColumns(columns, userIds, businessIds)
+                writer.close()
+                stage.records = stage.records + len(rows)
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description='Generate training and test feature files from the Yelp json data.')
+    parser.add_argument('--data-dir', default=DATA_DIR, help='directory with the Yelp json data and business_clusters.csv')
+    parser.add_argument('--workers', type=int, default=1, help='processes used for review text analysis (1 = serial)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='reviews per text analysis task')
+    parser.add_argument('--text-cache', default=None, help='sqlite file caching review text analysis between runs')
+    parser.add_argument('--store', choices=['objects', 'columnar'], default='objects', \
+                        help='keep reviews as Review/User/Business objects or in a columnar ReviewStore')
+    parser.add_argument('--compact', action='store_true', \
+                        help='objects store: drop each review text once analyzed (keeping its term counts only if ' + \
+                             'similarityToOtherReviews is selected) and share one copy of each id')
+    parser.add_argument('--engine', choices=['rows', 'vectorized', 'streaming'], default='rows', \
+                        help='compute ReviewFeatures row by row, all rows at once from group aggregates (uses the columnar ' + \
+                             'store), or streamed in two passes over the review files with memory bounded by users and businesses')
+    parser.add_argument('--format', choices=FORMATS, default='csv', \
+                        help='feature file format; npy and parquet hold float64 columns with NaN for NA plus a .schema.json')
+    parser.add_argument('--pos-tagger', choices=TAGGERS, default='nltk', \
+                        help='pos tagger of the text analysis: nltk, or a word/suffix frequency lexicon (faster, approximate)')
+    parser.add_argument('--pos-lexicon', default=None, help='lexicon file of the lexicon tagger (pos_tagging.py train)')
+    parser.add_argument('--verbose', action='store_true', help='report json ingestion records/sec on stderr')
+    parser.add_argument('--features', default=None, metavar='NAMES', \
+                        help='comma separated feature columns to write, in their usual order (default all); pos tagging ' + \
+                             'and the tf-idf similarity index are skipped unless a selected feature needs them')
+    parser.add_argument('--similarity-sample', type=int, default=None, metavar='N', \
+                        help='estimate similarityToOtherReviews of a business with more than N reviews against a fixed ' + \
+                             'sample of N of them (the same in every engine) rather than all of them; see similarity_report.py')
+    parser.add_argument('--checkpoint', default=None, metavar='DIR', \
+                        help='streaming engine: also save the per-user/per-business state and feature rows to DIR; ' + \
+                             'with --update, the checkpoint to refresh')
+    parser.add_argument('--update', default=None, metavar='FILE', \
+                        help='add a json file of new reviews to --checkpoint, recomputing only the rows of their users ' + \
+                             'and businesses, and rewrite the feature files')
+    parser.add_argument('--as-of', default=None, metavar='DATES', \
+                        help='comma separated YYYY-MM-DD dates to write features as of, from one load of the reviews (uses ' + \
+                             'the columnar store); the feature files of each date get the date appended to their name')
+    parser.add_argument('--memory-budget', type=float, default=None, metavar='MB', \
+                        help='streaming engine: group the reviews by user and business out of core, spilling sorted runs ' + \
+                             'of compact per-review records whenever MB of them are buffered and merging them afterwards')
+    parser.add_argument('--spill-dir', default=None, metavar='DIR', \
+                        help='local directory for the --memory-budget runs (default the system temporary directory)')
+    parser.add_argument('--update-split', choices=['training', 'test'], default='test', help='split of the --update reviews')
+    parser.add_argument('--update-users', default=None, metavar='FILE', \
+                        help='json records of new or changed user profiles; other new users are looked up in the --data-dir json')
+    parser.add_argument('--update-businesses', default=None, metavar='FILE', \
+                        help='json records of new or changed business profiles; other new businesses are looked up in the --data-dir json')
+    parser.add_argument('--pipeline', action='store_true', \
+                        help='overlap json decoding, text analysis (in --workers processes) and feature writing, each in ' + \
+                             'a thread of its own handing its results on through a bounded queue')
+    parser.add_argument('--queue-depth', default=None, metavar='STAGE=N,...', \
+                        help='--pipeline queue depths of the %s stages (default %s)' % \
+                             ('/'.join(STAGES), ','.join('%s=%d' % (stage, QUEUE_DEPTHS[stage]) for stage in STAGES)))
+    parser.add_argument('--write-batch', type=int, default=WRITE_BATCH_SIZE, metavar='ROWS', \
+                        help='--pipeline feature rows per writerows call of the writer thread')
+    parser.add_argument('--instrument', action='store_true', \
+                        help='report wall/cpu time, records/sec and peak memory of each stage on stderr')
+    parser.add_argument('--progress', type=float, default=None, metavar='SECONDS', \
+                        help='report progress and ETA of the long loops every SECONDS on stderr (implies --instrument)')
+    parser.add_argument('--summary', default=None, metavar='FILE', \
+                        help='write the stages, timers (posTagging, similarity, writing) and counters as json (implies --instrument)')
+    args = parser.parse_args()
+    if args.update is not None and args.checkpoint is None:
+        parser.error('--update needs --checkpoint')
+    if args.checkpoint is not None and args.update is None and args.engine != 'streaming':
+        parser.error('--checkpoint is written by the streaming engine')
+    if args.as_of is not None:
+        if args.engine == 'streaming' or args.update is not None:
+            parser.error('--as-of uses the columnar store, not the streaming engine or --update')
+        try:
+            args.as_of = [datetime.strptime(date, '%Y-%m-%d') for date in args.as_of.split(',')]
+        except ValueError, e:
+            parser.error('--as-of: %s' % e)
+    if args.compact and (args.engine != 'rows' or args.store != 'objects' or args.update is not None or args.as_of is not None):
+        parser.error('--compact applies to the objects store of the rows engine')
+    if args.memory_budget is not None:
+        if args.engine != 'streaming' or args.update is not None:
+            parser.error('--memory-budget groups the reviews of the streaming engine')
+        if args.memory_budget <= 0:
+            parser.error('--memory-budget must be positive')
+    if args.similarity_sample is not None:
+        if args.update is not None:
+            parser.error('--update keeps the --similarity-sample of its checkpoint')
+        if args.similarity_sample < 1:
+            parser.error('--similarity-sample must be at least 1')
+    if args.spill_dir is not None and args.memory_budget is None:
+        parser.error('--spill-dir holds the runs of --memory-budget')
+    if args.queue_depth is not None:
+        if not args.pipeline:
+            parser.error('--queue-depth sets the queues of --pipeline')
+        try:
+            args.queue_depth = dict((stage, int(depth)) for stage, depth in (item.split('=') for item in args.queue_depth.split(',')))
+        except ValueError:
+            parser.error('--queue-depth takes STAGE=N pairs, eg decode=4,write=8')
+        unknown = [stage for stage in args.queue_depth if stage not in STAGES]
+        if len(unknown) > 0 or min(args.queue_depth.values()) < 1:
+            parser.error('--queue-depth: stages are %s, with depths of at least 1' % ', '.join(STAGES))
+    if args.write_batch < 1:
+        parser.error('--write-batch must be at least 1')
+    if args.features is not None:
+        args.features = args.features.split(',')
+        unknown = [name for name in args.features if name not in FEATURE_INDEX]
+        if len(unknown) > 0:
+            parser.error('unknown features: %s' % ', '.join(unknown))
+        if args.checkpoint is not None:
+            parser.error('--checkpoint keeps every feature, so it cannot be combined with --features')
+    return args
+
+def generateObjectFeatures(args, categories):
+    with instruments.stage('loadReviews') as stage:
+        (trainingReviews, trainingReviewIds, testReviews, testReviewIds) = loadReviews(categories, args.workers, args.chunk_size, args.text_cache, args.compact) # dictionary of review ID -> review
+        stage.records = len(trainingReviewIds) + len(testReviewIds)
+    with instruments.stage('loadUsersAndBusinesses') as stage:
+        userGroups = ReviewGroups('userId', trainingReviews, testReviews) # user ID -> [Review], built once
+        businessGroups = ReviewGroups('businessId', trainingReviews, testReviews) # business ID -> [Review], built once
+        jsonUserDict = loadUserData()
+        jsonBusinessDict = loadBusinessData()
+        trainingUsers = loadUsers(userGroups.view(trainingOnly=True), jsonUserDict) # dictionary of user ID -> user
+        testUsers = loadUsers(userGroups.view(trainingOnly=False), jsonUserDict) # dictionary of user ID -> user
+        trainingBusinesses = loadBusinesses(businessGroups.view(trainingOnly=True), jsonBusinessDict, categories) # dictionary of business ID -> business
+        testBusinesses = loadBusinesses(businessGroups.view(trainingOnly=False), jsonBusinessDict, categories) # dictionary of business ID -> business
+        stage.records = len(testUsers) + len(testBusinesses)
+    with instruments.stage('writeFeatures', records=len(trainingReviewIds) + len(testReviewIds)):
+        writeFeatures(trainingReviewIds, trainingReviews, trainingUsers, trainingBusinesses, TRAINING_OUTPUTFILE, args.format)
+        writeFeatures(testReviewIds, testReviews, testUsers, testBusinesses, TEST_OUTPUTFILE, args.format)
+
+def generateColumnarFeatures(args, categories):
+    with instruments.stage('loadReviews') as stage:
+        store = loadReviewStore(categories, args.workers, args.chunk_size, args.text_cache)
+        nreviews = len(store.reviewIds)
+        stage.records = nreviews
+    with instruments.stage('loadUsersAndBusinesses'):
+        store.loadProfiles(loadUserData(), loadBusinessData(), categories)
+        trainingView = store.view(trainingOnly=True, hiddenVoteProbability=HIDDEN_VOTES_PROBABILITY)
+        testView = store.view(trainingOnly=False, hiddenVoteProbability=HIDDEN_VOTES_PROBABILITY)
+    with instruments.stage('writeFeatures', records=nreviews):
+        if args.engine == 'vectorized':
+            writeFeatureColumns(trainingView, store.splitRows(test=False), TRAINING_OUTPUTFILE, args.format)
+            writeFeatureColumns(testView, store.splitRows(test=True), TEST_OUTPUTFILE, args.format)
+        else:
+            writeFeatures(store.splitReviewIds(test=False), trainingView.reviews, trainingView.users, trainingView.businesses, TRAINING_OUTPUTFILE, args.format)
+            writeFeatures(store.splitReviewIds(test=True), testView.reviews, testView.users, testView.businesses, TEST_OUTPUTFILE, args.format)
 
 def main():
+    args = parseArguments()
+    setDataDir(args.data_dir)
+    if args.verbose:
+        reportTo(sys.stderr)
+    if args.instrument or args.progress is not None or args.summary is not None:
+        instruments.enable(args.progress)
+    configureTagger(args.pos_tagger, args.pos_lexicon)
+    configureFeatures(args.features)
+    configureSimilarity(args.similarity_sample)
+    if args.pipeline:
+        configurePipeline(args.queue_depth or { }, args.write_batch)
     categories = loadBusinessCategories()
-    (trainingReviews, trainingReviewIds, testReviews, testReviewIds) = loadReviews(categories) # dictionary of review ID -> review
-    allReviews = dict(trainingReviews.items() + testReviews.items())
-    trainingUsers = loadUsers(trainingReviews) # dictionary of user ID -> user
-    testUsers = loadUsers(allReviews) # dictionary of user ID -> user
-    trainingBusinesses = loadBusinesses(trainingReviews, categories) # dictionary of business ID -> user
-    testBusinesses = loadBusinesses(allReviews, categories) # dictionary of business ID -> user
-    writeFeatures(trainingReviewIds, trainingReviews, trainingUsers, trainingBusinesses, TRAINING_OUTPUTFILE)
-    writeFeatures(testReviewIds, testReviews, testUsers, testBusinesses, TEST_OUTPUTFILE)
+    if args.update is not None:
+        updateFeatures(args, categories)
+    elif args.as_of is not None:
+        generateAsOfFeatures(args, categories)
+    elif args.engine == 'streaming':
+        generateStreamingFeatures(args, categories)
+    elif args.store == 'columnar' or args.engine == 'vectorized':
+        generateColumnarFeatures(args, categories)
+    else:
+        generateObjectFeatures(args, categories)
+    if args.summary is not None:
+        instruments.writeSummary(args.summary)
 
 if __name__ == '__main__':
     main()
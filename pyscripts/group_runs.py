@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import numpy
+from aggregates import sampleValues, pairKeys
+from instrumentation import instruments
+
+# compact record of a review spilled for grouping: the code of its group, then the values the group aggregates need
+RUN_DTYPE = numpy.dtype([('code', 'i4'), ('category', 'i4'), ('age', 'i4'), ('stars', 'f8'), ('funny', 'i4'), ('useful', 'i4'), \
+                         ('cool', 'i4'), ('ncharacters', 'i4'), ('nwords', 'i4'), ('nsentences', 'i4'), ('nsyllables', 'i4'), \
+                         ('npolysyllables', 'i4')])
+GROUPS = [('users', 'userCode'), ('businesses', 'businessCode')]
+MEMORY_BUDGET = 256.0 # megabytes of records buffered before they are spilled, and read at a time when merging
+
+def runRecords(columns, codeColumn, rows):
+    # the records of the given rows of review columns, grouped by codeColumn
+    codes = columns[codeColumn][rows]
+    records = numpy.empty(len(codes), dtype=RUN_DTYPE)
+    records['code'] = codes
+    for name in RUN_DTYPE.names[1:]:
+        records[name] = columns[name][rows]
+    return records
+
+class RunReader(object):
+    # a spilled run of records sorted by code, read a block at a time into records
+    def __init__(self, filename, blockSize):
+        self.file = open(filename, 'rb')
+        self.remaining = os.path.getsize(filename)/RUN_DTYPE.itemsize
+        self.blockSize = blockSize
+        self.records = numpy.zeros(0, dtype=RUN_DTYPE)
+        self.read()
+
+    def read(self):
+        # appends the next block of the run to records
+        n = min(self.blockSize, self.remaining)
+        self.records = numpy.concatenate([self.records, numpy.fromfile(self.file, dtype=RUN_DTYPE, count=n)])
+        self.remaining = self.remaining - n
+        if self.remaining == 0:
+            self.file.close()
+
+    def take(self, bound=None):
+        # removes and returns the read records with codes below bound (default all)
+        end = len(self.records) if bound is None else numpy.searchsorted(self.records['code'], bound)
+        (taken, self.records) = (self.records[:end], self.records[end:])
+        if len(self.records) == 0 and self.remaining > 0:
+            self.read()
+        return taken
+
+class GroupRuns(object):
+    # external-memory grouping of reviews by user and by business: the compact records of added reviews are buffered
+    # up to a memory budget, then sorted by group code and spilled to run files below directory (default the system
+    # temporary directory). Runs are kept per split, so the runs of the training reviews are spilled once and merged
+    # again for the combined view. close() removes them.
+    def __init__(self, directory=None, memoryBudget=MEMORY_BUDGET):
+        self.directory = tempfile.mkdtemp(prefix='group-runs-', dir=directory)
+        self.budget = int(memoryBudget * 1024 * 1024)
+        self.buffers = { } # (group, split) -> [record array]
+        self.buffered = 0
+        self.runs = { } # (group, split) -> [run filename]
+
+    def add(self, split, columns):
+        # adds every review of a chunk of review columns; users only get the reviews with votes, as ReviewAggregates
+        hasVotes = columns['hasVotes'] == 1
+        for group, codeColumn in GROUPS:
+            records = runRecords(columns, codeColumn, hasVotes if group == 'users' else slice(None))
+            self.buffers.setdefault((group, split), [ ]).append(records)
+            self.buffered = self.buffered + records.nbytes
+        if self.buffered >= self.budget:
+            self.spill()
+
+    def spill(self):
+        # sorts each buffer by group code, stably so that a group keeps the order its reviews were added in, into a run
+        for key, buffer in self.buffers.iteritems():
+            if len(buffer) == 0:
+                continue
+            records = numpy.concatenate(buffer)
+            runs = self.runs.setdefault(key, [ ])
+            filename = os.path.join(self.directory, '%s-%s-%04d.run' % (key[0], key[1], len(runs)))
+            records[numpy.argsort(records['code'], kind='mergesort')].tofile(filename)
+            runs.append(filename)
+            instruments.count('spilledRuns')
+            instruments.count('spilledRecords', len(records))
+        self.buffers = { }
+        self.buffered = 0
+
+    def merged(self, group, splits):
+        # yields the records of group in the runs of splits as blocks sorted by code, reading about the memory budget
+        # from the runs at a time; all of a group's records are in one block, in the order they were added
+        self.spill()
+        filenames = [filename for split in splits for filename in self.runs.get((group, split), [ ])]
+        if len(filenames) == 0:
+            return
+        readers = [RunReader(filename, max(1, self.budget/(RUN_DTYPE.itemsize*len(filenames)))) for filename in filenames]
+        while True:
+            # the unread records of a run have codes of at least its last read one, so the read records with codes
+            # below the smallest of those are whole groups; if there are none, the runs ending at it read further
+            unread = [reader for reader in readers if reader.remaining > 0]
+            bound = min(reader.records['code'][-1] for reader in unread) if len(unread) > 0 else None
+            block = numpy.concatenate([reader.take(bound) for reader in readers])
+            if len(block) > 0:
+                yield block[numpy.argsort(block['code'], kind='mergesort')]
+            elif len(unread) > 0:
+                for reader in unread:
+                    if reader.records['code'][-1] == bound:
+                        reader.read()
+            else:
+                return
+
+    def aggregate(self, aggregates, splits):
+        # adds the reviews of splits to the user, business and user/category aggregates of a ReviewAggregates, in one
+        # sequential scan of their merged runs; returns the number of records scanned
+        nrecords = 0
+        for group, codeColumn in GROUPS:
+            keys = [ ]
+            counts = [ ]
+            for block in self.merged(group, splits):
+                values = sampleValues(dict((name, block[name]) for name in RUN_DTYPE.names), slice(None))
+                getattr(aggregates, group).add(block['code'], values)
+                if group == 'users':
+                    # blocks hold whole users in code order, so their (user, category) keys are distinct between blocks
+                    (blockKeys, blockCounts) = numpy.unique(pairKeys(block['code'], block['category']), return_counts=True)
+                    keys.append(blockKeys)
+                    counts.append(blockCounts)
+                nrecords = nrecords + len(block)
+            if len(keys) > 0:
+                aggregates.userCategories.add(numpy.concatenate(keys), numpy.concatenate(counts))
+        return nrecords
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
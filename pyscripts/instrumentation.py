@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+import sys
+import json
+import time
+import resource
+from contextlib import contextmanager
+
+PROGRESS_INTERVAL = 30.0 # seconds between progress lines
+
+def peakRssMB():
+    # high-water mark of this process's resident memory (Linux reports KB); python 2 has no tracemalloc
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0
+
+def cpuSeconds(who=resource.RUSAGE_SELF):
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+class Stage(object):
+    # one measured stage; records can be set while it runs
+    def __init__(self, name, records=None):
+        self.name = name
+        self.records = records
+        self.start = time.time()
+        self.cpuStart = cpuSeconds()
+        self.peakStart = peakRssMB()
+
+    def finish(self):
+        seconds = time.time() - self.start
+        peak = peakRssMB()
+        return {'stage': self.name, 'seconds': seconds, 'cpuSeconds': cpuSeconds() - self.cpuStart, 'records': self.records, \
+                'recordsPerSecond': self.records/seconds if self.records is not None and seconds > 0 else None, \
+                'peakRssMB': peak, 'peakRssGrowthMB': peak - self.peakStart}
+
+class Progress(object):
+    # periodic 'done/total, rate, ETA' lines for one long loop
+    def __init__(self, instrumentation, name, total, unit):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.total = total
+        self.unit = unit
+        self.start = time.time()
+        self.last = self.start
+
+    def update(self, done):
+        now = time.time()
+        if now - self.last < self.instrumentation.progressInterval:
+            return
+        self.last = now
+        rate = done/(now - self.start)
+        line = '%s: %d/%s %s, %.0f %s/sec' % (self.name, done, self.total if self.total is not None else '?', self.unit, rate, self.unit)
+        if self.total is not None and rate > 0:
+            line = line + ', ETA %.0fs' % ((self.total - done)/rate)
+        self.instrumentation.log(line)
+
+class TimedWriter(object):
+    # a FeatureWriter whose writing time goes to the 'writing' timer, with progress over total rows
+    def __init__(self, writer, instrumentation, name, total):
+        self.writer = writer
+        self.instrumentation = instrumentation
+        self.progress = instrumentation.progress(name, total, 'rows')
+        self.nrows = 0
+
+    def writeRow(self, values):
+        start = time.time()
+        self.writer.writeRow(values)
+        self.instrumentation.add('writing', time.time() - start)
+        self.nrows = self.nrows + 1
+        self.progress.update(self.nrows)
+
+    def writeRows(self, rows):
+        start = time.time()
+        self.writer.writeRows(rows)
+        self.instrumentation.add('writing', time.time() - start)
+        self.nrows = self.nrows + len(rows)
+        self.progress.update(self.nrows)
+
+    def writeColumns(self, columns, userIds, businessIds):
+        start = time.time()
+        self.writer.writeColumns(columns, userIds, businessIds)
+        self.instrumentation.add('writing', time.time() - start)
+        self.nrows = self.nrows + len(userIds)
+        self.progress.update(self.nrows)
+
+    def close(self):
+        start = time.time()
+        self.writer.close()
+        self.instrumentation.add('writing', time.time() - start)
+
+class Instrumentation(object):
+    # per-stage wall/cpu time, records/sec and peak memory, accumulated timers (eg posTagging, similarity, writing),
+    # counters, pipeline queue metrics and progress lines. Disabled it only costs the enabled checks of its callers.
+    def __init__(self):
+        self.enabled = False
+        self.progressInterval = None
+        self.stream = sys.stderr
+        self.reset()
+
+    def reset(self):
+        self.start = time.time()
+        self.stages = [ ]
+        self.timers = { }
+        self.counters = { }
+        self.queues = { }
+
+    def enable(self, progressInterval=None, stream=sys.stderr):
+        # progress lines are written every progressInterval seconds if it is given
+        self.enabled = True
+        self.progressInterval = progressInterval
+        self.stream = stream
+        self.reset()
+
+    def log(self, line):
+        self.stream.write(line + '\n')
+        self.stream.flush()
+
+    @contextmanager
+    def stage(self, name, records=None):
+        # measures the with block; its records can be set on the yielded stage
+        if not self.enabled:
+            yield NO_STAGE
+            return
+        stage = Stage(name, records)
+        yield stage
+        result = stage.finish()
+        self.stages.append(result)
+        self.log('%s: %.2fs wall, %.2fs cpu%s, %.1f MB peak' % (name, result['seconds'], result['cpuSeconds'], \
+                 ', %.0f records/sec' % result['recordsPerSecond'] if result['recordsPerSecond'] is not None else '', result['peakRssMB']))
+
+    def add(self, timer, seconds):
+        self.timers[timer] = self.timers.get(timer, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.time()
+        yield
+        self.add(name, time.time() - start)
+
+    def count(self, counter, n=1):
+        self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def addQueue(self, stage, metrics):
+        # adds up the metrics of a pipeline queue into a stage (see pipeline.StageQueue) and logs them: a producer
+        # blocked on a full queue waits for a slower stage, a consumer waiting on an empty one for a faster stage
+        if not self.enabled:
+            return
+        totals = self.queues.setdefault(stage, dict((name, 0) for name in metrics))
+        for name, value in metrics.iteritems():
+            totals[name] = max(totals[name], value) if name == 'depth' else totals[name] + value
+        items = max(metrics['items'], 1)
+        self.log('%s queue: %d items, mean depth %.1f of %d, full at %.0f%% of puts; producer blocked %.2fs, consumer waited %.2fs' % \
+                 (stage, metrics['items'], float(metrics['depthTotal'])/items, metrics['depth'], 100.0*metrics['fullPuts']/items, \
+                  metrics['producerBlockedSeconds'], metrics['consumerWaitingSeconds']))
+
+    def progress(self, name, total=None, unit='records'):
+        return Progress(self, name, total, unit) if self.enabled and self.progressInterval is not None else NO_PROGRESS
+
+    def timedWriter(self, writer, name, total=None):
+        return TimedWriter(writer, self, name, total) if self.enabled else writer
+
+    def summary(self):
+        return {'stages': self.stages, 'timers': self.timers, 'counters': self.counters, 'queues': self.queues, \
+                'totalSeconds': time.time() - self.start, \
+                'cpuSeconds': cpuSeconds(), 'workerCpuSeconds': cpuSeconds(resource.RUSAGE_CHILDREN), 'peakRssMB': peakRssMB(), \
+                'workerPeakRssMB': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss/1024.0}
+
+    def writeSummary(self, filename):
+        f = open(filename, 'w')
+        json.dump(self.summary(), f, indent=1, sort_keys=True)
+        f.close()
+
+class NoProgress(object):
+    def update(self, done):
+        pass
+
+class NoStage(object):
+    records = None
+
+NO_PROGRESS = NoProgress()
+NO_STAGE = NoStage()
+instruments = Instrumentation() # shared by the feature scripts; disabled unless a script enables it
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+import json
+import time
+import itertools
+
+READ_BLOCK_SIZE = 1 << 22 # bytes of whole lines read from a json file at a time
+USER_FIELDS = ['user_id', 'votes', 'average_stars', 'review_count']
+BUSINESS_FIELDS = ['business_id', 'open', 'stars', 'review_count', 'categories']
+
+def stdlibDecoder():
+    # the C scanner of the stdlib decoder, called directly to skip the per call overhead of json.loads
+    scanOnce = json.decoder.JSONDecoder().scan_once
+    def loads(line):
+        try:
+            (data, end) = scanOnce(line, 0)
+        except StopIteration:
+            return json.loads(line) # leading whitespace, or raises the stdlib error for a malformed line
+        if end != len(line) and line[end:].strip():
+            return json.loads(line)
+        return data
+    return loads
+
+def chooseDecoder():
+    # (name, loads) of the fastest installed decoder that parses numbers like the stdlib json module
+    try:
+        import ujson
+        try:
+            ujson.loads('0.1', precise_float=True)
+            return ('ujson', lambda s: ujson.loads(s, precise_float=True))
+        except TypeError:
+            return ('ujson', ujson.loads)
+    except ImportError:
+        pass
+    try:
+        import simplejson
+        import simplejson.scanner
+        if simplejson.scanner.c_make_scanner is not None: # pure python simplejson is slower than the stdlib
+            return ('simplejson', simplejson.loads)
+    except ImportError:
+        pass
+    return ('json', stdlibDecoder())
+
+(DECODER_NAME, decode) = chooseDecoder()
+reportStream = None
+
+def reportTo(stream):
+    # a records/sec line is written to stream (eg sys.stderr) for each file read to the end; None disables it
+    global reportStream
+    reportStream = stream
+
+def project(data, fields):
+    # drops the fields of a decoded record that are not in the set fields, in place
+    for key in data.keys():
+        if key not in fields:
+            del data[key]
+    return data
+
+class JsonFileReader(object):
+    # iterates the records of a line-delimited json file, read in large blocks and decoded a block at a time.
+    # If fields is given only those fields of each record are kept, which is worth it for records held in memory.
+    def __init__(self, filename, fields=None, blockSize=READ_BLOCK_SIZE):
+        self.filename = filename
+        self.fields = frozenset(fields) if fields is not None else None
+        self.blockSize = blockSize
+        self.records = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def __iter__(self):
+        for block in self.blocks():
+            for data in block:
+                yield data
+
+    def blocks(self):
+        # lists of decoded records, one per block read from the file
+        f = open(self.filename, 'rb')
+        while True:
+            start = time.time()
+            lines = f.readlines(self.blockSize)
+            if len(lines) == 0:
+                break
+            if self.fields is not None:
+                fields = self.fields
+                block = [project(decode(line), fields) for line in lines]
+            else:
+                block = [decode(line) for line in lines]
+            self.bytes = self.bytes + sum(itertools.imap(len, lines))
+            self.records = self.records + len(block)
+            self.seconds = self.seconds + time.time() - start
+            yield block
+        f.close()
+        if reportStream is not None:
+            reportStream.write(self.report() + '\n')
+
+    def recordsPerSecond(self):
+        return self.records / self.seconds if self.seconds > 0 else 0.0
+
+    def report(self):
+        return '%s: %d records, %.1f MB in %.2fs (%.0f records/sec, %s)' % \
+               (self.filename, self.records, self.bytes / 1e6, self.seconds, self.recordsPerSecond(), DECODER_NAME)
+
+def loadJsonRecords(filenames, idKey, fields=None):
+    # id -> json data over line-delimited json files; later files take precedence
+    jsonDict = { }
+    for filename in filenames:
+        for jsonData in JsonFileReader(filename, fields):
+            jsonDict[jsonData[idKey]] = jsonData
+    return jsonDict
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+import sys
+import time
+import Queue
+import threading
+from instrumentation import instruments
+
+STAGES = ['decode', 'analysis', 'write']
+QUEUE_DEPTHS = {'decode': 2, 'analysis': 1, 'write': 8} # items (review blocks, write calls) a stage may run ahead
+WRITE_BATCH_SIZE = 1000 # feature rows per writeRows call of the writer thread
+
+queueDepths = None # stage -> queue depth set by configurePipeline; None runs every stage in its caller's thread
+writeBatchSize = WRITE_BATCH_SIZE
+DONE = object() # ends the items of a queue
+
+def configurePipeline(depths=None, batchSize=WRITE_BATCH_SIZE):
+    # with depths (stage -> queue depth; stages left out get QUEUE_DEPTHS), json decoding, text analysis and feature
+    # writing each run in a thread of their own, handing their results on through bounded queues
+    global queueDepths, writeBatchSize
+    queueDepths = dict(QUEUE_DEPTHS, **depths) if depths is not None else None
+    writeBatchSize = batchSize
+
+def pipelined():
+    return queueDepths is not None
+
+class StageQueue(object):
+    # bounded queue into a stage: put blocks while it is full, holding the producer back until the consumer catches
+    # up. Keeps the depth found by each put and the seconds producers spent blocked and consumers spent waiting.
+    def __init__(self, stage):
+        self.stage = stage
+        self.queue = Queue.Queue(queueDepths[stage])
+        self.items = 0
+        self.depths = 0
+        self.full = 0
+        self.putSeconds = 0.0
+        self.getSeconds = 0.0
+
+    def put(self, item):
+        depth = self.queue.qsize()
+        self.items = self.items + 1
+        self.depths = self.depths + depth
+        if depth >= self.queue.maxsize:
+            self.full = self.full + 1
+        start = time.time()
+        self.queue.put(item)
+        self.putSeconds = self.putSeconds + time.time() - start
+
+    def get(self):
+        start = time.time()
+        item = self.queue.get()
+        self.getSeconds = self.getSeconds + time.time() - start
+        return item
+
+    def close(self):
+        instruments.addQueue(self.stage, {'items': self.items, 'depth': self.queue.maxsize, 'depthTotal': self.depths, \
+                                          'fullPuts': self.full, 'producerBlockedSeconds': self.putSeconds, \
+                                          'consumerWaitingSeconds': self.getSeconds})
+
+def runAhead(items, stage):
+    # iterates items in a thread of its own, up to the stage's queue depth ahead of the consumer; an exception of
+    # the iteration is raised again in the consumer. Not pipelined, items are iterated as they are consumed.
+    if not pipelined():
+        for item in items:
+            yield item
+        return
+    queue = StageQueue(stage)
+    def produce():
+        try:
+            for item in items:
+                queue.put((item, None))
+            queue.put((DONE, None))
+        except BaseException:
+            queue.put((DONE, sys.exc_info()))
+    thread = threading.Thread(target=produce, name=stage)
+    thread.daemon = True
+    thread.start()
+    while True:
+        (item, error) = queue.get()
+        if item is DONE:
+            break
+        yield item
+    thread.join()
+    queue.close()
+    if error is not None:
+        raise error[0], error[1], error[2]
+
+class PipelinedWriter(object):
+    # a FeatureWriter run by a writer thread: rows given to writeRow go to it in batches for writeRows, columns as
+    # they are. An exception of the writer thread is raised again by the next call or by close.
+    def __init__(self, writer):
+        self.writer = writer
+        self.queue = StageQueue('write')
+        self.batch = [ ]
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name='write')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while True:
+            call = self.queue.get()
+            if call is DONE:
+                break
+            if self.error is None: # later calls are dropped, but still taken so that the producer is not blocked
+                try:
+                    call[0](*call[1:])
+                except BaseException:
+                    self.error = sys.exc_info()
+
+    def put(self, *call):
+        if self.error is not None:
+            self.raiseError()
+        self.queue.put(call)
+
+    def raiseError(self):
+        error = self.error
+        self.error = None
+        raise error[0], error[1], error[2]
+
+    def writeRow(self, values):
+        self.batch.append(values)
+        if len(self.batch) >= writeBatchSize:
+            self.flush()
+
+    def flush(self):
+        if len(self.batch) > 0:
+            self.put(self.writer.writeRows, self.batch)
+            self.batch = [ ]
+
+    def writeColumns(self, columns, userIds, businessIds):
+        self.flush()
+        self.put(self.writer.writeColumns, columns, userIds, businessIds)
+
+    def close(self):
+        self.flush()
+        self.put(self.writer.close)
+        self.queue.put(DONE)
+        self.thread.join()
+        self.queue.close()
+        if self.error is not None:
+            self.raiseError()
+
+def pipelinedWriter(writer):
+    return PipelinedWriter(writer) if pipelined() else writer
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+import time
+import hashlib
+import argparse
+import itertools
+from collections import Counter, defaultdict
+from json_ingest import JsonFileReader
+from text_normalizer import normalizeTexts
+
+TAGGERS = ['nltk', 'lexicon']
+OTHER = 0
+ADJADV = 1
+VERB = 2
+NOUN = 3
+# simplified tags (simplify_wsj_tag) counted by ReviewText, leaving out modal verbs MOD and pronouns PRO
+SIMPLIFIED_TAG_CLASSES = {'ADJ': ADJADV, 'ADV': ADJADV, 'V': VERB, 'VD': VERB, 'VG': VERB, 'VN': VERB, 'N': NOUN, 'NP': NOUN}
+SUFFIX_LENGTH = 3 # characters of an unknown word used to guess its tag in the lexicon tagger
+DEFAULT_TAG = 'NN'
+
+tagClasses = { } # WSJ tag -> OTHER/ADJADV/VERB/NOUN, filled from nltk's WSJ mapping when the first tagger is made
+taggerConfiguration = ('nltk', None) # (tagger name, lexicon filename) set by configureTagger
+tagger = None # made on first use by currentTagger()
+taggingSeconds = 0.0 # time spent in tagTexts by this process
+
+def simplifiedTagClass(tag):
+    # class of a WSJ tag after simplify_wsj_tag
+    from nltk.tag.simplify import simplify_wsj_tag
+    return SIMPLIFIED_TAG_CLASSES.get(simplify_wsj_tag(tag), OTHER)
+
+def fillTagClasses():
+    # precomputes the class of every tag of nltk's WSJ mapping; other tags are added as they are seen
+    from nltk.tag.simplify import wsj_mapping
+    for tag in wsj_mapping:
+        tagClasses[tag] = simplifiedTagClass(tag)
+        tagClasses[tag.upper()] = simplifiedTagClass(tag.upper())
+
+def tagClass(tag):
+    c = tagClasses.get(tag)
+    if c is None:
+        c = simplifiedTagClass(tag)
+        tagClasses[tag] = c
+    return c
+
+def tokenize(text):
+    import nltk
+    return nltk.word_tokenize(text)
+
+class NltkTagger(object):
+    # nltk's recommended tagger (pos_tag), loaded once and called once per batch of texts
+    def __init__(self):
+        import nltk
+        self.tagger = nltk.data.load(nltk.tag._POS_TAGGER)
+        self.name = 'nltk'
+
+    def tagTexts(self, texts):
+        return self.tagger.batch_tag([tokenize(text) for text in texts])
+
+class LexiconTagger(object):
+    # most frequent tag of each word, then of each word suffix for unknown words, learned from NltkTagger output
+    # by trainLexicon; a file of 'word<tab>tag' lines followed by '<tab>suffix<tab>tag' lines
+    def __init__(self, filename):
+        self.words = { }
+        self.suffixes = { }
+        f = open(filename, 'rb')
+        data = f.read()
+        f.close()
+        for line in data.splitlines():
+            fields = line.split('\t')
+            if len(fields) == 2:
+                self.words[fields[0]] = fields[1]
+            elif len(fields) == 3:
+                self.suffixes[fields[1]] = fields[2]
+        self.name = 'lexicon:' + hashlib.sha1(data).hexdigest()[:12]
+
+    def tagWord(self, word):
+        tag = self.words.get(word)
+        if tag is None:
+            tag = self.suffixes.get(word[-SUFFIX_LENGTH:], DEFAULT_TAG)
+        return tag
+
+    def tagTexts(self, texts):
+        tagWord = self.tagWord
+        return [[(word, tagWord(word)) for word in tokenize(text)] for text in texts]
+
+def trainLexicon(tokenTags, filename):
+    # writes the lexicon of LexiconTagger from an iterable of tagged texts
+    wordTags = defaultdict(Counter)
+    suffixTags = defaultdict(Counter)
+    for tags in tokenTags:
+        for word, tag in tags:
+            wordTags[word][tag] += 1
+            suffixTags[word[-SUFFIX_LENGTH:]][tag] += 1
+    f = open(filename, 'wb')
+    for word in sorted(wordTags):
+        f.write('%s\t%s\n' % (word, wordTags[word].most_common(1)[0][0]))
+    for suffix in sorted(suffixTags):
+        f.write('\t%s\t%s\n' % (suffix, suffixTags[suffix].most_common(1)[0][0]))
+    f.close()
+
+def makeTagger(name, lexiconFilename=None):
+    if len(tagClasses) == 0:
+        fillTagClasses()
+    if name == 'nltk':
+        return NltkTagger()
+    elif name == 'lexicon':
+        if lexiconFilename is None:
+            raise ValueError('the lexicon tagger needs a lexicon file')
+        return LexiconTagger(lexiconFilename)
+    raise ValueError('unknown pos tagger: %s' % name)
+
+def configureTagger(name='nltk', lexiconFilename=None):
+    # selects the tagger used by ReviewText; the tagger itself is made on first use
+    global taggerConfiguration, tagger
+    taggerConfiguration = (name, lexiconFilename)
+    tagger = None
+
+def currentTagger():
+    global tagger
+    if tagger is None:
+        tagger = makeTagger(*taggerConfiguration)
+    return tagger
+
+def taggerKey():
+    # identifies the configured tagger in text cache keys; empty for the default nltk tagger
+    if taggerConfiguration[0] == 'nltk':
+        return ''
+    return currentTagger().name
+
+def tagTexts(texts):
+    # [(token, WSJ tag)] of each text, tagged by the configured tagger in one batch
+    global taggingSeconds
+    start = time.time()
+    tags = currentTagger().tagTexts(texts)
+    taggingSeconds = taggingSeconds + time.time() - start
+    return tags
+
+def tagCounts(tags):
+    # [other, adjadv, verbs, nouns] counts of a tagged text
+    counts = [0, 0, 0, 0]
+    for word, tag in tags:
+        counts[tagClass(tag)] += 1
+    return counts
+
+def report(texts, lexiconFilename=None):
+    # reviews/sec of each tagger and how far its nadjadv/nverbs/nnouns counts are from the nltk tagger's
+    processedTexts = [normalized[0] for normalized in normalizeTexts(texts)]
+    names = ['nltk', 'lexicon'] if lexiconFilename is not None else ['nltk']
+    results = { }
+    for name in names:
+        t = makeTagger(name, lexiconFilename)
+        start = time.time()
+        results[name] = [tagCounts(tags) for tags in t.tagTexts(processedTexts)]
+        seconds = time.time() - start
+        line = '%s: %d reviews in %.2fs (%.0f reviews/sec)' % (t.name, len(texts), seconds, len(texts)/seconds if seconds > 0 else 0.0)
+        for label, c in [('nadjadv', ADJADV), ('nverbs', VERB), ('nnouns', NOUN)]:
+            differences = [abs(counts[c] - nltkCounts[c]) for counts, nltkCounts in itertools.izip(results[name], results['nltk'])]
+            line = line + '; %s mean abs difference %.3f, %.1f%% of reviews differ' % \
+                   (label, float(sum(differences))/max(len(texts), 1), 100.0*len([x for x in differences if x > 0])/max(len(texts), 1))
+        print line
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the lexicon pos tagger or compare the pos taggers on review json files.')
+    parser.add_argument('command', choices=['train', 'report'])
+    parser.add_argument('filenames', nargs='+', help='line-delimited review json files')
+    parser.add_argument('--lexicon', default=None, help='lexicon file written by train and read by report')
+    parser.add_argument('--limit', type=int, default=None, help='reviews read from the files')
+    args = parser.parse_args()
+    records = itertools.chain(*[JsonFileReader(filename) for filename in args.filenames])
+    texts = [data['text'] for data in itertools.islice(records, args.limit)]
+    if args.command == 'train':
+        if args.lexicon is None:
+            parser.error('train needs --lexicon')
+        processedTexts = [normalized[0] for normalized in normalizeTexts(texts)]
+        trainLexicon(makeTagger('nltk').tagTexts(processedTexts), args.lexicon)
+    else:
+        report(texts, args.lexicon)
+
+if __name__ == '__main__':
+    main()
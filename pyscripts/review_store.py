@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+
+import array
+import random
+import numpy
+from datetime import datetime
+from data_objects import ReviewText, Business, BusinessTfidfIndex, TermBags
+
+# review attributes kept as columns; (name, array typecode)
+REVIEW_COLUMNS = [('userCode', 'i'), ('businessCode', 'i'), ('category', 'i'), ('isTest', 'b'), ('stars', 'd'), \
+                  ('age', 'i'), ('hasVotes', 'b'), ('funny', 'i'), ('useful', 'i'), ('cool', 'i')]
+TEXT_COLUMNS = [('ncharacters', 'i'), ('nwords', 'i'), ('nsentences', 'i'), ('npunctuation', 'i'), ('containsClosed', 'b'), \
+                ('nverbs', 'i'), ('nnouns', 'i'), ('nadjadv', 'i'), ('nsyllables', 'i'), ('npolysyllables', 'i'), \
+                ('ari', 'd'), ('fk', 'd'), ('smog', 'd')]
+TERMS_BLOCK_SIZE = 1000 # processed texts turned into TermBags at a time
+
+class IdCoder(object):
+    # maps string ids to consecutive integer codes
+    def __init__(self):
+        self.codes = { }
+        self.ids = [ ]
+
+    def encode(self, id):
+        code = self.codes.get(id)
+        if code is None:
+            code = len(self.ids)
+            self.codes[id] = code
+            self.ids.append(id)
+        return code
+
+    def __len__(self):
+        return len(self.ids)
+
+class ReviewStoreBuilder(object):
+    # appends reviews to compact typed arrays; build() turns them into a ReviewStore. Builders of consecutive
+    # chunks of reviews can share their IdCoders so that codes agree between chunks. Unless keepTerms is False, the
+    # processed texts are packed into TermBags a block at a time, and not kept.
+    def __init__(self, keepTerms=True, users=None, businesses=None):
+        self.columns = dict((name, array.array(typecode)) for name, typecode in REVIEW_COLUMNS + TEXT_COLUMNS)
+        self.reviewIds = [ ]
+        self.processedTexts = [ ] if keepTerms else None
+        self.termBlocks = [ ]
+        self.users = users if users is not None else IdCoder()
+        self.businesses = businesses if businesses is not None else IdCoder()
+
+    def __len__(self):
+        return len(self.reviewIds)
+
+    def addReview(self, jsonData, businessCategories, today, reviewText, isTest):
+        votes = jsonData.get('votes')
+        values = {'userCode': self.users.encode(jsonData['user_id']), \
+                  'businessCode': self.businesses.encode(jsonData['business_id']), \
+                  'category': businessCategories[jsonData['business_id']], \
+                  'isTest': 1 if isTest else 0, \
+                  'stars': float(jsonData['stars']), \
+                  'age': (today - datetime.strptime(jsonData['date'], '%Y-%m-%d')).days, \
+                  'hasVotes': 1 if votes is not None else 0, \
+                  'funny': int(votes['funny']) if votes is not None else 0, \
+                  'useful': int(votes['useful']) if votes is not None else 0, \
+                  'cool': int(votes['cool']) if votes is not None else 0}
+        for name, typecode in REVIEW_COLUMNS:
+            self.columns[name].append(values[name])
+        for name, typecode in TEXT_COLUMNS:
+            self.columns[name].append(getattr(reviewText, name))
+        self.reviewIds.append(jsonData['review_id'])
+        if self.processedTexts is not None:
+            self.processedTexts.append(reviewText.processedText)
+            if len(self.processedTexts) >= TERMS_BLOCK_SIZE:
+                self.packTerms()
+
+    def packTerms(self):
+        nwords = self.columns['nwords'][len(self.reviewIds) - len(self.processedTexts):]
+        self.termBlocks.append(TermBags.fromTexts(self.processedTexts, nwords))
+        self.processedTexts = [ ]
+
+    def build(self):
+        columns = dict((name, numpy.frombuffer(column, dtype=column.typecode).copy() if len(column) > 0 \
+                        else numpy.zeros(0, dtype=column.typecode)) for name, column in self.columns.iteritems())
+        terms = None
+        if self.processedTexts is not None:
+            self.packTerms()
+            terms = TermBags.concatenate(self.termBlocks)
+        return ReviewStore(columns, self.reviewIds, terms, self.users.ids, self.businesses.ids)
+
+class ReviewStore(object):
+    def __init__(self, columns, reviewIds, terms, userIds, businessIds):
+        # columns is name -> numpy array with one entry per review; userCode/businessCode index userIds/businessIds,
+        # terms is the TermBags of their processed texts
+        self.columns = columns
+        self.reviewIds = reviewIds
+        self.terms = terms
+        self.userIds = userIds
+        self.businessIds = businessIds
+        self.reviewIndex = dict((reviewId, i) for i, reviewId in enumerate(reviewIds))
+        self.nreviews = len(reviewIds)
+
+        # user/business profile columns, filled by loadProfiles
+        self.userProfiles = None
+        self.businessProfiles = None
+
+    def __len__(self):
+        return self.nreviews
+
+    def loadProfiles(self, jsonUserDict, jsonBusinessDict, businessCategories):
+        self.userProfiles = userProfileColumns(self.userIds, jsonUserDict)
+        self.businessProfiles = businessProfileColumns(self.businessIds, jsonBusinessDict, businessCategories)
+
+    def splitRows(self, test):
+        # rows of the training or test reviews, in file order
+        return numpy.flatnonzero(self.columns['isTest'] == (1 if test else 0))
+
+    def splitReviewIds(self, test):
+        return [self.reviewIds[i] for i in self.splitRows(test)]
+
+    def view(self, trainingOnly, hiddenVoteProbability=0.0):
+        return ReviewStoreView(self, trainingOnly, hiddenVoteProbability)
+
+def userProfileColumns(userIds, jsonUserDict):
+    # profile attribute -> array indexed by user code
+    nusers = len(userIds)
+    profiles = {'hasProfile': numpy.zeros(nusers, dtype=bool), 'hasVotes': numpy.zeros(nusers, dtype=bool), \
+                'funny': numpy.zeros(nusers), 'useful': numpy.zeros(nusers), 'cool': numpy.zeros(nusers), \
+                'averageStars': numpy.zeros(nusers), 'reviewCount': numpy.zeros(nusers, dtype=numpy.int32)}
+    for code, userId in enumerate(userIds):
+        jsonData = jsonUserDict.get(userId)
+        if jsonData is None:
+            continue
+        profiles['hasProfile'][code] = True
+        if 'votes' in jsonData:
+            profiles['hasVotes'][code] = True
+            profiles['funny'][code] = int(jsonData['votes']['funny'])
+            profiles['useful'][code] = int(jsonData['votes']['useful'])
+            profiles['cool'][code] = int(jsonData['votes']['cool'])
+        profiles['averageStars'][code] = float(jsonData['average_stars'])
+        profiles['reviewCount'][code] = int(jsonData['review_count'])
+    return profiles
+
+def businessProfileColumns(businessIds, jsonBusinessDict, businessCategories):
+    # profile attribute -> array indexed by business code
+    nbusinesses = len(businessIds)
+    profiles = {'hasProfile': numpy.zeros(nbusinesses, dtype=bool), 'closed': numpy.zeros(nbusinesses, dtype=numpy.int32), \
+                'stars': numpy.zeros(nbusinesses), 'reviewCount': numpy.zeros(nbusinesses, dtype=numpy.int32), \
+                'category': numpy.array([businessCategories[b] for b in businessIds], dtype=numpy.int32)}
+    for code, businessId in enumerate(businessIds):
+        jsonData = jsonBusinessDict.get(businessId)
+        if jsonData is None:
+            continue
+        profiles['hasProfile'][code] = True
+        profiles['closed'][code] = 0 if jsonData['open'] == True else 1
+        profiles['stars'][code] = float(jsonData['stars'])
+        profiles['reviewCount'][code] = int(jsonData['review_count'])
+    return profiles
+
+def hideUserVotes(userProfiles, inView, hiddenVoteProbability):
+    # per-user hasVotes with the votes of public users in the view hidden at random, as in features.loadUsers
+    hasVotes = userProfiles['hasVotes'].copy()
+    for code in numpy.flatnonzero(userProfiles['hasProfile'][:len(inView)] & inView):
+        if random.random() < hiddenVoteProbability:
+            hasVotes[code] = False
+    return hasVotes
+
+def groupIndex(codes, ngroups, rows):
+    # CSR-style index of rows by group code: the rows of group g are order[offsets[g]:offsets[g + 1]]
+    order = rows[numpy.argsort(codes[rows], kind='mergesort')]
+    offsets = numpy.zeros(ngroups + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(codes[rows], minlength=ngroups), out=offsets[1:])
+    return (offsets, order)
+
+class ReviewStoreView(object):
+    def __init__(self, store, trainingOnly, hiddenVoteProbability=0.0):
+        # the training reviews of a ReviewStore, or all of them, with per-user and per-business review indexes
+        self.store = store
+        self.trainingOnly = trainingOnly
+        self.rows = numpy.flatnonzero(store.columns['isTest'] == 0) if trainingOnly else numpy.arange(len(store))
+        (self.userOffsets, self.userOrder) = groupIndex(store.columns['userCode'], len(store.userIds), self.rows)
+        (self.businessOffsets, self.businessOrder) = groupIndex(store.columns['businessCode'], len(store.businessIds), self.rows)
+
+        self.userHasVotes = hideUserVotes(store.userProfiles, numpy.diff(self.userOffsets) > 0, hiddenVoteProbability)
+
+        # mappings used by features.writeFeatures
+        self.reviews = StoredReviews(self)
+        self.users = StoredUsers(self)
+        self.businesses = StoredBusinesses(self)
+
+    def userRows(self, code):
+        return self.userOrder[self.userOffsets[code]:self.userOffsets[code + 1]]
+
+    def businessRows(self, code):
+        return self.businessOrder[self.businessOffsets[code]:self.businessOffsets[code + 1]]
+
+    def businessTfidfIndex(self, code):
+        # BusinessTfidfIndex over the reviews of a business, keyed by store row
+        rows = self.businessRows(code)
+        return BusinessTfidfIndex.fromReviews(rows, [self.store.terms[i] for i in rows], [self.store.reviewIds[i] for i in rows])
+
+class StoredReviewText(object):
+    # ReviewText attributes read from a ReviewStore row
+    __slots__ = ['rawText'] + ReviewText.analysisFields
+
+    def __init__(self, store, i):
+        self.rawText = None
+        self.processedText = store.terms[i] if store.terms is not None else ''
+        for name, typecode in TEXT_COLUMNS:
+            value = store.columns[name][i]
+            # readability scores that were never computed are left at int 0 by ReviewText
+            setattr(self, name, float(value) if (typecode == 'd' and value != 0) else int(value))
+
+class StoredReview(object):
+    # Review attributes read from a ReviewStore row
+    __slots__ = ['reviewId', 'userId', 'businessId', 'businessCategory', 'stars', 'age', 'funny', 'useful', 'cool', 'reviewText']
+
+    def __init__(self, store, i):
+        columns = store.columns
+        self.reviewId = store.reviewIds[i]
+        self.userId = store.userIds[columns['userCode'][i]]
+        self.businessId = store.businessIds[columns['businessCode'][i]]
+        self.businessCategory = int(columns['category'][i])
+        self.stars = float(columns['stars'][i])
+        self.age = int(columns['age'][i])
+        hasVotes = columns['hasVotes'][i] == 1
+        self.funny = int(columns['funny'][i]) if hasVotes else None
+        self.useful = int(columns['useful'][i]) if hasVotes else None
+        self.cool = int(columns['cool'][i]) if hasVotes else None
+        self.reviewText = StoredReviewText(store, i)
+
+class StoredUserProfile(object):
+    __slots__ = ['funny', 'useful', 'cool', 'averageStars', 'reviewCount']
+
+    def __init__(self, view, code):
+        profiles = view.store.userProfiles
+        hasVotes = view.userHasVotes[code]
+        self.funny = int(profiles['funny'][code]) if hasVotes else None
+        self.useful = int(profiles['useful'][code]) if hasVotes else None
+        self.cool = int(profiles['cool'][code]) if hasVotes else None
+        self.averageStars = float(profiles['averageStars'][code])
+        self.reviewCount = int(profiles['reviewCount'][code])
+
+class StoredBusinessProfile(object):
+    __slots__ = ['closed', 'stars', 'reviewCount', 'category']
+
+    def __init__(self, view, code):
+        profiles = view.store.businessProfiles
+        self.closed = int(profiles['closed'][code])
+        self.stars = float(profiles['stars'][code])
+        self.reviewCount = int(profiles['reviewCount'][code])
+        self.category = int(profiles['category'][code])
+
+class StoredUser(object):
+    # User attributes for one user of a ReviewStoreView; reviews are materialized from the CSR index
+    def __init__(self, view, code):
+        self.userId = view.store.userIds[code]
+        self.profile = StoredUserProfile(view, code) if view.store.userProfiles['hasProfile'][code] else None
+        self.reviews = dict((view.store.reviewIds[i], StoredReview(view.store, i)) for i in view.userRows(code))
+
+class StoredBusiness(Business):
+    # Business for one business of a ReviewStoreView; reviews are materialized from the CSR index
+    __slots__ = [ ]
+
+    def __init__(self, view, code):
+        self.businessId = view.store.businessIds[code]
+        self.profile = StoredBusinessProfile(view, code) if view.store.businessProfiles['hasProfile'][code] else None
+        self.reviews = dict((view.store.reviewIds[i], StoredReview(view.store, i)) for i in view.businessRows(code))
+        self.tfidfIndex = None
+
+class StoredReviews(object):
+    # reviewId -> StoredReview over a view
+    def __init__(self, view):
+        self.view = view
+
+    def __getitem__(self, reviewId):
+        return StoredReview(self.view.store, self.view.store.reviewIndex[reviewId])
+
+class StoredGroups(object):
+    # id -> StoredUser/StoredBusiness over a view; the most recently used groups are kept, since reviews are
+    # usually written grouped by user
+    cacheSize = 64
+
+    def __init__(self, view, ids, groupClass):
+        self.view = view
+        self.codes = dict((id, code) for code, id in enumerate(ids))
+        self.groupClass = groupClass
+        self.cache = { }
+
+    def __getitem__(self, id):
+        group = self.cache.get(id)
+        if group is None:
+            if len(self.cache) >= self.cacheSize:
+                self.cache.clear()
+            group = self.groupClass(self.view, self.codes[id])
+            self.cache[id] = group
+        return group
+
+class StoredUsers(StoredGroups):
+    def __init__(self, view):
+        StoredGroups.__init__(self, view, view.store.userIds, StoredUser)
+
+class StoredBusinesses(StoredGroups):
+    def __init__(self, view):
+        StoredGroups.__init__(self, view, view.store.businessIds, StoredBusiness)
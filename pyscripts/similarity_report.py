@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+import time
+import argparse
+import numpy
+import features
+from data_objects import BusinessTfidfIndex, configureSimilarity
+from feature_registry import configureFeatures
+from pos_tagging import TAGGERS, configureTagger
+
+SAMPLE_SIZES = [100, 300, 1000]
+
+def businessRows(store):
+    # (training rows, test rows) of the store's reviews of each business
+    codes = store.columns['businessCode']
+    isTest = store.columns['isTest'] == 1
+    order = numpy.argsort(codes, kind='mergesort')
+    starts = numpy.flatnonzero(numpy.diff(numpy.concatenate([[-1], codes[order]])))
+    return [(rows[~isTest[rows]], rows[isTest[rows]]) for rows in numpy.split(order, starts[1:]) if len(rows) > 0]
+
+def scoreBusinesses(store, groups, sampleSize):
+    # seconds to index the training reviews of each business with their similarities, exactly or on a sample, and
+    # the similarities of its held-out test reviews to that index
+    configureSimilarity(sampleSize)
+    start = time.time()
+    indexes = [ ]
+    for trainingRows, testRows in groups:
+        index = BusinessTfidfIndex.fromReviews(trainingRows, [store.terms[i] for i in trainingRows], \
+                                               [store.reviewIds[i] for i in trainingRows])
+        index.similaritiesFor(trainingRows)
+        indexes.append(index)
+    seconds = time.time() - start
+    heldOut = [index.similaritiesOf([store.terms[i] for i in testRows]) for index, (trainingRows, testRows) in zip(indexes, groups)]
+    return (seconds, numpy.concatenate(heldOut) if len(heldOut) > 0 else numpy.zeros(0))
+
+def report(store, sampleSizes):
+    # for each sample size, the time saved on the businesses with more training reviews than it and the error of
+    # similarityToOtherReviews of their held-out test reviews against the sample
+    allGroups = businessRows(store)
+    for sampleSize in sampleSizes:
+        groups = [(trainingRows, testRows) for trainingRows, testRows in allGroups if len(trainingRows) > sampleSize]
+        nreviews = sum(len(trainingRows) for trainingRows, testRows in groups)
+        (exactSeconds, exact) = scoreBusinesses(store, groups, None)
+        (sampledSeconds, sampled) = scoreBusinesses(store, groups, sampleSize)
+        line = 'sample %d: %d businesses with more reviews, %d reviews indexed in %.2fs exact, %.2fs sampled (%.1fx)' % \
+               (sampleSize, len(groups), nreviews, exactSeconds, sampledSeconds, exactSeconds/sampledSeconds if sampledSeconds > 0 else 0.0)
+        scored = ~numpy.isnan(exact) & ~numpy.isnan(sampled)
+        errors = numpy.abs(sampled[scored] - exact[scored])
+        if len(errors) > 0:
+            line = line + '; %d held-out reviews: mean abs error %.4f (%.1f%% of the mean), 95th percentile %.4f, max %.4f' % \
+                   (len(errors), errors.mean(), 100.0*errors.mean()/max(numpy.abs(exact[scored]).mean(), 1e-12), \
+                    numpy.percentile(errors, 95), errors.max())
+        print line
+    configureSimilarity(None)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the sampled similarityToOtherReviews of features.py --similarity-sample ' + \
+                                                 'with the exact one: time saved on the popular businesses, and error on their ' + \
+                                                 'test reviews held out of the index.')
+    parser.add_argument('--data-dir', default=features.DATA_DIR, help='directory with the Yelp json data and business_clusters.csv')
+    parser.add_argument('--sample-sizes', default=','.join(str(n) for n in SAMPLE_SIZES), metavar='N,...', \
+                        help='comma separated --similarity-sample sizes to compare')
+    parser.add_argument('--workers', type=int, default=1, help='processes used for review text analysis (1 = serial)')
+    parser.add_argument('--chunk-size', type=int, default=features.CHUNK_SIZE, help='reviews per text analysis task')
+    parser.add_argument('--text-cache', default=None, help='sqlite file caching review text analysis between runs')
+    parser.add_argument('--pos-tagger', choices=TAGGERS, default='nltk')
+    parser.add_argument('--pos-lexicon', default=None, help='lexicon file of the lexicon tagger')
+    args = parser.parse_args()
+    try:
+        sampleSizes = [int(n) for n in args.sample_sizes.split(',')]
+    except ValueError:
+        parser.error('--sample-sizes takes comma separated numbers')
+    if min(sampleSizes) < 1:
+        parser.error('--sample-sizes must be at least 1')
+    features.setDataDir(args.data_dir)
+    configureTagger(args.pos_tagger, args.pos_lexicon)
+    configureFeatures(['similarityToOtherReviews'])
+    store = features.loadReviewStore(features.loadBusinessCategories(), args.workers, args.chunk_size, args.text_cache)
+    report(store, sampleSizes)
+
+if __name__ == '__main__':
+    main()
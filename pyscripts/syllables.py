@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import array
+import itertools
+import argparse
+
+# in the repository's data directory, wherever the scripts are run from
+SYLLABLE_TABLE_FILENAME = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'cmudict_syllables.dat'))
+SYLLABLE_TABLE_VERSION = 1 # bump whenever the table layout or the counting changes
+syllableCounts = None # word -> syllables, loaded by syllables() on first use
+
+def cmudictSyllableCounts():
+    # word -> syllables of its first cmudict pronunciation, ie its phonemes carrying a stress digit
+    from nltk.corpus import cmudict
+    counts = { }
+    for word, pronunciations in cmudict.dict().iteritems():
+        counts[word] = len([phoneme for phoneme in pronunciations[0] if phoneme[-1].isdigit()])
+    return counts
+
+def writeSyllableTable(counts, filename):
+    # a header line, the sorted words joined by newlines, then their counts as one signed byte each. The table
+    # is written to a temporary file first so that concurrent readers never see a partial one.
+    words = sorted(counts)
+    wordData = '\n'.join(words)
+    temporaryFilename = '%s.%d.tmp' % (filename, os.getpid())
+    f = open(temporaryFilename, 'wb')
+    f.write('%d %d %d\n' % (SYLLABLE_TABLE_VERSION, len(words), len(wordData)))
+    f.write(wordData)
+    f.write(array.array('b', [counts[word] for word in words]).tostring())
+    f.close()
+    os.rename(temporaryFilename, filename)
+
+def readSyllableTable(filename):
+    # word -> syllables from a table file; None if it is missing, damaged or of another version
+    try:
+        f = open(filename, 'rb')
+    except IOError:
+        return None
+    header = f.readline().split()
+    if len(header) != 3 or int(header[0]) != SYLLABLE_TABLE_VERSION:
+        f.close()
+        return None
+    (nwords, nbytes) = (int(header[1]), int(header[2]))
+    words = f.read(nbytes).split('\n') if nwords > 0 else [ ]
+    counts = array.array('b')
+    counts.fromstring(f.read(nwords))
+    f.close()
+    if len(words) != nwords or len(counts) != nwords:
+        return None
+    return dict(itertools.izip(words, counts))
+
+def loadSyllableCounts(filename=SYLLABLE_TABLE_FILENAME):
+    # reads the precompiled table, building it from cmudict (slow) and saving it if it is not there yet
+    counts = readSyllableTable(filename)
+    if counts is None:
+        counts = cmudictSyllableCounts()
+        try:
+            writeSyllableTable(counts, filename)
+        except (IOError, OSError) as e:
+            sys.stderr.write('warning: could not save the syllable table to %s, cmudict is read again next time: %s\n' % (filename, e))
+    return counts
+
+def syllables(word):
+    # syllables of the first cmudict pronunciation of word, -1 if cmudict does not have the word
+    global syllableCounts
+    if syllableCounts is None:
+        syllableCounts = loadSyllableCounts()
+    return syllableCounts.get(word, -1)
+
+def main():
+    parser = argparse.ArgumentParser(description='Precompile the cmudict syllable table used by ReviewText.')
+    parser.add_argument('filename', nargs='?', default=SYLLABLE_TABLE_FILENAME)
+    args = parser.parse_args()
+    writeSyllableTable(cmudictSyllableCounts(), args.filename)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+import os
+import json
+import argparse
+import numpy
+from datetime import datetime, timedelta
+
+# a common-word vocabulary for review text; rarer words are made up to give the vocabulary a long tail
+COMMON_WORDS = ('the and a to i was it of for is in we but they food this my that with place good so great had were you ' + \
+                'not on are have be our at service very all just there like here one time what out me if back would ' + \
+                'really when get go restaurant their order us an about menu or some only he she them which nice came ' + \
+                'more also been friendly ordered can no up delicious pizza chicken best little staff from always try ' + \
+                'will because definitely love first fresh said well even amazing better bar table sauce wait got ' + \
+                'never make salad lunch coffee dinner closed location price prices experience recommend people went ' + \
+                'night come taste pretty burger sandwich minutes cheese side fries hot dish atmosphere nothing beer ' + \
+                'everything area again small favorite rice happy bad sweet meal room drinks friends took beautiful ' + \
+                'wonderful terrible horrible interesting slow expensive cheap decent excellent disappointed').split()
+STARS_PROBABILITIES = [0.07, 0.09, 0.15, 0.33, 0.36] # 1 to 5 stars
+CATEGORY_NAMES = ['Restaurants', 'Food', 'Bars', 'Nightlife', 'Mexican', 'Pizza', 'Italian', 'Chinese', 'Thai', 'Coffee & Tea', \
+                  'Shopping', 'Beauty & Spas', 'Automotive', 'Hotels & Travel', 'Active Life', 'Home Services', 'Pets', 'Sushi Bars']
+SENTENCE_ENDS = ['. ', '. ', '. ', '! ', '? ', '.\n\n', '!! ', '... ', ' . ', '\n']
+FIRST_DATE = datetime.strptime('2005-01-01', '%Y-%m-%d')
+TRAINING_DATE = datetime.strptime('2013-01-19', '%Y-%m-%d')
+TEST_DATE = datetime.strptime('2013-03-12', '%Y-%m-%d')
+
+def zipfProbabilities(n, exponent):
+    # probability of rank 1..n proportional to 1/rank^exponent; exponent 0 is uniform
+    weights = 1.0/numpy.arange(1, n + 1)**exponent
+    return weights/weights.sum()
+
+def makeVocabulary(size, rng):
+    words = list(COMMON_WORDS)
+    words.append(u'caf\xe9')
+    letters = list('abcdefghilmnoprstuy')
+    while len(words) < size:
+        words.append(''.join(rng.choice(letters, rng.randint(3, 11))))
+    return words
+
+class SyntheticYelp(object):
+    # Yelp-shaped review, user and business records with Zipf-distributed reviews per user and per business
+    def __init__(self, nreviews, nusers=None, nbusinesses=None, userSkew=1.0, businessSkew=0.8, testFraction=0.2, \
+                 nclusters=10, vocabularySize=5000, seed=1):
+        self.rng = numpy.random.RandomState(seed)
+        self.nreviews = nreviews
+        self.ntest = int(nreviews*testFraction)
+        self.nusers = nusers if nusers is not None else max(nreviews//5, 1)
+        self.nbusinesses = nbusinesses if nbusinesses is not None else max(nreviews//20, 1)
+        self.userProbabilities = zipfProbabilities(self.nusers, userSkew)
+        self.businessProbabilities = zipfProbabilities(self.nbusinesses, businessSkew)
+        self.vocabulary = makeVocabulary(vocabularySize, self.rng)
+        self.wordCdf = numpy.cumsum(zipfProbabilities(len(self.vocabulary), 1.0))
+        self.nclusters = nclusters
+
+    def text(self):
+        words = self.vocabulary
+        sentences = [ ]
+        for k in xrange(self.rng.randint(1, 15)):
+            wordIndices = numpy.minimum(numpy.searchsorted(self.wordCdf, self.rng.random_sample(self.rng.randint(3, 25))), len(words) - 1)
+            sentence = ' '.join(words[i] for i in wordIndices)
+            if self.rng.random_sample() < 0.05:
+                sentence = '%d. %s' % (k + 1, sentence)
+            if self.rng.random_sample() < 0.05:
+                sentence = '"%s"' % sentence
+            sentences.append(sentence[0].upper() + sentence[1:] + SENTENCE_ENDS[self.rng.randint(len(SENTENCE_ENDS))])
+        return ''.join(sentences).strip()
+
+    def reviews(self, isTest):
+        # review records of the training or test set; test reviews have no votes
+        n = self.ntest if isTest else self.nreviews - self.ntest
+        userIndices = self.rng.choice(self.nusers, n, p=self.userProbabilities)
+        businessIndices = self.rng.choice(self.nbusinesses, n, p=self.businessProbabilities)
+        (first, last) = (TRAINING_DATE, TEST_DATE) if isTest else (FIRST_DATE, TRAINING_DATE)
+        for i in xrange(n):
+            text = self.text()
+            data = {'review_id': '%s%08d' % ('te' if isTest else 'tr', i), 'user_id': 'u%08d' % userIndices[i], \
+                    'business_id': 'b%08d' % businessIndices[i], 'stars': int(self.rng.choice(5, p=STARS_PROBABILITIES)) + 1, \
+                    'date': (first + timedelta(days=self.rng.randint((last - first).days))).strftime('%Y-%m-%d'), \
+                    'text': text, 'type': 'review'}
+            if not isTest:
+                useful = self.rng.poisson(0.5 + len(text)/1000.0)
+                data['votes'] = {'funny': int(self.rng.poisson(0.3*useful)), 'useful': int(useful), 'cool': int(self.rng.poisson(0.4*useful))}
+            yield data
+
+    def users(self, isTest):
+        # training users have votes; every third user has no user record at all, as in the real dumps
+        for i in xrange(self.nusers):
+            if i % 3 == 2 or (i % 3 == 1) != isTest:
+                continue
+            reviewCount = int(self.rng.zipf(1.8)) + 1
+            data = {'user_id': 'u%08d' % i, 'name': 'User %d' % i, 'review_count': reviewCount, \
+                    'average_stars': round(self.rng.uniform(1.0, 5.0), 2), 'type': 'user'}
+            if not isTest:
+                data['votes'] = dict((vote, int(self.rng.poisson(reviewCount))) for vote in ['funny', 'useful', 'cool'])
+            yield data
+
+    def businesses(self, isTest):
+        for i in xrange(self.nbusinesses):
+            if (i % 4 == 3) != isTest:
+                continue
+            categories = [CATEGORY_NAMES[c] for c in self.rng.choice(len(CATEGORY_NAMES), self.rng.randint(1, 4), replace=False)]
+            yield {'business_id': 'b%08d' % i, 'name': 'Business %d' % i, 'full_address': '%d Main St\nPhoenix, AZ 85004' % i, \
+                   'city': 'Phoenix', 'state': 'AZ', 'latitude': 33.4 + self.rng.random_sample(), \
+                   'longitude': -112.1 + self.rng.random_sample(), 'neighborhoods': [ ], 'categories': categories, \
+                   'open': bool(self.rng.random_sample() < 0.9), 'stars': self.rng.randint(2, 11)/2.0, \
+                   'review_count': int(self.rng.zipf(1.6)) + 2, 'type': 'business'}
+
+    def clusters(self):
+        # business id -> category cluster (1-based), as in business_clusters.csv
+        return [('b%08d' % i, int(self.rng.randint(self.nclusters)) + 1) for i in xrange(self.nbusinesses)]
+
+def writeJson(records, filename):
+    f = open(filename, 'w')
+    for data in records:
+        f.write(json.dumps(data) + '\n')
+    f.close()
+
+def generate(dataDir, nreviews, **options):
+    # writes a data directory laid out like ../data/ for features.py --data-dir
+    yelp = SyntheticYelp(nreviews, **options)
+    for split, isTest in [('training', False), ('test', True)]:
+        jsonDir = os.path.join(dataDir, split, 'json')
+        if not os.path.isdir(jsonDir):
+            os.makedirs(jsonDir)
+        writeJson(yelp.reviews(isTest), os.path.join(jsonDir, 'yelp_%s_set_review.json' % split))
+        writeJson(yelp.users(isTest), os.path.join(jsonDir, 'yelp_%s_set_user.json' % split))
+        writeJson(yelp.businesses(isTest), os.path.join(jsonDir, 'yelp_%s_set_business.json' % split))
+    f = open(os.path.join(dataDir, 'business_clusters.csv'), 'w')
+    f.write('id,category\n')
+    for businessId, cluster in yelp.clusters():
+        f.write('%s,%d\n' % (businessId, cluster))
+    f.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Write synthetic Yelp-shaped json data and business_clusters.csv.')
+    parser.add_argument('data_dir', help='output directory, used as features.py --data-dir')
+    parser.add_argument('--reviews', type=int, default=10000, help='training plus test reviews')
+    parser.add_argument('--users', type=int, default=None, help='users (default reviews/5)')
+    parser.add_argument('--businesses', type=int, default=None, help='businesses (default reviews/20)')
+    parser.add_argument('--user-skew', type=float, default=1.0, help='Zipf exponent of reviews per user (0 = uniform)')
+    parser.add_argument('--business-skew', type=float, default=0.8, help='Zipf exponent of reviews per business (0 = uniform)')
+    parser.add_argument('--test-fraction', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    generate(args.data_dir, args.reviews, nusers=args.users, nbusinesses=args.businesses, userSkew=args.user_skew, \
+             businessSkew=args.business_skew, testFraction=args.test_fraction, seed=args.seed)
+
+if __name__ == '__main__':
+    main()
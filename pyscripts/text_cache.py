@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+import sqlite3
+import hashlib
+import marshal
+import zlib
+from data_objects import ReviewText, TEXT_ANALYZER_VERSION
+from pos_tagging import taggerKey
+
+COMMIT_INTERVAL = 10000 # cache writes between sqlite commits
+
+class ReviewTextCache(object):
+    # content-addressed sqlite cache of ReviewText.getAnalysis() tuples, keyed by a hash of the raw text,
+    # the analysis options, the analyzer version and the pos tagger. It may be opened in one thread and used in
+    # another (the analysis thread of a pipeline), though by one thread at a time.
+    def __init__(self, filename):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS analysis (key BLOB PRIMARY KEY, value BLOB NOT NULL)')
+        self.uncommitted = 0
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, text, posAnalysis=True, readabilityAnalysis=True):
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        h = hashlib.sha1('%d:%d:%d:' % (TEXT_ANALYZER_VERSION, int(posAnalysis), int(readabilityAnalysis)))
+        if posAnalysis and taggerKey() != '':
+            h.update(taggerKey() + ':')
+        h.update(text)
+        return sqlite3.Binary(h.digest())
+
+    def get(self, text, posAnalysis=True, readabilityAnalysis=True):
+        row = self.connection.execute('SELECT value FROM analysis WHERE key = ?', \
+                                      (self.key(text, posAnalysis, readabilityAnalysis),)).fetchone()
+        if row is None:
+            self.misses = self.misses + 1
+            return None
+        self.hits = self.hits + 1
+        return marshal.loads(zlib.decompress(str(row[0])))
+
+    def put(self, text, analysis, posAnalysis=True, readabilityAnalysis=True):
+        value = sqlite3.Binary(zlib.compress(marshal.dumps(tuple(analysis))))
+        self.connection.execute('INSERT OR REPLACE INTO analysis (key, value) VALUES (?, ?)', \
+                                (self.key(text, posAnalysis, readabilityAnalysis), value))
+        self.uncommitted = self.uncommitted + 1
+        if self.uncommitted >= COMMIT_INTERVAL:
+            self.commit()
+
+    def reviewText(self, text, posAnalysis=True, readabilityAnalysis=True):
+        # cached ReviewText for text, analyzing and storing it on a miss
+        analysis = self.get(text, posAnalysis, readabilityAnalysis)
+        if analysis is not None:
+            return ReviewText.fromAnalysis(text, analysis)
+        reviewText = ReviewText(text, posAnalysis, readabilityAnalysis)
+        self.put(text, reviewText.getAnalysis(), posAnalysis, readabilityAnalysis)
+        return reviewText
+
+    def commit(self):
+        self.connection.commit()
+        self.uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self.connection.close()
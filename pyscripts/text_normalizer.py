@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+import re
+import string
+import time
+import argparse
+from json_ingest import JsonFileReader
+
+# the steps of referencePreprocessText folded into a few combined patterns, applied in the same order
+PS_PATTERN = re.compile(r'p\.s\.|p\. s\.')
+SPACES_PATTERN = re.compile(r' +(?=[\n.,!?])|(?<= ) +') # spaces before punctuation/newline, and repeated spaces
+STOP_NEWLINES_PATTERN = re.compile(r'(?<=[.!:?])\n+') # newlines after a sentence stop or colon become a space
+NEWLINES_PATTERN = re.compile(r'\n+') # other newlines become a stop
+DIGIT_STOP_PATTERN = re.compile(r'[0-9]\.')
+REPEATED_STOP_PATTERNS = [(stop, stop + stop, re.compile(re.escape(stop) + '+')) for stop in '.!?']
+REPEATED_SPACES_PATTERN = re.compile(r'  +')
+PUNCTUATION_PATTERN = re.compile('[' + re.escape(string.punctuation) + ']')
+SPACED_PUNCTUATION = [' \n', ' .', ' ,', ' !', ' ?']
+NONCHARACTERS = string.punctuation + ' '
+TERMINATORS = '.!?'
+
+def preprocessText(text):
+    # same result as referencePreprocessText; patterns are skipped when a substring test shows they cannot match
+    text = text.replace('\"', ' ')
+    if 'p.' in text:
+        text = PS_PATTERN.sub('ps', text)
+    if '  ' in text:
+        text = SPACES_PATTERN.sub('', text)
+    else:
+        # single spaces only, so only the space right before punctuation/newline goes
+        for spaced in SPACED_PUNCTUATION:
+            if spaced in text:
+                text = text.replace(spaced, spaced[1])
+    if '\n' in text:
+        text = STOP_NEWLINES_PATTERN.sub(' ', text)
+        text = NEWLINES_PATTERN.sub('.', text)
+    text = DIGIT_STOP_PATTERN.sub(' ', text)
+    text = text.replace('-', ' ').replace('*', ' ')
+    for stop, repeated, pattern in REPEATED_STOP_PATTERNS:
+        # a run of stops becomes a single stop and a space
+        text = pattern.sub(stop + ' ', text) if repeated in text else text.replace(stop, stop + ' ')
+    text = REPEATED_SPACES_PATTERN.sub(' ', text)
+    return text.encode('ascii', 'ignore').lower().strip()
+
+def normalizeText(text):
+    # (processedText, ncharacters, nwords, nsentences, npunctuation, containsClosed) as computed by ReviewText
+    processedText = preprocessText(text)
+    ncharacters = len(processedText.translate(None, NONCHARACTERS))
+    nwords = len(processedText.split())
+    nsentences = 0
+    if len(processedText) > 0:
+        # processedText is stripped, so its last character is the last one once spaces are removed
+        nsentences = processedText.count('.') + processedText.count('!') + processedText.count('?')
+        if processedText[-1] not in TERMINATORS:
+            nsentences = nsentences + 1
+    npunctuation = len(text) - len(PUNCTUATION_PATTERN.sub('', text))
+    containsClosed = 1 if 'closed' in processedText else 0
+    return (processedText, ncharacters, nwords, nsentences, npunctuation, containsClosed)
+
+def normalizeTexts(texts):
+    return [normalizeText(text) for text in texts]
+
+def referencePreprocessText(text):
+    # the original regex cascade of ReviewText.preprocessText, kept to check preprocessText against
+    # remove quotation marks
+    text = text.replace('\"', ' ')
+    # deal with PS, p.s., p. s.
+    text = re.sub('p\.s\.', 'ps', text)
+    text = re.sub('p\. s\.', 'ps', text)
+    # remove repeated spaces
+    text = re.sub(' +', ' ', text)
+    # remove spaces before punctuation/newline
+    text = re.sub(' \n', '\n', text)
+    text = re.sub(' \.', '.', text)
+    text = re.sub(' ,', ',', text)
+    text = re.sub(' !', '!', text)
+    text = re.sub(' \?', '?', text)
+    # remove repeated newlines
+    text = re.sub('\n+', '\n', text)
+    # remove newlines
+    text = re.sub('\.\n', '. ', text)
+    text = re.sub('!\n', '! ', text)
+    text = re.sub(':\n', ': ', text)
+    text = re.sub('\?\n', '? ', text)
+    text = text.replace('\n', '.')
+    # remove digits eg 1., 2., and special characters
+    text = re.sub('[0-9]\.', ' ', text)
+    text = text.replace('-', ' ')
+    text = text.replace('*', ' ')
+    # remove repeated puntuation
+    text = re.sub('\.+', '. ', text)
+    text = re.sub('!+', '! ', text)
+    text = re.sub('\?+', '? ', text)
+    # remove repeated spaces
+    text = re.sub(' +', ' ', text)
+    text = text.encode('ascii', 'ignore').lower().strip()
+    return text
+
+def referenceNormalizeText(text):
+    # normalizeText as ReviewText computed it before
+    processedText = referencePreprocessText(text)
+    ncharacters = len(processedText.translate(string.maketrans("", ""), string.punctuation).replace(' ', ''))
+    nwords = len(processedText.split())
+    nsentences = 0
+    if len(processedText) > 0:
+        unspaced = processedText.replace(' ', '')
+        nsentences = len([x for x in unspaced if x in TERMINATORS])
+        if unspaced[-1] not in TERMINATORS:
+            nsentences = nsentences + 1
+    npunctuation = len([x for x in text if x in string.punctuation])
+    containsClosed = 1 if processedText.find('closed') >= 0 else 0
+    return (processedText, ncharacters, nwords, nsentences, npunctuation, containsClosed)
+
+def main():
+    # checks normalizeText against the original cascade on the texts of review json files (the golden corpus)
+    parser = argparse.ArgumentParser(description='Compare normalizeText with the original ReviewText preprocessing.')
+    parser.add_argument('filenames', nargs='+', help='line-delimited review json files')
+    args = parser.parse_args()
+    texts = [data['text'] for filename in args.filenames for data in JsonFileReader(filename)]
+    start = time.time()
+    expected = [referenceNormalizeText(text) for text in texts]
+    referenceSeconds = time.time() - start
+    start = time.time()
+    normalized = normalizeTexts(texts)
+    seconds = time.time() - start
+    mismatches = [i for i in xrange(len(texts)) if normalized[i] != expected[i]]
+    print '%d texts, %d mismatches; reference %.2fs, normalizeText %.2fs' % (len(texts), len(mismatches), referenceSeconds, seconds)
+    for i in mismatches[:10]:
+        print repr(texts[i])
+
+if __name__ == '__main__':
+    main()